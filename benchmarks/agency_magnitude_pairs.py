@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Benchmark of eqcat.catalogue_query_tools.get_agency_magnitude_pairs on a
+synthetic catalogue. Compares the merge-based implementation with the
+previous implementation, which looked up the magnitudes of the first pair
+for each magnitude of the second pair, and checks that both return the same
+magnitudes
+
+Usage: python benchmarks/agency_magnitude_pairs.py [number_magnitudes]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from eqcat.catalogue_query_tools import (CatalogueDB,
+                                         get_agency_magnitude_pairs)
+
+# Agency and magnitude type combinations of the synthetic magnitudes, with
+# their relative frequency
+PAIRS = [("ISC", "mb", 0.3), ("NEIC", "mb", 0.2), ("ISC", "MS", 0.15),
+         ("GCMT", "Mw", 0.1), ("NEIC", "Mw", 0.1), ("MOS", "mb", 0.15)]
+
+
+def build_catalogue(number_magnitudes, magnitudes_per_event=4, seed=42):
+    """
+    Returns a synthetic catalogue (as instance of CatalogueDB) with the
+    given number of magnitudes, reported by one to three origins per event
+    """
+    rng = np.random.RandomState(seed)
+    number_events = number_magnitudes // magnitudes_per_event
+    event_ids = np.array(["%d" % (600000 + i) for i in range(number_events)],
+                         dtype=object)
+    mag_events = np.sort(rng.randint(0, number_events, number_magnitudes))
+    origin_numbers = rng.randint(0, 3, number_magnitudes)
+    pair_index = rng.choice(len(PAIRS), number_magnitudes,
+                            p=[pair[2] for pair in PAIRS])
+    origin_ids = np.array(["%d" % (1000000 + 3 * event + number)
+                           for event, number in zip(mag_events,
+                                                    origin_numbers)],
+                          dtype=object)
+    magnitudes = pd.DataFrame({
+        "eventID": event_ids[mag_events],
+        "originID": origin_ids,
+        "magnitudeID": np.array(["%d" % i for i in range(number_magnitudes)],
+                                dtype=object),
+        "value": np.round(rng.uniform(3.0, 8.0, number_magnitudes), 1),
+        "sigma": np.round(rng.uniform(0.05, 0.3, number_magnitudes), 2),
+        "magType": np.array([PAIRS[i][1] for i in pair_index], dtype=object),
+        "magAgency": np.array([PAIRS[i][0] for i in pair_index],
+                              dtype=object)},
+        columns=["eventID", "originID", "magnitudeID", "value", "sigma",
+                 "magType", "magAgency"])
+    origins = magnitudes[["eventID", "originID"]].drop_duplicates()
+    origins = origins.assign(Agency="ISC", depth=10.0).reset_index(drop=True)
+    catalogue = CatalogueDB()
+    catalogue.origins = origins
+    catalogue.magnitudes = magnitudes
+    _ = catalogue._get_number_origins_magnitudes()
+    return catalogue
+
+
+def previous_agency_magnitude_pairs(catalogue, pair1, pair2):
+    """
+    Previous implementation of get_agency_magnitude_pairs (magnitudes only)
+    """
+    mags = catalogue.magnitudes
+    select_cat1 = mags[(mags["magAgency"] == pair1[0]) &
+                       (mags["magType"] == pair1[1])]
+    select_cat2 = mags[(mags["magAgency"] == pair2[0]) &
+                       (mags["magType"] == pair2[1])]
+    common_catalogue = select_cat2[
+        select_cat2.eventID.isin(select_cat1.eventID)]
+    cat1_groups = select_cat1.groupby("eventID")
+    mag1 = []
+    mag2 = []
+    for row in list(common_catalogue.iterrows()):
+        mag2.append(row[1].value)
+        event1 = cat1_groups.get_group(row[1].eventID)
+        if len(event1) > 1:
+            event1 = event1.iloc[np.argmax(event1["originID"].values)]
+            mag1.append(event1.value.tolist())
+        else:
+            mag1.extend(event1.value.tolist())
+    return np.array(mag1), np.array(mag2)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        number_magnitudes = int(sys.argv[1])
+    else:
+        number_magnitudes = 1000000
+    catalogue = build_catalogue(number_magnitudes)
+    pair1 = ("ISC", "mb")
+    pair2 = ("GCMT", "Mw")
+    print "Catalogue of %d magnitudes, pairs %s and %s" % (
+        number_magnitudes, pair1, pair2)
+    start = time.time()
+    data, _ = get_agency_magnitude_pairs(catalogue, pair1, pair2)
+    new_time = time.time() - start
+    start = time.time()
+    mag1, mag2 = previous_agency_magnitude_pairs(catalogue, pair1, pair2)
+    previous_time = time.time() - start
+    print "Merge-based: %.2f s" % new_time
+    print "Previous:    %.2f s" % previous_time
+    print "Speed-up:    %.1f x" % (previous_time / new_time)
+    print "Same magnitudes: %s" % (
+        np.array_equal(data["mb(ISC)"], mag1) and
+        np.array_equal(data["Mw(GCMT)"], mag2))
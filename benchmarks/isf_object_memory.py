@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Benchmark of the per-object memory of the ISF catalogue classes. Compares the
+slotted records of eqcat.isf_catalogue with equivalent records holding the
+same attributes in a per-instance dictionary (the previous layout)
+
+Usage: python benchmarks/isf_object_memory.py [number_events]
+"""
+import gc
+import sys
+import types
+import datetime
+from eqcat.isf_catalogue import (Magnitude, Location, Origin, OriginMetadata,
+                                 Event, _CompactRecord)
+
+
+class DictRecord(object):
+    """
+    Holds the attributes of a compact record in a per-instance dictionary
+    """
+    def __init__(self, record, memo):
+        memo[id(record)] = self
+        for key, value in record.__getstate__().items():
+            setattr(self, key, to_dict_record(value, memo))
+
+
+def to_dict_record(value, memo):
+    """
+    Converts a compact record (or a list of them) to the dictionary layout.
+    Each record is converted once, recorded in the memo by its id, so that
+    objects shared by several records (e.g. the magnitudes referenced by
+    both an event and an origin) are also shared in the copy
+    """
+    if isinstance(value, list):
+        return [to_dict_record(val, memo) for val in value]
+    if not isinstance(value, _CompactRecord):
+        return value
+    if not id(value) in memo:
+        if isinstance(value, OriginMetadata):
+            memo[id(value)] = dict(value.items())
+        else:
+            DictRecord(value, memo)
+    return memo[id(value)]
+
+
+def shallow_size(obj):
+    """
+    Returns the size in bytes of the object and of its instance dictionary,
+    if one has been created
+    """
+    size = sys.getsizeof(obj)
+    for referent in gc.get_referents(obj):
+        if isinstance(referent, dict):
+            size += sys.getsizeof(referent)
+    return size
+
+
+def deep_size(objects):
+    """
+    Returns the total size in bytes of the objects and everything they refer
+    to, excluding classes and modules
+    """
+    seen = set()
+    size = 0
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return size
+
+
+def build_events(number_events):
+    """
+    Builds a set of synthetic events with two origins and three magnitudes
+    """
+    events = []
+    for i in range(number_events):
+        origins = []
+        magnitudes = []
+        for j in range(2):
+            origin_id = str(1000000 + 2 * i + j)
+            metadata = OriginMetadata(
+                Nphases=20 + j, Nstations=15, AzimuthGap=90.0, minDist=1.0,
+                maxDist=50.0, FixedTime="", DepthSolution="", AnalysisType="m",
+                LocationMethod="i", EventType="ke")
+            location = Location(origin_id, 10.0 + 0.001 * i, 40.0, 10.0,
+                                5.0, 4.0, 30.0, 2.0)
+            origin = Origin(origin_id,
+                            datetime.date(2000, 1, 1 + (i % 28)),
+                            datetime.time(12, i % 60, 30, 100000),
+                            location, "ISC", is_prime=(j == 0),
+                            time_error=0.5, time_rms=1.1, metadata=metadata)
+            for scale in ["mb", "MS"][:2 - j + 1]:
+                magnitude = Magnitude(str(i), origin_id, 4.5, "ISC", scale,
+                                      0.1, 20)
+                origin.magnitudes.append(magnitude)
+                magnitudes.append(magnitude)
+            origins.append(origin)
+        events.append(Event(str(i), origins, magnitudes, "ke"))
+    return events
+
+
+def to_dict_records(events):
+    """
+    Returns copies of the events with the attributes held in dictionaries,
+    with the same sharing of objects as the original events
+    """
+    memo = {}
+    return [to_dict_record(event, memo) for event in events]
+
+
+def per_object_sizes(events):
+    """
+    Returns the mean size in bytes of each record type
+    """
+    sizes = {"Event": [], "Origin": [], "Location": [], "Magnitude": [],
+             "Metadata": []}
+    for event in events:
+        sizes["Event"].append(shallow_size(event))
+        for origin in event.origins:
+            sizes["Origin"].append(shallow_size(origin))
+            sizes["Location"].append(shallow_size(origin.location))
+            sizes["Metadata"].append(shallow_size(origin.metadata))
+        for magnitude in event.magnitudes:
+            sizes["Magnitude"].append(shallow_size(magnitude))
+    return dict([(key, float(sum(values)) / len(values))
+                 for key, values in sizes.items()])
+
+
+def main(number_events=20000):
+    """
+    Prints the shallow size of each record type and the deep size of the
+    whole set of events for both layouts
+    """
+    events = build_events(number_events)
+    dict_events = to_dict_records(events)
+    slotted = per_object_sizes(events)
+    dicts = per_object_sizes(dict_events)
+    print "%-10s %12s %12s %8s" % ("Record", "dict (B)", "slots (B)",
+                                   "ratio")
+    for key in ["Event", "Origin", "Location", "Magnitude", "Metadata"]:
+        print "%-10s %12.1f %12.1f %8.2f" % (key, dicts[key], slotted[key],
+                                             dicts[key] / slotted[key])
+    dict_total = deep_size(dict_events)
+    slot_total = deep_size(events)
+    print "Total for %g events: dict %.1f MB, slots %.1f MB (%.1f %% less)" \
+        % (number_events, dict_total / 1024. ** 2, slot_total / 1024. ** 2,
+        100. * (1. - float(slot_total) / dict_total))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
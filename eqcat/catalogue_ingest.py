@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute 
+# it and/or modify it under the terms of the GNU Affero General Public 
+# License as published by the Free Software Foundation, either version 
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Incremental ingestion of ISF bulletins into the hdf5 catalogue database read
+by :class: eqcat.catalogue_query_tools.CatalogueDB
+"""
+import os
+import hashlib
+import datetime
+import numpy as np
+import pandas as pd
+from eqcat.isf_catalogue import (DATAMAP, MAGDATAMAP, ORIGIN_KEY,
+                                 MAGNITUDE_KEY, append_catalogue_tables,
+                                 index_catalogue_tables)
+from eqcat.parsers.isf_catalogue_reader import ISFReader
+
+
+MANIFEST_KEY = "catalogue/manifest"
+
+MANIFEST_COLUMNS = ["filename", "file_size", "mtime", "sha1",
+                    "origin_agencies", "magnitude_agencies", "ingested",
+                    "origins", "magnitudes", "replaced_origins",
+                    "replaced_magnitudes"]
+
+# Agency selection of the entries of a manifest written before the
+# selections were recorded, which matches no selection
+UNKNOWN_SELECTION = "?"
+
+
+def get_file_hash(filename):
+    """
+    Returns the SHA-1 hash of the content of the file
+    """
+    checksum = hashlib.sha1()
+    with open(filename, "rb") as fle:
+        for block in iter(lambda: fle.read(1024 ** 2), ""):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def get_agency_selection(agencies):
+    """
+    Returns the string recording an agency selection in the manifest: the
+    sorted agencies separated by commas, or an empty string if all agencies
+    are selected
+    """
+    return ",".join(sorted(set(agencies)))
+
+
+def get_ingest_manifest(hdf5_file):
+    """
+    Returns the manifest of the source files ingested into the database as
+    a pandas.DataFrame (empty if no files have been ingested). In the
+    manifest of an older database the agency selections are
+    UNKNOWN_SELECTION
+    """
+    if not os.path.exists(hdf5_file):
+        return pd.DataFrame(columns=MANIFEST_COLUMNS)
+    store = pd.HDFStore(hdf5_file, "r")
+    try:
+        if not MANIFEST_KEY in store:
+            return pd.DataFrame(columns=MANIFEST_COLUMNS)
+        manifest = store[MANIFEST_KEY]
+    finally:
+        store.close()
+    for column in ["origin_agencies", "magnitude_agencies"]:
+        if not column in manifest.columns:
+            manifest[column] = UNKNOWN_SELECTION
+    return manifest[MANIFEST_COLUMNS]
+
+
+def is_ingested(manifest, file_hash, origin_agencies, magnitude_agencies):
+    """
+    Returns True if the manifest records the ingestion of a file with the
+    given content hash and agency selections (see get_agency_selection)
+    """
+    return bool((manifest["sha1"].isin([file_hash]) &
+                 manifest["origin_agencies"].isin([origin_agencies]) &
+                 manifest["magnitude_agencies"].isin([magnitude_agencies])
+                 ).any())
+
+
+def ingest_isf_file(hdf5_file, isf_file, selected_origin_agencies=[],
+        selected_magnitude_agencies=[], force=False):
+    """
+    Parses a single ISF bulletin file and upserts its origins and magnitudes
+    into the database. Events, origins and magnitudes already in the
+    database with the same eventID, originID or magnitudeID as those in the
+    new file are replaced, so re-ingesting an overlapping period does not
+    duplicate rows. The file is recorded in the ingest manifest of the
+    database with its content hash and agency selections, and a file is
+    skipped if already ingested with the same selections.
+    :param str hdf5_file:
+        Path to the hdf5 database (created if it does not exist)
+    :param str isf_file:
+        Path to the ISF bulletin
+    :param list selected_origin_agencies:
+        List of origin agencies to be considered for inclusion
+    :param list selected_magnitude_agencies:
+        List of magnitude agencies to be considered for inclusion
+    :param bool force:
+        Ingest the file even if a file with identical content was already
+        ingested with the same agency selections
+    :returns:
+        Manifest entry of the file as a dictionary, or None if the file was
+        already ingested
+    """
+    file_hash = get_file_hash(isf_file)
+    origin_agencies = get_agency_selection(selected_origin_agencies)
+    magnitude_agencies = get_agency_selection(selected_magnitude_agencies)
+    manifest = get_ingest_manifest(hdf5_file)
+    if not force and is_ingested(manifest, file_hash, origin_agencies,
+                                 magnitude_agencies):
+        return None
+    reader = ISFReader(isf_file, selected_origin_agencies,
+                       selected_magnitude_agencies)
+    origin_data, mag_data = reader.read_to_arrays()
+    n_replaced_orig, n_replaced_mag = upsert_catalogue_tables(hdf5_file,
+                                                              origin_data,
+                                                              mag_data)
+    status = os.stat(isf_file)
+    entry = {"filename": os.path.abspath(isf_file),
+             "file_size": status.st_size,
+             "mtime": status.st_mtime,
+             "sha1": file_hash,
+             "origin_agencies": origin_agencies,
+             "magnitude_agencies": magnitude_agencies,
+             "ingested": datetime.datetime.now().isoformat(),
+             "origins": len(origin_data),
+             "magnitudes": len(mag_data),
+             "replaced_origins": n_replaced_orig,
+             "replaced_magnitudes": n_replaced_mag}
+    entry_df = pd.DataFrame([entry], columns=MANIFEST_COLUMNS)
+    if len(manifest):
+        manifest = pd.concat([manifest, entry_df], ignore_index=True)
+    else:
+        manifest = entry_df
+    store = pd.HDFStore(hdf5_file)
+    try:
+        store.put(MANIFEST_KEY, manifest)
+    finally:
+        store.close()
+    return entry
+
+
+def upsert_catalogue_tables(hdf5_file, origin_data, mag_data):
+    """
+    Inserts the origin and magnitude tables (as structured arrays defined
+    by isf_catalogue.DATAMAP and isf_catalogue.MAGDATAMAP) into the database,
+    replacing the rows of any event, origin or magnitude already present.
+    The rows to replace are located first, and only removed (by their row
+    coordinates) once the new rows are appended, so if appending fails no
+    rows are lost. Values outside the categories of a categorical table are
+    added to its categories (see isf_catalogue.append_catalogue_table)
+    :returns:
+        Number of origins replaced, number of magnitudes replaced
+    """
+    orig_df = pd.DataFrame(origin_data, columns=[val[0] for val in DATAMAP])
+    mag_df = pd.DataFrame(mag_data, columns=[val[0] for val in MAGDATAMAP])
+    event_ids = np.union1d(orig_df["eventID"].unique(),
+                           mag_df["eventID"].unique())
+    store = pd.HDFStore(hdf5_file)
+    try:
+        replaced_orig = _get_replaced_rows(store, ORIGIN_KEY, event_ids,
+                                           "originID",
+                                           orig_df["originID"].unique())
+        replaced_mag = _get_replaced_rows(store, MAGNITUDE_KEY, event_ids,
+                                          "magnitudeID",
+                                          mag_df["magnitudeID"].unique())
+        # New rows are appended after the existing rows, so the coordinates
+        # of the replaced rows are unchanged
+        append_catalogue_tables(store, orig_df, mag_df, index=False)
+        for key, rows in [(ORIGIN_KEY, replaced_orig),
+                          (MAGNITUDE_KEY, replaced_mag)]:
+            if len(rows):
+                store.remove(key, where=rows)
+        index_catalogue_tables(store)
+    finally:
+        store.close()
+    return len(replaced_orig), len(replaced_mag)
+
+
+def _get_table_column(store, key, column):
+    """
+    Reads a single column of a table, which is only possible directly if the
+    column is indexable or a data column
+    """
+    try:
+        return store.select_column(key, column)
+    except (KeyError, ValueError):
+        return store.select(key)[column]
+
+
+def _get_replaced_rows(store, key, event_ids, id_column, row_ids):
+    """
+    Returns the sorted coordinates of the rows of the table belonging to any
+    of the events or with any of the row IDs
+    """
+    if not key in store:
+        return np.array([], dtype=np.int64)
+    # Combined as arrays, as the index labels of appended rows repeat
+    replace = np.logical_or(
+        _get_table_column(store, key, "eventID").isin(event_ids).values,
+        _get_table_column(store, key, id_column).isin(row_ids).values)
+    return np.where(replace)[0].astype(np.int64)
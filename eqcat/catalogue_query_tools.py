@@ -18,20 +18,28 @@
 """
 Collection of Catalogue Database Query Tools
 """
+import os
+import zipfile
+import multiprocessing
 import h5py
 import numpy as np
 import pandas as pd
 from copy import copy, deepcopy
 from datetime import datetime, date, time
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib.colors import Normalize, LogNorm
 import eqcat.utils as utils
+from eqcat.spatial_index import (SpatialGridIndex, INDEX_FILE_ERRORS,
+                                 get_file_identity)
 from matplotlib.path import Path
 from scipy import odr
 from eqcat.isf_catalogue import (Magnitude, Location, Origin,
-                                 Event, ISFCatalogue)
+                                 Event, ISFCatalogue, DATAMAP, MAGDATAMAP,
+                                 ORIGIN_KEY, MAGNITUDE_KEY,
+                                 append_catalogue_tables,
+                                 datetime_to_decimal_time)
 
 try:
     from mpl_toolkits.basemap import Basemap
@@ -43,41 +51,562 @@ except:
 matplotlib.rc("xtick", labelsize=14)
 matplotlib.rc("ytick", labelsize=14)
 
+# Columns of the CatalogueDB tables converted to categoricals when loading
+# with categorical=True
+CATEGORICAL_COLUMNS = {ORIGIN_KEY: ["eventID", "originID", "Agency"],
+                       MAGNITUDE_KEY: ["eventID", "originID", "magType",
+                                       "magAgency"]}
+
+
+def to_categorical(origins, magnitudes):
+    """
+    Returns copies of the origin and magnitude tables with the identifier,
+    agency and magnitude type columns (CATEGORICAL_COLUMNS) converted to
+    pandas categoricals. The eventID and originID columns of the two tables
+    share the same categories, such that their codes can be compared
+    directly
+    """
+    origins = origins.copy()
+    magnitudes = magnitudes.copy()
+    for col in ["eventID", "originID"]:
+        categories = pd.unique(np.concatenate([
+            np.asarray(origins[col], dtype=object),
+            np.asarray(magnitudes[col], dtype=object)]))
+        origins[col] = pd.Categorical(origins[col], categories=categories)
+        magnitudes[col] = pd.Categorical(magnitudes[col],
+                                         categories=categories)
+    for table, key in [(origins, ORIGIN_KEY), (magnitudes, MAGNITUDE_KEY)]:
+        for col in CATEGORICAL_COLUMNS[key]:
+            if not pd.api.types.is_categorical_dtype(table[col].dtype):
+                table[col] = table[col].astype("category")
+    return origins, magnitudes
+
+
+def _get_where_value(value):
+    """
+    Returns a value formatted for a PyTables where expression
+    """
+    if isinstance(value, basestring):
+        return repr(str(value))
+    return repr(float(value))
+
+
+# Integer codes of the events of a catalogue: the sorted event IDs, and for
+# each table the code of the event of each row, the rows in order of event
+# code and the offsets of the events in that order (compressed sparse row
+# form), such that the rows of event i are order[offsets[i]:offsets[i + 1]]
+EventCodes = namedtuple("EventCodes",
+                        ["event_ids", "origin_codes", "origin_order",
+                         "origin_offsets", "magnitude_codes",
+                         "magnitude_order", "magnitude_offsets"])
+
+
+def _get_code_order(codes, number_events):
+    """
+    Returns the order of the rows by event code and the offsets of the
+    events in that order
+    """
+    order = np.argsort(codes, kind="mergesort")
+    offsets = np.zeros(number_events + 1, dtype=int)
+    offsets[1:] = np.cumsum(np.bincount(codes, minlength=number_events))
+    return order, offsets
+
+
+def get_event_codes(origin_event_ids, magnitude_event_ids):
+    """
+    Returns the integer codes (as instance of EventCodes) of the events of
+    the origin and magnitude tables given their event IDs. The events are
+    coded in order of event ID and the codes are shared by both tables
+    """
+    codes, event_ids = pd.factorize(np.concatenate([
+        np.asarray(origin_event_ids, dtype=object),
+        np.asarray(magnitude_event_ids, dtype=object)]), sort=True)
+    number_events = len(event_ids)
+    origin_codes = codes[:len(origin_event_ids)]
+    magnitude_codes = codes[len(origin_event_ids):]
+    return EventCodes(
+        np.asarray(event_ids),
+        origin_codes, *(_get_code_order(origin_codes, number_events) +
+                        (magnitude_codes,) +
+                        _get_code_order(magnitude_codes, number_events)))
+
+
+def _select_code_order(codes, order, mask, number_events):
+    """
+    Returns the codes, order and offsets of the rows of a table selected by a
+    boolean mask, derived from those of the full table without sorting
+    """
+    positions = np.cumsum(mask) - 1
+    order = positions[order[mask[order]]]
+    codes = codes[mask]
+    offsets = np.zeros(number_events + 1, dtype=int)
+    offsets[1:] = np.cumsum(np.bincount(codes, minlength=number_events))
+    return codes, order, offsets
+
+
+def select_event_codes(event_codes, origin_mask, magnitude_mask):
+    """
+    Returns the event codes of the rows of the tables selected by boolean
+    masks, keeping the codes (and event IDs) of the full tables
+    """
+    number_events = len(event_codes.event_ids)
+    return EventCodes(event_codes.event_ids, *(
+        _select_code_order(event_codes.origin_codes, event_codes.origin_order,
+                           origin_mask, number_events) +
+        _select_code_order(event_codes.magnitude_codes,
+                           event_codes.magnitude_order, magnitude_mask,
+                           number_events)))
+
+
+def get_selected_events(codes, offsets, idx, select_type="any"):
+    """
+    Returns the boolean array (by event code) of the events with any or all
+    of their rows in a table selected
+    :param numpy.ndarray codes:
+        Event codes of the rows of the table
+    :param numpy.ndarray offsets:
+        Offsets of the events in the table (see EventCodes)
+    :param idx:
+        Boolean selection of the rows
+    :param str select_type:
+        Select events with "any" or "all" of their rows selected
+    """
+    number_events = len(offsets) - 1
+    n_selected = np.bincount(codes[np.asarray(idx, dtype=bool)],
+                             minlength=number_events)
+    if select_type == "any":
+        return n_selected > 0
+    elif select_type == "all":
+        n_rows = np.diff(offsets)
+        return (n_selected == n_rows) & (n_rows > 0)
+    else:
+        raise ValueError(
+            "Selection Type must correspond to 'any' or 'all'")
+
+
+def _load_time_index(index_file, identity, number_rows):
+    """
+    Returns the sorted times and rows of the time index stored in a sidecar
+    file (see CatalogueDB.get_time_index), or None if the file is damaged
+    or holds the index of another version of the catalogue file
+    """
+    if not zipfile.is_zipfile(index_file):
+        return None
+    try:
+        data = np.load(index_file)
+        try:
+            if str(data["identity"]) != identity:
+                return None
+            times = data["times"]
+            rows = data["rows"]
+        finally:
+            data.close()
+    except INDEX_FILE_ERRORS:
+        return None
+    if len(times) != number_rows or len(rows) != number_rows:
+        return None
+    return times, rows
+
+
 class CatalogueDB(object):
     """
-    Holder class for the catalogue database
+    Holder class for the catalogue database. In lazy mode the tables are not
+    read from the file when instantiated: the selections of the
+    :class: CatalogueSelector are evaluated by PyTables on the indexed data
+    columns of the file (see isf_catalogue.append_catalogue_table) and only
+    the origins and magnitudes of the selected events are read. The full
+    tables are read only if the origins or magnitudes attributes are used.
+    Spatial and time selections use a grid index and a sorted time index of
+    the origins (see get_spatial_index and get_time_index), which for the
+    tables of a file are stored alongside it (or in the index directory),
+    if writable. The selected events are
+    propagated between the tables through integer event codes (see
+    get_event_codes)
     """
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, lazy=False, categorical=False,
+                 index_dir=None):
         """
         Instantiate the class. If a filename is supplied this will load the
         data from the file
         :param str filename:
             Path to input file
+        :param bool lazy:
+            Do not load the data until needed
+        :param bool categorical:
+            Convert the identifier, agency and magnitude type columns to
+            pandas categoricals when loading (see to_categorical)
+        :param str index_dir:
+            Directory in which the spatial and time index files of the file
+            are stored (defaults to the directory of the file)
         """
         self.filename = filename
-        self.origins = []
-        self.magnitudes = []
+        self.index_dir = index_dir
+        self.lazy = lazy and bool(filename)
+        self.categorical = categorical
+        self._origins = []
+        self._magnitudes = []
         self.number_origins = None
         self.number_magnitudes = None
+        self._origins_from_file = False
+        self._spatial_index = None
+        self._time_index = None
+        self._event_codes = None
+        self._data_columns = {}
         self.load_data_from_file()
 
+    @property
+    def origins(self):
+        """
+        Origin table as a pandas.DataFrame
+        """
+        if self._origins is None:
+            self._load_tables()
+        return self._origins
+
+    @origins.setter
+    def origins(self, origins):
+        self._origins = origins
+        self._origins_from_file = False
+        self._spatial_index = None
+        self._time_index = None
+        self._event_codes = None
+
+    @property
+    def magnitudes(self):
+        """
+        Magnitude table as a pandas.DataFrame
+        """
+        if self._magnitudes is None:
+            self._load_tables()
+        return self._magnitudes
+
+    @magnitudes.setter
+    def magnitudes(self, magnitudes):
+        self._magnitudes = magnitudes
+        self._event_codes = None
+
+    def _load_tables(self):
+        """
+        Reads the origin and magnitude tables from the file
+        """
+        origins = pd.read_hdf(self.filename, ORIGIN_KEY)
+        magnitudes = pd.read_hdf(self.filename, MAGNITUDE_KEY)
+        if self.categorical:
+            origins, magnitudes = to_categorical(origins, magnitudes)
+        self._origins = origins
+        self._magnitudes = magnitudes
+        self._origins_from_file = True
+
     def load_data_from_file(self):
         """
-        If a filename is specified then will import data from file
+        If a filename is specified then will import data from file (in lazy
+        mode only the number of rows is read)
         """
-        if self.filename:
-            self.origins = pd.read_hdf(self.filename, "catalogue/origins")
-            self.magnitudes = pd.read_hdf(self.filename,
-                                          "catalogue/magnitudes")
+        if self.filename and self.lazy:
+            self._origins = None
+            self._magnitudes = None
+            self._origins_from_file = True
+            store = pd.HDFStore(self.filename, "r")
+            try:
+                self.number_origins = store.get_storer(ORIGIN_KEY).nrows
+                self.number_magnitudes = store.get_storer(MAGNITUDE_KEY).nrows
+                # Data columns on which selections can be evaluated
+                self._data_columns = dict([
+                    (key, store.get_storer(key).data_columns)
+                    for key in [ORIGIN_KEY, MAGNITUDE_KEY]])
+            finally:
+                store.close()
+        elif self.filename:
+            self._load_tables()
             _ = self._get_number_origins_magnitudes()
         else:
             pass
 
+    def is_lazy(self):
+        """
+        Returns True if the tables are not loaded and selections can be
+        evaluated from the file
+        """
+        return self.lazy and self._origins is None and\
+            self._magnitudes is None
+
+    def get_event_codes(self):
+        """
+        Returns the integer codes of the events of the catalogue (as instance
+        of EventCodes), computed once and kept for the catalogues selected
+        from it
+        """
+        if self._event_codes is None:
+            if self.is_lazy():
+                store = pd.HDFStore(self.filename, "r")
+                try:
+                    origin_ids = store.select_column(ORIGIN_KEY,
+                                                     "eventID").values
+                    magnitude_ids = store.select_column(MAGNITUDE_KEY,
+                                                        "eventID").values
+                finally:
+                    store.close()
+            else:
+                origin_ids = self.origins["eventID"]
+                magnitude_ids = self.magnitudes["eventID"]
+            self._event_codes = get_event_codes(origin_ids, magnitude_ids)
+        return self._event_codes
+
+    def select_rows(self, origin_mask, magnitude_mask, in_place=False):
+        """
+        Returns the catalogue of the origins and magnitudes selected by
+        boolean masks, keeping the event codes. In lazy mode only the
+        selected rows are read from the file
+        :param bool in_place:
+            Select the rows of this catalogue rather than of a new catalogue
+        """
+        origin_mask = np.asarray(origin_mask, dtype=bool)
+        magnitude_mask = np.asarray(magnitude_mask, dtype=bool)
+        event_codes = select_event_codes(self.get_event_codes(), origin_mask,
+                                         magnitude_mask)
+        if self.is_lazy():
+            origins, magnitudes = self._read_rows(origin_mask,
+                                                  magnitude_mask)
+        else:
+            origins = self.origins[origin_mask]
+            magnitudes = self.magnitudes[magnitude_mask]
+        if in_place:
+            output_catalogue = self
+        else:
+            output_catalogue = CatalogueDB(categorical=self.categorical)
+        output_catalogue.origins = origins
+        output_catalogue.magnitudes = magnitudes
+        output_catalogue._event_codes = event_codes
+        _ = output_catalogue._get_number_origins_magnitudes()
+        return output_catalogue
+
+    def _read_rows(self, origin_mask, magnitude_mask):
+        """
+        Reads the origins and magnitudes selected by boolean masks from the
+        file
+        """
+        tables = []
+        store = pd.HDFStore(self.filename, "r")
+        try:
+            for key, mask in [(ORIGIN_KEY, origin_mask),
+                              (MAGNITUDE_KEY, magnitude_mask)]:
+                rows = np.where(mask)[0]
+                if len(rows):
+                    tables.append(store.select(key, where=rows))
+                else:
+                    tables.append(store.select(key, start=0, stop=0))
+        finally:
+            store.close()
+        if self.categorical:
+            return to_categorical(*tables)
+        return tuple(tables)
+
+    def select_events(self, selected, in_place=False):
+        """
+        Returns the catalogue of the events selected by a boolean array by
+        event code (see get_event_codes)
+        :param bool in_place:
+            Select the events of this catalogue rather than of a new
+            catalogue
+        """
+        event_codes = self.get_event_codes()
+        return self.select_rows(selected[event_codes.origin_codes],
+                                selected[event_codes.magnitude_codes],
+                                in_place)
+
+    def get_spatial_index(self, cell_size=1.0):
+        """
+        Returns the longitude/latitude grid index of the origins (as instance
+        of :class: eqcat.spatial_index.SpatialGridIndex), whose rows are
+        the positions of the origins in the origin table. The index is cached
+        and, for the origin table of a file, stored in the sidecar file
+        filename + ".grid.npz" (see get_index_file), where it is reused while
+        the file is unchanged. A sidecar file that cannot be read is
+        rebuilt. If the sidecar file cannot be written (e.g. read-only
+        storage) the index is only kept in memory
+        :param float cell_size:
+            Size of the grid cells (decimal degrees)
+        """
+        index = self._spatial_index
+        if index is not None and index.cell_size == cell_size:
+            return index
+        if self.filename and self._origins_from_file:
+            index_file = self.get_index_file(".grid.npz")
+            identity = get_file_identity(self.filename)
+            if os.path.exists(index_file):
+                try:
+                    index = SpatialGridIndex.load(index_file)
+                except INDEX_FILE_ERRORS:
+                    # Damaged sidecar file, replaced by the rebuilt index
+                    index = None
+            if index is None or index.identity != identity or\
+                    index.cell_size != cell_size or index.number_rows !=\
+                    self._get_number_origins_magnitudes()[0]:
+                lons, lats = self._get_file_coordinates()
+                index = SpatialGridIndex.build(lons, lats, cell_size,
+                                               identity)
+                try:
+                    index.save(index_file)
+                except (IOError, OSError):
+                    pass
+        else:
+            index = SpatialGridIndex.build(self.origins["longitude"].values,
+                                           self.origins["latitude"].values,
+                                           cell_size)
+        self._spatial_index = index
+        return index
+
+    def get_index_file(self, extension):
+        """
+        Returns the path to a sidecar index file of the file, given its
+        extension, in the index directory if set
+        """
+        if self.index_dir:
+            return os.path.join(self.index_dir,
+                                os.path.basename(self.filename) + extension)
+        return self.filename + extension
+
+    def get_time_index(self):
+        """
+        Returns the decimal times of the origins (see get_decimal_time) in
+        ascending order and the rows of the origin table in that order, such
+        that time windows are found by binary search. The index is cached
+        and, for the origin table of a file, stored in the sidecar file
+        filename + ".time.npz" (see get_index_file), where it is reused while
+        the file is unchanged. A sidecar file that cannot be read is
+        rebuilt. If the sidecar file cannot be written (e.g. read-only
+        storage) the index is only kept in memory
+        """
+        if self._time_index is not None:
+            return self._time_index
+        index_file = None
+        if self.filename and self._origins_from_file:
+            index_file = self.get_index_file(".time.npz")
+            identity = get_file_identity(self.filename)
+            if os.path.exists(index_file):
+                self._time_index = _load_time_index(
+                    index_file, identity,
+                    self._get_number_origins_magnitudes()[0])
+                if self._time_index is not None:
+                    return self._time_index
+        if self.is_lazy():
+            store = pd.HDFStore(self.filename, "r")
+            try:
+                origins = store.select(ORIGIN_KEY, columns=[
+                    "year", "month", "day", "hour", "minute", "second"])
+            finally:
+                store.close()
+        else:
+            origins = self.origins
+        times = get_decimal_time(origins)
+        rows = np.argsort(times, kind="mergesort")
+        self._time_index = (times[rows], rows)
+        if index_file:
+            try:
+                np.savez(index_file, times=times[rows], rows=rows,
+                         identity=identity)
+            except (IOError, OSError):
+                pass
+        return self._time_index
+
+    def get_time_window_rows(self, start=-np.inf, end=np.inf):
+        """
+        Returns the sorted rows of the origin table with decimal times within
+        the window [start, end]
+        """
+        times, rows = self.get_time_index()
+        return np.sort(rows[np.searchsorted(times, start, side="left"):
+                            np.searchsorted(times, end, side="right")])
+
+    def _get_file_coordinates(self):
+        """
+        Returns the longitudes and latitudes of the origins of the file
+        """
+        if not self.is_lazy():
+            return (self.origins["longitude"].values,
+                    self.origins["latitude"].values)
+        store = pd.HDFStore(self.filename, "r")
+        try:
+            data_columns = store.get_storer(ORIGIN_KEY).data_columns
+            if "longitude" in data_columns and "latitude" in data_columns:
+                return (store.select_column(ORIGIN_KEY, "longitude").values,
+                        store.select_column(ORIGIN_KEY, "latitude").values)
+            origins = store.select(ORIGIN_KEY,
+                                   columns=["longitude", "latitude"])
+            return origins["longitude"].values, origins["latitude"].values
+        finally:
+            store.close()
+
+    def can_query_store(self, key, columns):
+        """
+        Returns True if the selections on the columns of a table (ORIGIN_KEY
+        or MAGNITUDE_KEY) can be evaluated from the file, i.e. the database
+        is lazy and the columns (and eventID) are data columns of the table
+        """
+        if not self.is_lazy():
+            return False
+        data_columns = self._data_columns[key]
+        return all([col in data_columns for col in ["eventID"] + columns])
+
+    def select_from_store(self, key, where, select_type="any",
+                          row_filter=None, coordinates=None):
+        """
+        Returns a new (in-memory) database with the events whose rows in one
+        of the tables match a PyTables where expression, reading from the file
+        only the matching rows and the origins and magnitudes of the selected
+        events
+        :param str key:
+            Table on which the selection is made (ORIGIN_KEY or MAGNITUDE_KEY)
+        :param str where:
+            Where expression on the data columns of the table (ignored if
+            the coordinates are given)
+        :param str select_type:
+            Select events with "any" or "all" of their rows matching
+        :param row_filter:
+            Optional function applied to the dataframe of the matching rows,
+            returning a boolean array of the rows to keep (for conditions
+            that cannot be expressed in PyTables)
+        :param numpy.ndarray coordinates:
+            Sorted rows of the table to which the selection is applied
+            instead of the where expression (e.g. from the spatial index)
+        :returns:
+            Selected catalogue as instance of :class: CatalogueDB
+        """
+        if not select_type in ("any", "all"):
+            raise ValueError(
+                "Selection Type must correspond to 'any' or 'all'")
+        event_codes = self.get_event_codes()
+        store = pd.HDFStore(self.filename, "r")
+        try:
+            if coordinates is None:
+                coordinates = store.select_as_coordinates(key, where)
+            if row_filter is not None and len(coordinates):
+                rows = store.select(key, where=coordinates)
+                coordinates = coordinates[np.asarray(row_filter(rows),
+                                                     dtype=bool)]
+            if key == ORIGIN_KEY:
+                codes = event_codes.origin_codes
+                offsets = event_codes.origin_offsets
+            else:
+                codes = event_codes.magnitude_codes
+                offsets = event_codes.magnitude_offsets
+            n_matched = np.bincount(codes[coordinates],
+                                    minlength=len(event_codes.event_ids))
+            selected = n_matched > 0
+            if select_type == "all":
+                # Events in which every row matches
+                selected &= n_matched == np.diff(offsets)
+        finally:
+            store.close()
+        return self.select_events(selected)
+
     def _get_number_origins_magnitudes(self):
         """
         Returns the number of origins and the number of magnitudes
         """
-        self.number_origins = len(self.origins) 
+        if self.is_lazy():
+            return self.number_origins, self.number_magnitudes
+        self.number_origins = len(self.origins)
         self.number_magnitudes = len(self.magnitudes)
         return self.number_origins, self.number_magnitudes
 
@@ -86,110 +615,156 @@ class CatalogueDB(object):
         Exports the current selection to file   
         """
         store = pd.HDFStore(output_file)
-        store.append("catalogue/origins", self.origins)
-        store.append("catalogue/magnitudes", self.magnitudes)
+        append_catalogue_tables(store, self.origins, self.magnitudes)
         store.close()
 
-    def build_isf(self, identifier, name):
+    def build_isf(self, identifier, name, lazy=False):
         """
-        Creates an instance of the ISFCatalogue class from the hdf5 format
+        Creates an instance of the ISFCatalogue class from the hdf5 format.
+        The events are ordered by event ID
         :param str identifier:
             Identifier string of the ISFCatalogue object
         :param str name:
             Name for the ISFCatalogue object
+        :param bool lazy:
+            Return a catalogue backed by the origin and magnitude tables
+            (see :meth: eqcat.isf_catalogue.ISFCatalogue.from_tables), in
+            which the event objects are only built when accessed. As in the
+            events built otherwise, missing optional values are NaN
         :returns:
-            Catalogue as instance of :class: ISFCatalogue  
+            Catalogue as instance of :class: ISFCatalogue
         """
+        if lazy:
+            return self._build_table_isf(identifier, name)
+        origin_event_ids = np.asarray(self.origins["eventID"], dtype=object)
+        mag_event_ids = np.asarray(self.magnitudes["eventID"], dtype=object)
+        # Sorted event IDs of the events with origins
+        event_ids = np.unique(origin_event_ids)
+        origin_order, origin_start, origin_end = _get_event_splits(
+            origin_event_ids, event_ids)
+        mag_order, mag_start, mag_end = _get_event_splits(mag_event_ids,
+                                                          event_ids)
+        origins = _get_origin_classes(self.origins, origin_order)
+        magnitudes = _get_magnitude_classes(self.magnitudes, mag_order)
         isf_catalogue = ISFCatalogue(identifier, name)
-        event_groups = self.origins.groupby("eventID")
-        mag_groups = self.magnitudes.groupby("eventID")
-        mag_keys = mag_groups.indices.keys()
-        ngrps = len(event_groups)
-        for iloc, grp in enumerate(event_groups):
-            if (iloc % 1000) == 0:
-                print "Processing event %d of %d" % (iloc, ngrps)
-            # Get magnitudes list
-            if grp[0] in mag_keys:
-                # Magnitudes associated to this origin
-                mag_list = self._get_magnitude_classes(
-                    mag_groups.get_group(grp[0]))
-            else:
-                mag_list = []
-            # Get origins
-            origin_list = self._get_origin_classes(grp[1], mag_list)
-            event = Event(grp[0], origin_list, mag_list)
-            isf_catalogue.events.append(event)
+        for iloc, event_id in enumerate(event_ids):
+            origin_list = origins[origin_start[iloc]:origin_end[iloc]]
+            mag_list = magnitudes[mag_start[iloc]:mag_end[iloc]]
+            # Assign the magnitudes to their origins
+            origin_mags = {}
+            for mag in mag_list:
+                origin_mags.setdefault(mag.origin_id, []).append(mag)
+            for origin in origin_list:
+                origin.magnitudes.extend(origin_mags.get(origin.id, []))
+            isf_catalogue.events.append(Event(event_id, origin_list,
+                                              mag_list))
         return isf_catalogue
 
+    def _build_table_isf(self, identifier, name):
+        """
+        Creates an instance of the ISFCatalogue class backed by the origin
+        and magnitude tables, sorted by event ID as in build_isf
+        """
+        origin_data = _to_table(self.origins, DATAMAP)
+        mag_data = _to_table(self.magnitudes, MAGDATAMAP)
+        origin_data = origin_data[np.argsort(origin_data["eventID"],
+                                             kind="mergesort")]
+        # Only the magnitudes of events with origins are kept
+        mag_data = mag_data[np.in1d(mag_data["eventID"],
+                                    origin_data["eventID"])]
+        mag_data = mag_data[np.argsort(mag_data["eventID"],
+                                       kind="mergesort")]
+        return ISFCatalogue.from_tables(identifier, name, origin_data,
+                                        mag_data, missing=np.nan)
+
+
+def _to_table(dataframe, datamap):
+    """
+    Returns a catalogue dataframe as a structured array defined by the data
+    map (DATAMAP or MAGDATAMAP)
+    """
+    table = np.zeros(dataframe.shape[0], dtype=datamap)
+    for key, _ in datamap:
+        table[key] = np.asarray(dataframe[key])
+    return table
 
-    def _get_origin_classes(self, orig_group, mag_list):
-        """
-        Gets the Origin class representation for a particular event
-        :param orig_group:
-            Pandas Group object
-        :param list:
-            List of :class: Magnitude objects
-        """
-        origin_list = []
-        norig = orig_group.shape[0]
-        for iloc in range(0, norig):
-            # Get location
-            location = Location(orig_group.originID.values[iloc],
-                                orig_group.longitude.values[iloc],
-                                orig_group.latitude.values[iloc],
-                                orig_group.depth.values[iloc],
-                                orig_group.semimajor90.values[iloc],
-                                orig_group.semiminor90.values[iloc],
-                                orig_group.error_strike.values[iloc],
-                                orig_group.depth_error.values[iloc])
-            # origin
-            orig_date = date(orig_group.year.values[iloc],
-                             orig_group.month.values[iloc],
-                             orig_group.day.values[iloc])
-            micro_seconds = (orig_group.second.values[iloc] -
-                np.floor(orig_group.second.values[iloc])) * 1.0E6
-            seconds = int(orig_group.second.values[iloc])
-            if seconds > 59:
-                seconds = 0
-                minute_inc = 1
-            else:
-                minute_inc = 0
-            orig_time = time(orig_group.hour.values[iloc],
-                             orig_group.minute.values[iloc] + minute_inc,
-                             seconds,
-                             int(micro_seconds))
-            origin = Origin(orig_group.originID.values[iloc],
-                            orig_date,
-                            orig_time,
-                            location,
-                            orig_group.Agency.values[iloc],
-                            is_prime=bool(orig_group.prime.values[iloc]),
-                            time_error = orig_group.time_error.values[iloc])
-            for mag in mag_list:
-                if mag.origin_id == origin.id:
-                    origin.magnitudes.append(mag)
-            origin_list.append(origin)
-        return origin_list
-                               
-    def _get_magnitude_classes(self, mag_group):
-        """
-        For a given event, returns the list of magnitudes
-        :param mag_group:
-            Group of magnitudes for a given event as instance of Pandas
-            Group object
-        """
-        mag_list = []
-        nmags = mag_group.shape[0]
-        for iloc in range(0, nmags):
-            mag = Magnitude(mag_group.eventID.values[iloc],
-                            mag_group.originID.values[iloc],
-                            mag_group.value.values[iloc],
-                            mag_group.magAgency.values[iloc],
-                            mag_group.magType.values[iloc],
-                            mag_group.sigma.values[iloc])
-            mag.magnitude_id = mag_group.magnitudeID.values[iloc]
-            mag_list.append(mag)
-        return mag_list
+
+def _get_event_splits(event_ids, keys):
+    """
+    Returns the order of the rows sorted by event ID and the start and end
+    rows (in sorted order) of each of the sorted event IDs in keys
+    """
+    order = np.argsort(event_ids, kind="mergesort")
+    sorted_ids = event_ids[order]
+    return (order, np.searchsorted(sorted_ids, keys, side="left"),
+            np.searchsorted(sorted_ids, keys, side="right"))
+
+
+def _get_column(table, key, order):
+    """
+    Returns a column of a dataframe in a given order as a list
+    """
+    return np.asarray(table[key])[order].tolist()
+
+
+def _get_origin_classes(origins, order):
+    """
+    Returns the list of :class: Origin objects of the rows of the origin
+    table in a given order
+    :param origins:
+        Origin table as pandas.DataFrame
+    :param numpy.ndarray order:
+        Order of the rows
+    """
+    columns = [_get_column(origins, key, order)
+               for key in ["originID", "longitude", "latitude", "depth",
+                           "semimajor90", "semiminor90", "error_strike",
+                           "depth_error", "year", "month", "day", "hour",
+                           "minute", "second", "Agency", "prime",
+                           "time_error"]]
+    origin_list = []
+    for (origin_id, lon, lat, depth, semimajor90, semiminor90, error_strike,
+         depth_error, year, month, day, hour, minute, second, agency, prime,
+         time_error) in zip(*columns):
+        location = Location(origin_id, lon, lat, depth, semimajor90,
+                            semiminor90, error_strike, depth_error)
+        micro_seconds = (second - np.floor(second)) * 1.0E6
+        seconds = int(second)
+        if seconds > 59:
+            seconds = 0
+            minute_inc = 1
+        else:
+            minute_inc = 0
+        origin_list.append(Origin(
+            origin_id,
+            date(year, month, day),
+            time(hour, minute + minute_inc, seconds, int(micro_seconds)),
+            location,
+            agency,
+            is_prime=bool(prime),
+            time_error=time_error))
+    return origin_list
+
+
+def _get_magnitude_classes(magnitudes, order):
+    """
+    Returns the list of :class: Magnitude objects of the rows of the
+    magnitude table in a given order
+    :param magnitudes:
+        Magnitude table as pandas.DataFrame
+    :param numpy.ndarray order:
+        Order of the rows
+    """
+    columns = [_get_column(magnitudes, key, order)
+               for key in ["eventID", "originID", "value", "magAgency",
+                           "magType", "sigma", "magnitudeID"]]
+    mag_list = []
+    for (event_id, origin_id, value, agency, mag_type, sigma,
+         magnitude_id) in zip(*columns):
+        mag = Magnitude(event_id, origin_id, value, agency, mag_type, sigma)
+        mag.magnitude_id = magnitude_id
+        mag_list.append(mag)
+    return mag_list
 
 
 class CatalogueSelector(object):
@@ -210,39 +785,11 @@ class CatalogueSelector(object):
         :param idx:
             Pandas Series object indicating the truth of an array
         """
-        if select_type == "any":
-            valid_origins = self.catalogue.origins.eventID[idx]
-            event_list = valid_origins.unique()
-
-        elif select_type == "all":
-            self.catalogue.origins["idx"] = idx
-            origin_cat = pd.DataFrame({
-                "eventID": self.catalogue.origins.eventID[idx],
-                "idx": idx[idx]})
-            grps = origin_cat.groupby("eventID")
-            original_grps = self.catalogue.origins.groupby("eventID")
-            event_list = []
-            for key in grps.groups.keys():
-                if np.all(original_grps.get_group(key)["idx"].values):
-                    event_list.append(key)
-            event_list = np.array(event_list)
-            del self.catalogue.origins["idx"]
-        else:
-            raise ValueError(
-                "Selection Type must correspond to 'any' or 'all'")
-        
-        select_idx1 = self.catalogue.origins.eventID.isin(event_list)
-        select_idx2 = self.catalogue.magnitudes.eventID.isin(event_list)
-        if self.copycat:
-            output_catalogue = CatalogueDB()
-            output_catalogue.origins = self.catalogue.origins[select_idx1]
-            output_catalogue.magnitudes =\
-                self.catalogue.magnitudes[select_idx2]
-            _ = output_catalogue._get_number_origins_magnitudes
-        else:
-            self.catalogue.origins = self.catalogue.origins[select_idx1]
-            self.catalogue.magnitudes = self.catalogue.magnitudes[select_idx2]
-        return output_catalogue
+        event_codes = self.catalogue.get_event_codes()
+        selected = get_selected_events(event_codes.origin_codes,
+                                       event_codes.origin_offsets, idx,
+                                       select_type)
+        return self.catalogue.select_events(selected, not self.copycat)
             
     def _select_by_magnitudes(self, idx, select_type="any"):
         """
@@ -251,43 +798,20 @@ class CatalogueSelector(object):
         :param idx:
             Pandas Series object indicating the truth of an array
         """
-        if select_type == "any":
-            valid_mags = self.catalogue.magnitudes.eventID[idx]
-            event_list = valid_mags.unique()
-        elif select_type == "all":
-            self.catalogue.magnitudes["idx"] = idx
-            mag_cat = pd.DataFrame({
-                "eventID": self.catalogue.origins.eventID[idx],
-                "idx": idx[idx]})
-            grps = mag_cat.groupby("eventID")
-            mag_grps = self.catalogue.magnitudes.groupby("eventID")
-            event_list = []
-            for key in grps.groups.keys():
-                if np.all(mag_grps.get_group(key)["idx"].values):
-                    event_list.append(key)
-            event_list = np.array(event_list)
-            del self.catalogue.magnitudes["idx"]
-        else:
-            raise ValueError(
-                "Selection Type must correspond to 'any' or 'all'")
-            
-        select_idx1 = self.catalogue.magnitudes.eventID.isin(event_list)
-        select_idx2 = self.catalogue.origins.eventID.isin(event_list)
-        if self.copycat:
-            output_catalogue = CatalogueDB()
-            output_catalogue.magnitudes =\
-                self.catalogue.magnitudes[select_idx1]
-            output_catalogue.origins = self.catalogue.origins[select_idx2]
-            _ = output_catalogue._get_number_origins_magnitudes
-        else:
-            self.catalogue.magnitudes = self.catalogue.magnitude[select_idx1]
-            self.catalogue.origins = self.catalogue.origins[select_idx2]
-        return output_catalogue
+        event_codes = self.catalogue.get_event_codes()
+        selected = get_selected_events(event_codes.magnitude_codes,
+                                       event_codes.magnitude_offsets, idx,
+                                       select_type)
+        return self.catalogue.select_events(selected, not self.copycat)
     
     def select_by_agency(self, agency, select_type="any"):
         """
         Selects by agency type
         """
+        if self.catalogue.can_query_store(ORIGIN_KEY, ["Agency"]):
+            return self.catalogue.select_from_store(
+                ORIGIN_KEY, "Agency == %s" % _get_where_value(agency),
+                select_type)
         idx = self.catalogue.origins.Agency == agency
         return self._select_by_origins(idx, select_type)
 
@@ -298,18 +822,26 @@ class CatalogueSelector(object):
         """
         if not mag_agency:
             mag_agency = agency
-        select_idx1 = self.catalogue.magnitudes.magAgency == mag_agency
-        select_idx2 = self.catalogue.origins.Agency == agency
-        if self.copycat:
-            output_catalogue = CatalogueDB()
-            output_catalogue.magnitudes =\
-                self.catalogue.magnitudes[select_idx1]
-            output_catalogue.origins = self.catalogue.origins[select_idx2]
-            _ = output_catalogue._get_number_origins_magnitudes
-        else:
-            self.catalogue.magnitudes = self.catalogue.magnitude[select_idx1]
-            self.catalogue.origins = self.catalogue.origins[select_idx2]
-        return output_catalogue
+        if self.catalogue.can_query_store(ORIGIN_KEY, ["Agency"]) and\
+                self.catalogue.can_query_store(MAGNITUDE_KEY, ["magAgency"]):
+            output_catalogue = CatalogueDB(
+                categorical=self.catalogue.categorical)
+            origins = pd.read_hdf(
+                self.catalogue.filename, ORIGIN_KEY,
+                where="Agency == %s" % _get_where_value(agency))
+            magnitudes = pd.read_hdf(
+                self.catalogue.filename, MAGNITUDE_KEY,
+                where="magAgency == %s" % _get_where_value(mag_agency))
+            if self.catalogue.categorical:
+                origins, magnitudes = to_categorical(origins, magnitudes)
+            output_catalogue.origins = origins
+            output_catalogue.magnitudes = magnitudes
+            _ = output_catalogue._get_number_origins_magnitudes()
+            return output_catalogue
+        return self.catalogue.select_rows(
+            self.catalogue.origins.Agency == agency,
+            self.catalogue.magnitudes.magAgency == mag_agency,
+            not self.copycat)
 
     def select_within_depth_range(self, upper_depth=None, lower_depth=None,
             select_type="any"):
@@ -320,12 +852,12 @@ class CatalogueSelector(object):
             upper_depth = 0.0
         if not lower_depth:
             lower_depth = np.inf
-        idx = (self.catalogue.origins["depth"] >= upper_depth) &\
-            (self.catalogue.origins["depth"] <= lower_depth) &\
-            (self.catalogue.origins["depth"].notnull())
-        
-        #idx[np.logical_not(np.isnan(self.catalogue.origins["depth"]))] = False
-        #idix[np.isnan(self.catalogue.origins["depth"])]
+        if self.catalogue.can_query_store(ORIGIN_KEY, ["depth"]):
+            return self.catalogue.select_from_store(
+                ORIGIN_KEY, _get_depth_range_where(upper_depth, lower_depth),
+                select_type)
+        idx = _get_depth_range_index(self.catalogue.origins, upper_depth,
+                                     lower_depth)
         return self._select_by_origins(idx, select_type)
 
     def select_within_magnitude_range(self, lower_mag=None, upper_mag=None,
@@ -337,34 +869,625 @@ class CatalogueSelector(object):
             lower_mag = -np.inf
         if not upper_mag:
             upper_mag = np.inf
-        idx = (self.catalogue.magnitudes["value"] >= lower_mag) &\
-            (self.catalogue.magnitudes["value"] <= upper_mag)
+        if self.catalogue.can_query_store(MAGNITUDE_KEY, ["value"]):
+            return self.catalogue.select_from_store(
+                MAGNITUDE_KEY, _get_magnitude_range_where(lower_mag,
+                                                          upper_mag),
+                select_type)
+        idx = _get_magnitude_range_index(self.catalogue.magnitudes,
+                                         lower_mag, upper_mag)
         return self._select_by_magnitudes(idx, select_type)
 
     def select_within_polygon(self, poly_lons, poly_lats, select_type="any"):
         """
         Select within a polygon
         """
-        polypath = Path(np.column_stack([poly_lons, poly_lats]))
-        idx = pd.Series(polypath.contains_points(np.column_stack([
-            self.catalogue.origins["longitude"].values,
-            self.catalogue.origins["latitude"].values])))
-        idx = idx & self.catalogue.origins["depth"].notnull()
+        rows = self.catalogue.get_spatial_index().select_within_polygon(
+            poly_lons, poly_lats)
+        return self._select_by_origin_rows(rows, select_type, True)
+
+    def _select_by_origin_rows(self, rows, select_type="any",
+                               depth_required=False):
+        """
+        Returns a catalogue selected by the origins at the given rows of the
+        origin table (e.g. from the spatial or time index), optionally only
+        those that have a depth
+        """
+        columns = ["depth"] if depth_required else []
+        if self.catalogue.can_query_store(ORIGIN_KEY, columns):
+            # Only the origins at the rows are read and tested
+            row_filter = None
+            if depth_required:
+                row_filter = lambda origins: origins["depth"].notnull().values
+            return self.catalogue.select_from_store(
+                ORIGIN_KEY, None, select_type, row_filter, rows)
+        idx = np.zeros(self.catalogue.origins.shape[0], dtype=bool)
+        idx[rows] = True
+        idx = pd.Series(idx, index=self.catalogue.origins.index)
+        if depth_required:
+            idx &= self.catalogue.origins["depth"].notnull()
         return self._select_by_origins(idx, select_type)
 
     def select_within_bounding_box(self, bounds, select_type="any"):
         """
-        Selects within a bounding box
+        Selects within a bounding box [llon, llat, ulon, ulat] (bounds
+        included)
+        """
+        rows = self.catalogue.get_spatial_index().select_within_bounding_box(
+            bounds)
+        return self._select_by_origin_rows(rows, select_type, True)
+
+    def select_within_time_window(self, start_time=None, end_time=None,
+            select_type="any"):
+        """
+        Selects the events with origins within a time window, found by
+        binary search in the time index of the catalogue (see
+        :meth: CatalogueDB.get_time_index)
+        :param start_time:
+            Start of the window as instance of datetime.datetime (or None
+            for no lower limit)
+        :param end_time:
+            End of the window as instance of datetime.datetime (or None
+            for no upper limit)
+        """
+        start = -np.inf
+        end = np.inf
+        if start_time:
+            start = datetime_to_decimal_time(start_time.date(),
+                                             start_time.time())[0]
+        if end_time:
+            end = datetime_to_decimal_time(end_time.date(),
+                                           end_time.time())[0]
+        rows = self.catalogue.get_time_window_rows(start, end)
+        return self._select_by_origin_rows(rows, select_type)
+
+
+def _get_depth_range_index(origins, upper_depth, lower_depth):
+    """
+    Returns the boolean index of the origins with depths within the range
+    [upper_depth, lower_depth]
+    """
+    return (origins["depth"] >= upper_depth) &\
+        (origins["depth"] <= lower_depth) &\
+        (origins["depth"].notnull())
+
+
+def _get_magnitude_range_index(magnitudes, lower_mag, upper_mag):
+    """
+    Returns the boolean index of the magnitudes with values within the range
+    [lower_mag, upper_mag]
+    """
+    return (magnitudes["value"] >= lower_mag) &\
+        (magnitudes["value"] <= upper_mag)
+
+
+def _get_depth_range_where(upper_depth, lower_depth):
+    """
+    Returns the PyTables where expression of the origins with depths within
+    the range [upper_depth, lower_depth]
+    """
+    # The limits are rounded to the single precision of the stored column,
+    # as in the comparisons made in memory
+    where = "depth >= %s" % _get_where_value(np.float32(upper_depth))
+    if np.isfinite(lower_depth):
+        where += " & depth <= %s" % _get_where_value(
+            np.float32(lower_depth))
+    return where
+
+
+def _get_magnitude_range_where(lower_mag, upper_mag):
+    """
+    Returns the PyTables where expression of the magnitudes with values
+    within the range [lower_mag, upper_mag], or None if unbounded
+    """
+    where = []
+    # Limits rounded to the single precision of the stored column
+    if np.isfinite(lower_mag):
+        where.append("value >= %s" % _get_where_value(np.float32(lower_mag)))
+    if np.isfinite(upper_mag):
+        where.append("value <= %s" % _get_where_value(np.float32(upper_mag)))
+    return " & ".join(where) or None
+
+
+def _get_polygon_index(origins, polypath):
+    """
+    Returns the boolean array of the origins with a depth within a polygon
+    (as instance of matplotlib.path.Path)
+    """
+    return polypath.contains_points(np.column_stack([
+        origins["longitude"].values, origins["latitude"].values])) &\
+        origins["depth"].notnull().values
+
+
+def _get_bounding_box_index(origins, bounds):
+    """
+    Returns the boolean array of the origins with a depth within a bounding
+    box [llon, llat, ulon, ulat] (bounds included)
+    """
+    return (origins["longitude"] >= bounds[0]).values &\
+        (origins["longitude"] <= bounds[2]).values &\
+        (origins["latitude"] >= bounds[1]).values &\
+        (origins["latitude"] <= bounds[3]).values &\
+        origins["depth"].notnull().values
+
+
+def _get_rows_with_depth(catalogue, rows):
+    """
+    Returns the rows of the origin table of a catalogue at which the origin
+    has a depth, reading only those rows in lazy mode
+    """
+    if not len(rows):
+        return rows
+    if catalogue.is_lazy():
+        store = pd.HDFStore(catalogue.filename, "r")
+        try:
+            depths = store.select(ORIGIN_KEY, where=rows,
+                                  columns=["depth"])["depth"].values
+        finally:
+            store.close()
+    else:
+        depths = catalogue.origins["depth"].values[rows]
+    return rows[np.logical_not(np.isnan(depths))]
+
+
+# Step of a CatalogueQuery: the table the predicate applies to (ORIGIN_KEY
+# or MAGNITUDE_KEY), the predicate (returning the boolean index of the rows
+# of a dataframe of the table), the selection type ("any", "all" or
+# "limit"), a description for the plan and, optionally, a PyTables where
+# expression equivalent to the predicate (None for all rows) with the columns
+# it uses, or a function returning the sorted rows of the table satisfying
+# the predicate from the indices of a catalogue
+QueryStep = namedtuple("QueryStep",
+                       ["key", "predicate", "select_type", "description",
+                        "where", "columns", "get_rows"])
+
+
+class CatalogueQuery(object):
+    """
+    Lazy, composable selection of an instance of :class: CatalogueDB. The
+    selection methods mirror those of :class: CatalogueSelector, but only
+    add a step to the query plan and return a new query, such that queries
+    can be chained and reused. The plan is applied by execute(), which
+    evaluates each predicate once and combines the steps into a single set
+    of events and a single pair of origin and magnitude masks, copying the
+    tables only once. As in CatalogueSelector, spatial and time steps are
+    evaluated with the spatial and time indices of the catalogue and, for a
+    lazy catalogue, the other steps are evaluated by PyTables on the data
+    columns of the file where possible, with only the selected rows read.
+    The result is the same as applying the corresponding CatalogueSelector
+    methods in order, e.g.
+
+    >> query = CatalogueQuery(catalogue).select_within_depth_range(0., 40.)
+    >> query = query.select_within_magnitude_range(5.0).select_by_agency("ISC")
+    >> print query.explain()
+    >> selection = query.execute()
+    """
+    def __init__(self, catalogue, steps=None):
+        """
+        Instantiate with the catalogue and, optionally, the steps of the plan
+        as list of instances of QueryStep
+        """
+        self.catalogue = catalogue
+        self.steps = steps or []
+
+    def _add_step(self, key, predicate, select_type, description, where=None,
+                  columns=None, get_rows=None):
+        """
+        Returns a new query with a step added to the plan
+        """
+        if not select_type in ["any", "all", "limit"]:
+            raise ValueError(
+                "Selection Type must correspond to 'any' or 'all'")
+        return CatalogueQuery(self.catalogue, self.steps + [
+            QueryStep(key, predicate, select_type, description, where,
+                      columns or [], get_rows)])
+
+    def select_by_agency(self, agency, select_type="any"):
+        """
+        Selects by agency type
+        """
+        return self._add_step(
+            ORIGIN_KEY, lambda origins: origins["Agency"] == agency,
+            select_type, "Agency == %s" % agency,
+            "Agency == %s" % _get_where_value(agency), ["Agency"])
+
+    def limit_to_agency(self, agency, mag_agency=None):
+        """
+        Limits the catalogue to just those origins and magnitudes reported by
+        the specific agency
+        """
+        if not mag_agency:
+            mag_agency = agency
+        query = self._add_step(
+            ORIGIN_KEY, lambda origins: origins["Agency"] == agency,
+            "limit", "Agency == %s" % agency,
+            "Agency == %s" % _get_where_value(agency), ["Agency"])
+        return query._add_step(
+            MAGNITUDE_KEY, lambda mags: mags["magAgency"] == mag_agency,
+            "limit", "magAgency == %s" % mag_agency,
+            "magAgency == %s" % _get_where_value(mag_agency), ["magAgency"])
+
+    def select_within_depth_range(self, upper_depth=None, lower_depth=None,
+            select_type="any"):
+        """
+        Selects within a depth range
+        """
+        if not upper_depth:
+            upper_depth = 0.0
+        if not lower_depth:
+            lower_depth = np.inf
+        return self._add_step(
+            ORIGIN_KEY,
+            lambda origins: _get_depth_range_index(origins, upper_depth,
+                                                   lower_depth),
+            select_type, "%s <= depth <= %s" % (upper_depth, lower_depth),
+            _get_depth_range_where(upper_depth, lower_depth), ["depth"])
+
+    def select_within_magnitude_range(self, lower_mag=None, upper_mag=None,
+            select_type="any"):
+        """
+        Selects within a magnitude range
+        """
+        if not lower_mag:
+            lower_mag = -np.inf
+        if not upper_mag:
+            upper_mag = np.inf
+        return self._add_step(
+            MAGNITUDE_KEY,
+            lambda mags: _get_magnitude_range_index(mags, lower_mag,
+                                                    upper_mag),
+            select_type, "%s <= value <= %s" % (lower_mag, upper_mag),
+            _get_magnitude_range_where(lower_mag, upper_mag), ["value"])
+
+    def select_within_polygon(self, poly_lons, poly_lats, select_type="any"):
+        """
+        Select within a polygon
+        """
+        polypath = Path(np.column_stack([poly_lons, poly_lats]))
+        return self._add_step(
+            ORIGIN_KEY, lambda origins: _get_polygon_index(origins, polypath),
+            select_type, "within polygon of %d vertices" % len(poly_lons),
+            get_rows=lambda catalogue: _get_rows_with_depth(
+                catalogue,
+                catalogue.get_spatial_index().select_within_polygon(
+                    poly_lons, poly_lats)))
+
+    def select_within_bounding_box(self, bounds, select_type="any"):
+        """
+        Selects within a bounding box [llon, llat, ulon, ulat] (bounds
+        included)
+        """
+        return self._add_step(
+            ORIGIN_KEY,
+            lambda origins: _get_bounding_box_index(origins, bounds),
+            select_type, "within bounding box %s" % list(bounds),
+            get_rows=lambda catalogue: _get_rows_with_depth(
+                catalogue,
+                catalogue.get_spatial_index().select_within_bounding_box(
+                    bounds)))
+
+    def select_within_time_window(self, start_time=None, end_time=None,
+            select_type="any"):
+        """
+        Selects the events with origins within a time window (see
+        :meth: CatalogueSelector.select_within_time_window)
+        """
+        start = -np.inf
+        end = np.inf
+        if start_time:
+            start = datetime_to_decimal_time(start_time.date(),
+                                             start_time.time())[0]
+        if end_time:
+            end = datetime_to_decimal_time(end_time.date(),
+                                           end_time.time())[0]
+        return self._add_step(
+            ORIGIN_KEY,
+            lambda origins: _get_time_window_index(origins, start, end),
+            select_type, "%s <= time <= %s" % (start_time, end_time),
+            get_rows=lambda catalogue: catalogue.get_time_window_rows(start,
+                                                                      end))
+
+    def _get_table(self, key):
+        """
+        Returns the origin or magnitude table by table key
+        """
+        if key == ORIGIN_KEY:
+            return self.catalogue.origins
+        return self.catalogue.magnitudes
+
+    def _get_number_rows(self, key):
+        """
+        Returns the number of rows of the origin or magnitude table
+        """
+        number_origins, number_magnitudes =\
+            self.catalogue._get_number_origins_magnitudes()
+        if key == ORIGIN_KEY:
+            return number_origins
+        return number_magnitudes
+
+    def _evaluate_step(self, step):
         """
-        llon = bounds[0]
-        ulon = bounds[2]
-        llat = bounds[1]
-        ulat = bounds[3]
-        bbox = np.array([[llon, ulat],
-                         [ulon, ulat],
-                         [ulon, llat],
-                         [llon, llat]])
-        return self.select_within_polygon(bbox[:, 0], bbox[:, 1], select_type)
+        Returns the boolean index of the rows of the table of a step that
+        satisfy its predicate, using the indices of the catalogue or the
+        data columns of the file if possible
+        """
+        if step.get_rows is not None:
+            rows = step.get_rows(self.catalogue)
+        elif step.columns and self.catalogue.can_query_store(step.key,
+                                                             step.columns):
+            store = pd.HDFStore(self.catalogue.filename, "r")
+            try:
+                rows = store.select_as_coordinates(step.key, step.where)
+            finally:
+                store.close()
+        else:
+            return np.asarray(step.predicate(self._get_table(step.key)),
+                              dtype=bool)
+        idx = np.zeros(self._get_number_rows(step.key), dtype=bool)
+        idx[rows] = True
+        return idx
+
+    def evaluate(self):
+        """
+        Applies the plan to the tables of the catalogue
+        :returns:
+            event_ids - IDs of the selected events
+            origin_mask - Boolean mask of the selected origins
+            mag_mask - Boolean mask of the selected magnitudes
+        """
+        codes = self.catalogue.get_event_codes()
+        n_events = len(codes.event_ids)
+        event_codes = {ORIGIN_KEY: codes.origin_codes,
+                       MAGNITUDE_KEY: codes.magnitude_codes}
+        masks = {ORIGIN_KEY: np.ones(len(codes.origin_codes), dtype=bool),
+                 MAGNITUDE_KEY: np.ones(len(codes.magnitude_codes),
+                                        dtype=bool)}
+        for step in self.steps:
+            idx = self._evaluate_step(step)
+            if step.select_type == "limit":
+                masks[step.key] &= idx
+                continue
+            # Events with any (or all) of their remaining rows selected
+            step_codes = event_codes[step.key]
+            n_selected = np.bincount(step_codes[masks[step.key] & idx],
+                                     minlength=n_events)
+            if step.select_type == "all":
+                n_rows = np.bincount(step_codes[masks[step.key]],
+                                     minlength=n_events)
+                selected = (n_selected == n_rows) & (n_rows > 0)
+            else:
+                selected = n_selected > 0
+            for key in masks:
+                masks[key] &= selected[event_codes[key]]
+        selected = np.unique(np.concatenate([
+            event_codes[ORIGIN_KEY][masks[ORIGIN_KEY]],
+            event_codes[MAGNITUDE_KEY][masks[MAGNITUDE_KEY]]]))
+        return (codes.event_ids[selected], masks[ORIGIN_KEY],
+                masks[MAGNITUDE_KEY])
+
+    def execute(self):
+        """
+        Applies the plan and returns the selection as a new instance of
+        :class: CatalogueDB
+        """
+        _, origin_mask, mag_mask = self.evaluate()
+        return self.catalogue.select_rows(origin_mask, mag_mask)
+
+    def _get_sample(self, key, sample_size, random):
+        """
+        Returns a random sample of at most sample_size rows of a table,
+        reading only the sampled rows in lazy mode
+        """
+        number_rows = self._get_number_rows(key)
+        if number_rows <= sample_size:
+            rows = None
+        else:
+            rows = np.sort(random.choice(number_rows, sample_size,
+                                         replace=False))
+        if not self.catalogue.is_lazy():
+            table = self._get_table(key)
+            return table if rows is None else table.iloc[rows]
+        store = pd.HDFStore(self.catalogue.filename, "r")
+        try:
+            if rows is None:
+                return store.select(key)
+            return store.select(key, where=rows)
+        finally:
+            store.close()
+
+    def explain(self, sample_size=10000, seed=None):
+        """
+        Returns the plan as a string, with the selectivity of each step
+        estimated from a random sample of the rows of its table. The
+        selectivity is the fraction of the rows of the table satisfying the
+        predicate of the step, independently of the previous steps
+        :param int sample_size:
+            Maximum number of rows of each table on which the predicates are
+            evaluated
+        :param int seed:
+            Seed of the random sample
+        """
+        names = {ORIGIN_KEY: "origins", MAGNITUDE_KEY: "magnitudes"}
+        random = np.random.RandomState(seed)
+        lines = ["Query on %d origins and %d magnitudes" %
+                 self.catalogue._get_number_origins_magnitudes()]
+        for iloc, step in enumerate(self.steps):
+            table = self._get_sample(step.key, sample_size, random)
+            if table.shape[0]:
+                fraction = np.mean(np.asarray(step.predicate(table),
+                                              dtype=bool))
+            else:
+                fraction = 0.0
+            lines.append("%d. %s %s: %s (estimated selectivity %.1f %%, "
+                         "~%d rows)" % (iloc + 1, step.select_type,
+                                        names[step.key], step.description,
+                                        100.0 * fraction,
+                                        fraction *
+                                        self._get_number_rows(step.key)))
+        return "\n".join(lines)
+
+
+def get_decimal_time(origins):
+    """
+    Returns the decimal time of the origins of a table
+    """
+    return utils.decimal_time(origins["year"].values.astype(int),
+                              origins["month"].values.astype(int),
+                              origins["day"].values.astype(int),
+                              origins["hour"].values.astype(int),
+                              origins["minute"].values.astype(int),
+                              origins["second"].values.astype(float))
+
+
+def _get_time_window_index(origins, start, end):
+    """
+    Returns the boolean array of the origins with decimal times within the
+    window [start, end]
+    """
+    dtime = get_decimal_time(origins)
+    return (dtime >= start) & (dtime <= end)
+
+
+def _get_zone_rows(index, depths, poly_lons, poly_lats, depth_band=None):
+    """
+    Returns the sorted rows of the origins within a polygon (using the
+    spatial index) with a depth, optionally within a depth band
+    (upper_depth, lower_depth)
+    """
+    rows = index.select_within_polygon(poly_lons, poly_lats)
+    rows = rows[np.logical_not(np.isnan(depths[rows]))]
+    if depth_band is not None:
+        depth = depths[rows]
+        rows = rows[(depth >= depth_band[0]) & (depth <= depth_band[1])]
+    return rows
+
+
+# Spatial index and origin depths shared by the processes of the pool of
+# assign_source_zones, set when each process starts
+_ZONE_DATA = {}
+
+
+def _init_zone_process(index, depths):
+    """
+    Stores the spatial index and the depths in a process of the pool
+    """
+    _ZONE_DATA["index"] = index
+    _ZONE_DATA["depths"] = depths
+
+
+def _get_zone_chunk_rows(zones):
+    """
+    Returns the rows of the origins within each of a list of zones, given as
+    (poly_lons, poly_lats, depth_band). Defined at module level so that it
+    can be dispatched to a multiprocessing pool
+    """
+    return [_get_zone_rows(_ZONE_DATA["index"], _ZONE_DATA["depths"], *zone)
+            for zone in zones]
+
+
+def assign_source_zones(catalogue, polygons, depth_bands=None, processes=1,
+                        zones_per_task=10):
+    """
+    Assigns the origins of a catalogue to source zones in a single pass,
+    using the spatial index of the catalogue (see
+    :meth: CatalogueDB.get_spatial_index) to test each polygon only against
+    the origins in the cells it overlaps. As in
+    :meth: CatalogueSelector.select_within_polygon, only origins with a depth
+    are assigned. An origin within several zones is assigned to the first
+    of them
+    :param catalogue:
+        Catalogue as instance of :class: CatalogueDB
+    :param list polygons:
+        Polygons of the zones as list of (poly_lons, poly_lats)
+    :param list depth_bands:
+        Depth band (upper_depth, lower_depth) of each zone, or None for a
+        zone without depth limits
+    :param int processes:
+        Number of processes among which the zones are divided (None for
+        the number of CPUs)
+    :param int zones_per_task:
+        Number of zones sent to a process at a time
+    :returns:
+        Zone of each origin (position of its polygon in the list, or -1 if
+        not within any zone) as pandas.Series aligned with the origin table
+    """
+    if depth_bands is None:
+        depth_bands = [None] * len(polygons)
+    if len(depth_bands) != len(polygons):
+        raise ValueError("One depth band is needed for each polygon")
+    index = catalogue.get_spatial_index()
+    depths = catalogue.origins["depth"].values.astype(float)
+    zones = [(poly_lons, poly_lats, depth_band) for (poly_lons, poly_lats),
+             depth_band in zip(polygons, depth_bands)]
+    chunks = [zones[i:(i + zones_per_task)]
+              for i in range(0, len(zones), zones_per_task)]
+    if not processes:
+        processes = multiprocessing.cpu_count()
+    if processes > 1 and len(chunks) > 1:
+        pool = multiprocessing.Pool(processes, _init_zone_process,
+                                    (index, depths))
+        try:
+            # imap preserves the order of the zones
+            zone_rows = [rows for chunk_rows in
+                         pool.imap(_get_zone_chunk_rows, chunks)
+                         for rows in chunk_rows]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        zone_rows = [_get_zone_rows(index, depths, *zone) for zone in zones]
+    zone_ids = -np.ones(len(depths), dtype=int)
+    for zone_id, rows in enumerate(zone_rows):
+        rows = rows[zone_ids[rows] < 0]
+        zone_ids[rows] = zone_id
+    return pd.Series(zone_ids, index=catalogue.origins.index, name="zone")
+
+
+def get_zone_catalogues(catalogue, zones, number_zones=None):
+    """
+    Splits a catalogue by source zone (see assign_source_zones). The origins
+    and magnitudes are ordered by zone once, and the catalogue of each zone
+    holds slices of the ordered tables (views without copies). The
+    magnitudes take the zone of their origin
+    :param catalogue:
+        Catalogue as instance of :class: CatalogueDB
+    :param zones:
+        Zone of each origin (-1 for none)
+    :param int number_zones:
+        Number of zones (defaults to the largest zone + 1)
+    :returns:
+        List of the catalogues of the zones as instances of
+        :class: CatalogueDB
+    """
+    zones = np.asarray(zones, dtype=int)
+    if number_zones is None:
+        number_zones = np.max(zones) + 1 if len(zones) else 0
+    mag_zones = pd.merge(
+        catalogue.magnitudes[["eventID", "originID"]],
+        pd.DataFrame({"eventID": catalogue.origins["eventID"].values,
+                      "originID": catalogue.origins["originID"].values,
+                      "zone": zones}).drop_duplicates(["eventID",
+                                                       "originID"]),
+        on=["eventID", "originID"], how="left")["zone"]
+    mag_zones = mag_zones.fillna(-1).values.astype(int)
+    tables = []
+    for table, table_zones in [(catalogue.origins, zones),
+                               (catalogue.magnitudes, mag_zones)]:
+        order = np.argsort(table_zones, kind="mergesort")
+        tables.append((table.iloc[order], np.searchsorted(
+            table_zones[order], np.arange(number_zones + 1))))
+    (origins, origin_offsets), (magnitudes, mag_offsets) = tables
+    zone_catalogues = []
+    for zone in range(number_zones):
+        zone_catalogue = CatalogueDB(
+            categorical=getattr(catalogue, "categorical", False))
+        zone_catalogue.origins = origins.iloc[
+            origin_offsets[zone]:origin_offsets[zone + 1]]
+        zone_catalogue.magnitudes = magnitudes.iloc[
+            mag_offsets[zone]:mag_offsets[zone + 1]]
+        _ = zone_catalogue._get_number_origins_magnitudes()
+        zone_catalogues.append(zone_catalogue)
+    return zone_catalogues
 
 
 def get_agency_origin_count(catalogue):
@@ -373,10 +1496,13 @@ def get_agency_origin_count(catalogue):
     agency
     """
     agency_count = catalogue.origins["Agency"].value_counts()
+    # Categorical columns also count the categories not present, and their
+    # counts are indexed by category, so are taken by position
+    agency_count = agency_count[agency_count > 0]
     count_list = []
     agency_list = agency_count.keys()
     for iloc in range(0, len(agency_count)):
-        count_list.append((agency_list[iloc], agency_count[iloc]))
+        count_list.append((agency_list[iloc], agency_count.iloc[iloc]))
     return count_list
 
 
@@ -386,10 +1512,13 @@ def get_agency_magnitude_count(catalogue):
     agency
     """
     agency_count = catalogue.magnitudes["magAgency"].value_counts()
+    # Categorical columns also count the categories not present, and their
+    # counts are indexed by category, so are taken by position
+    agency_count = agency_count[agency_count > 0]
     count_list = []
     agency_list = agency_count.keys()
     for iloc in range(0, len(agency_count)):
-        count_list.append((agency_list[iloc], agency_count[iloc]))
+        count_list.append((agency_list[iloc], agency_count.iloc[iloc]))
     return count_list
 
 
@@ -399,7 +1528,7 @@ def get_agency_magtype_statistics(catalogue, pretty_print=True):
     each agency
     """
     agency_count = get_agency_origin_count(catalogue)
-    mag_group = catalogue.magnitudes.groupby("magAgency")
+    mag_group = catalogue.magnitudes.groupby("magAgency", observed=True)
     mag_group_keys = mag_group.groups.keys()
     output = []
     for agency, n_origins in agency_count:
@@ -412,7 +1541,7 @@ def get_agency_magtype_statistics(catalogue, pretty_print=True):
 
         grp1 = mag_group.get_group(agency)
         mag_counts = grp1["magType"].value_counts()
-        mag_counts = mag_counts.iteritems()
+        mag_counts = mag_counts[mag_counts > 0].iteritems()
         if pretty_print:
             print "%s" % " | ".join(["{:s} ({:d})".format(val[0], val[1])
                                      for val in mag_counts])
@@ -436,6 +1565,11 @@ def get_agency_magnitude_pairs(catalogue, pair1, pair2, no_case=False):
         the dependent variable
     :params bool no_case:
         Makes the selection case sensitive (True) or ignore case (False)
+    :returns:
+        Dictionary of the magnitudes and uncertainties of the two pairs (one
+        entry for each magnitude of pair 2 from an event with a magnitude of
+        pair 1) and the catalogue of the common events. When an event has
+        several magnitudes of pair 1, that with the largest originID is used
     """
     if no_case:
         case1_select = (
@@ -460,53 +1594,55 @@ def get_agency_magnitude_pairs(catalogue, pair1, pair2, no_case=False):
         print "Agency-Pair: (%s, %s) returned no magnitudes" %(pair2[0],
                                                                pair2[1])
         return None, None
-    select_cat1 = catalogue.magnitudes[case1_select]
-    select_cat2 = catalogue.magnitudes[case2_select]
-    # See if any eventIDs in the second catalogues are in the first
-    idx = select_cat2.eventID.isin(select_cat1.eventID)
-    num_events = np.sum(idx)
-    if np.any(idx):
+    event_codes = catalogue.get_event_codes()
+    case1_select = np.asarray(case1_select, dtype=bool)
+    case2_select = np.asarray(case2_select, dtype=bool)
+    select_cat1 = pd.DataFrame({
+        "code": event_codes.magnitude_codes[case1_select],
+        "value": catalogue.magnitudes["value"].values[case1_select],
+        "sigma": catalogue.magnitudes["sigma"].values[case1_select]})
+    select_cat2 = pd.DataFrame({
+        "position": np.arange(np.sum(case2_select)),
+        "code": event_codes.magnitude_codes[case2_select],
+        "value": catalogue.magnitudes["value"].values[case2_select],
+        "sigma": catalogue.magnitudes["sigma"].values[case2_select]})
+    # Each event of the first pair is represented by the magnitude with the
+    # largest originID (the first of them if repeated, as with np.argmax)
+    origin_rank = pd.factorize(np.asarray(
+        catalogue.magnitudes["originID"].values[case1_select], dtype=object),
+        sort=True)[0]
+    order = np.lexsort((np.arange(len(origin_rank)), -origin_rank))
+    select_cat1 = select_cat1.iloc[order].drop_duplicates("code")
+    # Magnitudes of the second pair from events of the first pair. The inner
+    # merge groups the rows by key, so the order of the second pair is
+    # restored from the positions
+    common_catalogue = pd.merge(select_cat2, select_cat1, on="code",
+                                how="inner", suffixes=("2", "1"))
+    common_catalogue = common_catalogue.sort_values("position",
+                                                    kind="mergesort")
+    num_events = common_catalogue.shape[0]
+    if num_events:
         print "Agency-Pairs: (%s, %s) & (%s, %s) returned %d events" % (
-            pair1[0], pair1[1], pair2[0], pair2[1], np.sum(idx))
-    
+            pair1[0], pair1[1], pair2[0], pair2[1], num_events)
     else:
         # No common events
         print "Agency-Pairs: (%s, %s) & (%s, %s) returned 0 events" % (
             pair1[0], pair1[1], pair2[0], pair2[1])
         return None, None
-        
-    common_catalogue = select_cat2[idx]
-    cat1_groups = select_cat1.groupby("eventID")
-    mag1 = []
-    sigma1 = []
-    mag2 = []
-    sigma2 = []
-    for row in list(common_catalogue.iterrows()):
-        #print row
-        mag2.append(row[1].value)
-        sigma2.append(row[1].sigma)
-        event1 = cat1_groups.get_group(row[1].eventID)
-        if len(event1) > 1:
-            event1 = event1.iloc[np.argmax(event1["originID"].values)]
-            mag1.append(event1.value.tolist())
-            sigma1.append(event1.sigma.tolist())
-        else:
-            mag1.extend(event1.value.tolist())
-            sigma1.extend(event1.sigma.tolist())
-
-    output_catalogue = CatalogueDB()
-    output_catalogue.origins = catalogue.origins[
-        catalogue.origins.eventID.isin(common_catalogue.eventID)]
-    output_catalogue.magnitudes = catalogue.magnitudes[
-        catalogue.magnitudes.eventID.isin(common_catalogue.eventID)]
-    _, _ = output_catalogue._get_number_origins_magnitudes()
+    mag1 = common_catalogue["value1"].values.astype(float)
+    sigma1 = common_catalogue["sigma1"].values.astype(float)
+    mag2 = common_catalogue["value2"].values.astype(float)
+    sigma2 = common_catalogue["sigma2"].values.astype(float)
+    selected = np.zeros(len(event_codes.event_ids), dtype=bool)
+    selected[common_catalogue["code"].values] = True
+    output_catalogue = catalogue.select_events(selected)
     pair_1_key = "{:s}({:s})".format(pair1[1],pair1[0])
     pair_2_key = "{:s}({:s})".format(pair2[1],pair2[0])
     return OrderedDict([
-        (pair_1_key, np.array(mag1)),
-        (pair_1_key + " Sigma", np.array(sigma1)),                   
-        (pair_2_key, np.array(mag2)),
-        (pair_2_key + " Sigma", np.array(sigma2))]), output_catalogue
+        (pair_1_key, mag1),
+        (pair_1_key + " Sigma", sigma1),
+        (pair_2_key, mag2),
+        (pair_2_key + " Sigma", sigma2)]), output_catalogue
 
 def mine_agency_magnitude_combinations(catalogue, agency_mag_data, threshold,
         no_case=False):
@@ -1058,7 +2194,7 @@ def plot_catalogue_map(config, catalogue, magnitude_scale=False,
                     catalogue.origins["latitude"].values)
     if magnitude_scale:
         magnitudes = []
-        mag_grps = catalogue.magnitudes.groupby("originID")
+        mag_grps = catalogue.magnitudes.groupby("originID", observed=True)
         for key in catalogue.origins.originID.values:
             if key in catalogue.magnitudes.originID.values:
                 grp = mag_grps.get_group(key)
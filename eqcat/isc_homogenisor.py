@@ -755,11 +755,13 @@ class DuplicateFinder(object):
         self.time_window = time_window / SECS_PER_YEAR
         self.dist_window = distance_window
         self.mag_window = magnitude_window
+        self.magnitude_conflicts = []
 
     def merge_catalogue(self, catalogue):
         '''
         Merge a second catalogue in ISFCatalogue format into the reference
-        catalogue
+        catalogue. Magnitude conflicts found when merging duplicate events
+        are added to the list self.magnitude_conflicts
         '''
         # Get event key list
         ref_keys = self.reference.get_event_key_list()
@@ -782,12 +784,15 @@ class DuplicateFinder(object):
                 dup_event = self.compare_duplicate_list(event, idx, dtime)
                 if dup_event:
                     # Merge origins of new catalogue into origin of reference
-                    self.reference.events[dup_event].merge_secondary_origin(
-                        event.origins)
+                    ref_event = self.reference.events[dup_event]
+                    self.magnitude_conflicts.extend(
+                        ref_event.merge_secondary_origin(event.origins))
                 else:
-                    self.reference.events.append(event)        
+                    self.reference.events.append(event)
 
-        # Sort reference events
+        # Sort reference events - the merged origins may have changed the
+        # prime origins of the reference events
+        self.reference.invalidate_cache()
         ref_times = self.reference.get_decimal_dates()
         ascend_time = np.argsort(ref_times)
         event_list = [self.reference.events[ascend_time[i]]
@@ -830,8 +835,8 @@ class DuplicateFinder(object):
         if len(distance_valid) > 1:
             # Multiple possible duplicates!
             # Assign to nearest event in time
-            print event.__dict__
-            print event.origins[0].__dict__
+            print str(event)
+            print str(event.origins[0])
             print distance_valid, len(distance_valid)
             #dtime = dtime[idx]
             dtime = dtime[distance_valid]
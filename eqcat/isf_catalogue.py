@@ -25,6 +25,7 @@ import h5py
 import pandas as pd
 from utils import decimal_time
 from math import fabs
+from collections import namedtuple
 
 
 DATAMAP = [("eventID", "a16"), ("originID", "a16"), ("Agency", "a14"), 
@@ -34,9 +35,551 @@ DATAMAP = [("eventID", "a16"), ("originID", "a16"), ("Agency", "a14"),
     ("semimajor90", "f4"), ("semiminor90", "f4"), ("error_strike", "f2"),
     ("depth_error", "f4"), ("prime", "i1")]
 
-MAGDATAMAP = [("eventID", "a12"), ("originID", "a12"), ("magnitudeID", "a40"), 
+MAGDATAMAP = [("eventID", "a12"), ("originID", "a12"), ("magnitudeID", "a40"),
     ("value", "f4"), ("sigma", "f4"), ("magType", "a6"), ("magAgency", "a14")]
 
+# Record of two magnitudes with the same (origin_id, author, scale) key but
+# different values, found when merging catalogues
+MagnitudeConflict = namedtuple("MagnitudeConflict",
+                               ["key", "current", "secondary"])
+
+# Columns of the table of the prime origins of a catalogue (one row per event)
+PRIME_ORIGIN_DTYPE = [("eventID", object), ("originID", object),
+    ("prime", bool), ("year", int), ("month", int), ("day", int),
+    ("hour", int), ("minute", int), ("second", float), ("longitude", float),
+    ("latitude", float), ("depth", float), ("magnitude", float)]
+
+# Version of the layout of the hdf5 catalogue tables, stored as the attribute
+# "schema_version" of each table. Version 1 adds the data columns below and
+# version 2 the location and magnitude value data columns
+SCHEMA_VERSION = 2
+
+# Table keys and indexed data columns of the hdf5 catalogue tables
+ORIGIN_KEY = "catalogue/origins"
+
+MAGNITUDE_KEY = "catalogue/magnitudes"
+
+ORIGIN_DATA_COLUMNS = ["eventID", "Agency", "year", "longitude", "latitude",
+                       "depth"]
+
+MAGNITUDE_DATA_COLUMNS = ["eventID", "value", "magType", "magAgency"]
+
+# Low cardinality string columns that can be stored as categoricals (their
+# codes and categories) in the hdf5 catalogue tables
+CATEGORICAL_COLUMNS = {ORIGIN_KEY: ["Agency"],
+                       MAGNITUDE_KEY: ["magType", "magAgency"]}
+
+# Default compression of the hdf5 catalogue tables (zlib is used if blosc is
+# not available) and number of rows written at a time
+COMPLIB = "blosc"
+
+COMPLEVEL = 5
+
+CHUNK_SIZE = 500000
+
+
+def _get_string_itemsize(datamap):
+    """
+    Returns the largest size of the string columns of the data map
+    """
+    return max([int(dtype[1:]) for _, dtype in datamap if dtype[0] == "a"])
+
+
+def _get_complib(complib):
+    """
+    Returns the compression library, falling back to zlib if the requested
+    library is not available to PyTables
+    """
+    import tables
+    if tables.which_lib_version(complib.split(":")[0]) is None:
+        return "zlib"
+    return complib
+
+
+def _get_catalogue_table_settings(key):
+    """
+    Returns the data map and data columns of a catalogue table
+    """
+    if key == ORIGIN_KEY:
+        return DATAMAP, ORIGIN_DATA_COLUMNS
+    elif key == MAGNITUDE_KEY:
+        return MAGDATAMAP, MAGNITUDE_DATA_COLUMNS
+    else:
+        raise ValueError("Unknown catalogue table %s" % key)
+
+
+def append_catalogue_table(store, key, dataframe, index=True,
+                           complib=COMPLIB, complevel=COMPLEVEL):
+    """
+    Appends a dataframe to one of the catalogue tables (ORIGIN_KEY or
+    MAGNITUDE_KEY) of an open pandas.HDFStore. New tables are created
+    compressed, with the indexed data columns of the table and with the
+    schema version attribute; appends to an existing table keep its layout.
+    The string columns are sized from the data maps so that later appends
+    with longer strings can be stored. If the table stores categorical
+    columns and the dataframe holds values outside their categories, the
+    table is first rewritten with the merged categories (see
+    rewrite_table_categories), keeping the positions of its rows
+    :param bool index:
+        Update the index of the data columns after appending (set to False
+        when appending many chunks, then call index_catalogue_tables)
+    :param str complib:
+        Compression library ("blosc", "zlib", ...) or None for no compression
+    :param int complevel:
+        Compression level (0 - 9)
+    """
+    data_columns = _get_catalogue_table_settings(key)[1]
+    if key in store:
+        categories = _get_table_categories(store, key)
+        new_categories = _get_new_categories(categories, dataframe)
+        if new_categories and not store.get_storer(key).nrows:
+            # An empty table is created again with the merged categories
+            store.remove(key)
+        elif new_categories:
+            rewrite_table_categories(store, key, new_categories)
+        dataframe = _to_categories(
+            dataframe, _merge_categories(categories, new_categories))
+    if key in store:
+        data_columns = store.get_storer(key).data_columns
+    else:
+        data_columns = [col for col in data_columns
+                        if col in dataframe.columns]
+    min_itemsize = _get_min_itemsize(key, dataframe, data_columns)
+    if key in store:
+        store.append(key, dataframe, min_itemsize=min_itemsize, index=index)
+        return
+    if complib and complevel:
+        complib = _get_complib(complib)
+    else:
+        complib = None
+        complevel = None
+    store.append(key, dataframe, min_itemsize=min_itemsize,
+                 data_columns=data_columns, index=index, complib=complib,
+                 complevel=complevel)
+    store.get_storer(key).attrs.schema_version = SCHEMA_VERSION
+
+
+def _get_min_itemsize(key, dataframe, data_columns):
+    """
+    Returns the sizes of the string columns of a catalogue table, as
+    defined by its data map
+    """
+    datamap = _get_catalogue_table_settings(key)[0]
+    min_itemsize = {"values": _get_string_itemsize(datamap)}
+    for name, dtype in datamap:
+        if name in data_columns and dtype[0] == "a" and\
+                not _is_categorical(dataframe[name]):
+            min_itemsize[name] = int(dtype[1:])
+    return min_itemsize
+
+
+def _is_categorical(column):
+    """
+    Returns True if a dataframe column is a pandas categorical
+    """
+    return pd.api.types.is_categorical_dtype(column.dtype)
+
+
+def _get_table_categories(store, key):
+    """
+    Returns the dictionary of the categorical columns of an existing table
+    and their categories
+    """
+    first_row = store.select(key, start=0, stop=1)
+    return dict([(col, first_row[col].cat.categories)
+                 for col in first_row.columns
+                 if _is_categorical(first_row[col])])
+
+
+def _get_new_categories(categories, dataframe):
+    """
+    Returns the dictionary of the categorical columns for which the
+    dataframe holds values outside the categories, and the sorted values to
+    add to their categories
+    """
+    new_categories = {}
+    for col in categories:
+        values = pd.unique(np.asarray(dataframe[col], dtype=object))
+        new_values = values[~pd.Index(values).isin(categories[col])]
+        if len(new_values):
+            new_categories[col] = np.sort(new_values)
+    return new_categories
+
+
+def _merge_categories(categories, new_categories):
+    """
+    Returns the categories of each column merged with the new categories
+    """
+    categories = categories.copy()
+    for col in new_categories:
+        categories[col] = pd.Index(np.union1d(
+            np.asarray(categories[col], dtype=object),
+            np.asarray(new_categories[col], dtype=object)))
+    return categories
+
+
+def _to_categories(dataframe, categories):
+    """
+    Converts the columns of a dataframe to categoricals with the given
+    categories
+    """
+    if not categories:
+        return dataframe
+    dataframe = dataframe.copy()
+    for col in categories:
+        dataframe[col] = pd.Categorical(
+            np.asarray(dataframe[col], dtype=object),
+            categories=categories[col])
+    return dataframe
+
+
+def rewrite_table_categories(store, key, new_categories,
+                             chunk_size=CHUNK_SIZE):
+    """
+    Adds categories to the categorical columns of a catalogue table of an
+    open pandas.HDFStore. As the categories of a stored categorical cannot
+    be changed by appending, the table is copied in chunks to a temporary
+    table with the merged categories, which then replaces it. The rows keep
+    their positions, and the table is left unchanged if the copy fails
+    :param dict new_categories:
+        Categories to add to each categorical column
+    :param int chunk_size:
+        Number of rows copied at a time
+    """
+    categories = _merge_categories(_get_table_categories(store, key),
+                                   new_categories)
+    storer = store.get_storer(key)
+    filters = storer.table.filters
+    temp_key = key + "_rewrite"
+    if temp_key in store:
+        store.remove(temp_key)
+    try:
+        for start in range(0, storer.nrows, chunk_size):
+            chunk = store.select(key, start=start, stop=start + chunk_size)
+            for col in categories:
+                chunk[col] = chunk[col].cat.set_categories(categories[col])
+            store.append(temp_key, chunk,
+                         min_itemsize=_get_min_itemsize(
+                             key, chunk, storer.data_columns),
+                         data_columns=storer.data_columns, index=False,
+                         complib=filters.complib or None,
+                         complevel=filters.complevel or None)
+    except Exception:
+        if temp_key in store:
+            store.remove(temp_key)
+        raise
+    store.get_storer(temp_key).attrs.schema_version = getattr(
+        storer.attrs, "schema_version", 0)
+    store.remove(key)
+    store._handle.rename_node("/" + temp_key, key.split("/")[-1])
+
+
+def append_catalogue_tables(store, orig_df, mag_df, index=True,
+                            complib=COMPLIB, complevel=COMPLEVEL):
+    """
+    Appends the origin and magnitude dataframes to the catalogue tables
+    ("catalogue/origins" and "catalogue/magnitudes") of an open
+    pandas.HDFStore (see append_catalogue_table)
+    """
+    append_catalogue_table(store, ORIGIN_KEY, orig_df, index, complib,
+                           complevel)
+    append_catalogue_table(store, MAGNITUDE_KEY, mag_df, index, complib,
+                           complevel)
+
+
+def index_catalogue_tables(store, optlevel=9, kind="full"):
+    """
+    Creates (or completes) the PyTables indices of the data columns of the
+    catalogue tables of an open pandas.HDFStore
+    """
+    for key in [ORIGIN_KEY, MAGNITUDE_KEY]:
+        if key in store:
+            data_columns = store.get_storer(key).data_columns
+            if data_columns:
+                store.create_table_index(key, columns=data_columns,
+                                         optlevel=optlevel, kind=kind)
+
+
+def get_schema_version(store, key=ORIGIN_KEY):
+    """
+    Returns the schema version of a catalogue table of an open
+    pandas.HDFStore, or 0 for tables written before versioning
+    """
+    if not key in store:
+        return None
+    return getattr(store.get_storer(key).attrs, "schema_version", 0)
+
+
+def write_catalogue_tables(hdf5_file, origin_data, mag_data,
+                           chunk_size=CHUNK_SIZE, complib=COMPLIB,
+                           complevel=COMPLEVEL, categorical=False):
+    """
+    Writes the origin and magnitude tables (as structured arrays defined by
+    DATAMAP and MAGDATAMAP, which may be memory-mapped) to the catalogue
+    tables of an hdf5 file, appending them in chunks of rows such that only
+    one chunk is held as a dataframe at a time. The indices of the data
+    columns are built once all chunks are written
+    :param str hdf5_file:
+        Path to the hdf5 file
+    :param int chunk_size:
+        Number of rows written at a time
+    :param bool categorical:
+        Store the CATEGORICAL_COLUMNS as categoricals. The categories are
+        taken from the full tables, such that every chunk shares them.
+        Appending new categories later rewrites the table (see
+        rewrite_table_categories)
+    """
+    store = pd.HDFStore(hdf5_file)
+    try:
+        for key, data, datamap in [(ORIGIN_KEY, origin_data, DATAMAP),
+                                   (MAGNITUDE_KEY, mag_data, MAGDATAMAP)]:
+            columns = [val[0] for val in datamap]
+            categories = {}
+            if categorical and not key in store:
+                categories = dict([(col, np.unique(data[col]))
+                                   for col in CATEGORICAL_COLUMNS[key]])
+            for start in range(0, len(data), chunk_size):
+                chunk = pd.DataFrame(data[start:(start + chunk_size)],
+                                     columns=columns)
+                for col in categories:
+                    chunk[col] = pd.Categorical(chunk[col],
+                                                categories=categories[col])
+                append_catalogue_table(store, key, chunk, False, complib,
+                                       complevel)
+        index_catalogue_tables(store)
+    finally:
+        store.close()
+
+
+def _update_id_index(index, items, get_key=None):
+    """
+    Updates the index of identifiers to positions of a list of catalogue
+    records (events, origins or magnitudes). The index is stored as a tuple
+    of (indexed list, list of the indexed records, dictionary of positions):
+    if the records indexed are still the leading records of the same list,
+    in the same order, then only the records appended since are added,
+    otherwise (list replaced, or records reordered, removed, inserted or
+    replaced) it is rebuilt. As in list.index, the first record with a given
+    identifier is returned
+    :param tuple index:
+        Current index (or None if not yet built)
+    :param list items:
+        List of records
+    :param get_key:
+        Function returning the identifier of a record (defaults to the
+        attribute "id")
+    :returns:
+        Updated index
+    """
+    # The records are compared by identity, as they do not define equality
+    if index is None or index[0] is not items or\
+            items[:len(index[1])] != index[1]:
+        index = (items, [], {})
+    indexed, positions = index[1], index[2]
+    for iloc in range(len(indexed), len(items)):
+        if get_key:
+            positions.setdefault(get_key(items[iloc]), iloc)
+        else:
+            positions.setdefault(items[iloc].id, iloc)
+    indexed.extend(items[len(indexed):])
+    return (items, indexed, positions)
+
+
+def fill_origin_mag_tables(events, origin_data, mag_data, origin_start=0,
+                           mag_start=0):
+    """
+    Writes the origins and magnitudes of a list of events into the origin
+    and magnitude tables (arrays defined by DATAMAP and MAGDATAMAP, or
+    memory-mapped equivalents). The rows are collected in a single pass over
+    the events and each table is then assigned at once. Missing optional
+    values (None) are rendered as NaN
+    :param list events:
+        Events as instances of :class: Event
+    :param origin_data:
+        Origin table
+    :param mag_data:
+        Magnitude table
+    :param int origin_start:
+        Row of the origin table at which to start writing
+    :param int mag_start:
+        Row of the magnitude table at which to start writing
+    :returns:
+        Number of origins and number of magnitudes written
+    """
+    origin_rows = [(eq.id, orig.id, orig.author,
+                    orig.date.year, orig.date.month, orig.date.day,
+                    orig.time.hour, orig.time.minute,
+                    orig.time.second + orig.time.microsecond / 1.0E6,
+                    orig.time_error,
+                    orig.location.longitude, orig.location.latitude,
+                    orig.location.depth, orig.location.semimajor90,
+                    orig.location.semiminor90, orig.location.error_strike,
+                    orig.location.depth_error, orig.is_prime)
+                   for eq in events for orig in eq.origins]
+    mag_rows = [(mag.event_id, mag.origin_id, mag.magnitude_id, mag.value,
+                 mag.sigma, mag.scale, mag.author)
+                for eq in events for mag in eq.magnitudes]
+    if origin_rows:
+        origin_data[origin_start:(origin_start + len(origin_rows))] =\
+            np.array(origin_rows, dtype=DATAMAP)
+    if mag_rows:
+        mag_data[mag_start:(mag_start + len(mag_rows))] =\
+            np.array(mag_rows, dtype=MAGDATAMAP)
+    return len(origin_rows), len(mag_rows)
+
+
+def get_prime_origin_row(event):
+    """
+    Returns the row of the prime origin table (see PRIME_ORIGIN_DTYPE) for
+    an event. The origin is the only origin of the event or, if there are
+    several, the last prime origin. Events without such an origin have zero
+    date, time and location
+    """
+    prime_origin = None
+    if len(event.origins) == 1:
+        prime_origin = event.origins[0]
+    else:
+        for origin in event.origins:
+            if origin.is_prime:
+                prime_origin = origin
+    if prime_origin is None:
+        return (event.id, None, False, 0, 0, 0, 0, 0, 0., 0., 0., 0., np.nan)
+    if prime_origin.magnitudes:
+        magnitude = prime_origin.magnitudes[0].value
+    else:
+        magnitude = np.nan
+    return (event.id,
+            prime_origin.id,
+            bool(prime_origin.is_prime),
+            prime_origin.date.year,
+            prime_origin.date.month,
+            prime_origin.date.day,
+            prime_origin.time.hour,
+            prime_origin.time.minute,
+            float(prime_origin.time.second) +
+            (float(prime_origin.time.microsecond) / 1.0E6),
+            prime_origin.location.longitude,
+            prime_origin.location.latitude,
+            prime_origin.location.depth,
+            magnitude)
+
+
+class _CompactRecord(object):
+    """
+    Base class of the catalogue records that store their attributes in
+    __slots__ rather than in a per-instance dictionary. Provides the pickle
+    support that slotted classes lack for protocols 0 and 1. Slots named in
+    _TRANSIENT hold derived data (e.g. indices) and are not pickled
+    """
+    __slots__ = ()
+    _TRANSIENT = ()
+
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if name == "__dict__":
+                    # Attributes without a dedicated slot. Reading __dict__
+                    # creates the dictionary, so an empty one is discarded
+                    if self.__dict__:
+                        state.update(self.__dict__)
+                    else:
+                        del self.__dict__
+                elif name not in self._TRANSIENT and hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class OriginMetadata(_CompactRecord):
+    """
+    Compact dictionary-like container of the origin metadata (see
+    :class: Origin), storing the values in slots rather than in a dict.
+    Keys other than those of the ISF origin block are stored in a secondary
+    dictionary, created only when needed
+    """
+    KEYS = ('Nphases', 'Nstations', 'AzimuthGap', 'minDist', 'maxDist',
+            'FixedTime', 'DepthSolution', 'AnalysisType', 'LocationMethod',
+            'EventType')
+    __slots__ = KEYS + ('_extra',)
+
+    def __init__(self, **kwargs):
+        """
+        Instantiate with the metadata as keyword arguments
+        """
+        for key in self.KEYS:
+            setattr(self, key, None)
+        self._extra = None
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in self.KEYS:
+            return getattr(self, key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.KEYS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        return (key in self.KEYS) or\
+            (self._extra is not None and key in self._extra)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def get(self, key, default=None):
+        """
+        Returns the value of the key, or the default if not found
+        """
+        if key in self:
+            return self[key]
+        return default
+
+    def keys(self):
+        """
+        Returns the list of metadata keys
+        """
+        keys = list(self.KEYS)
+        if self._extra:
+            keys.extend(self._extra.keys())
+        return keys
+
+    def values(self):
+        """
+        Returns the list of metadata values
+        """
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        """
+        Returns the list of (key, value) pairs
+        """
+        return [(key, self[key]) for key in self.keys()]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
 def datetime_to_decimal_time(date, time):
     '''
     Converts a datetime object to decimal time
@@ -52,7 +595,7 @@ def datetime_to_decimal_time(date, time):
                         np.array([time.minute]), 
                         np.array([seconds]))
 
-class Magnitude(object):
+class Magnitude(_CompactRecord):
     '''
     Stores an instance of a magnitude
     :param int identifier:
@@ -68,6 +611,9 @@ class Magnitude(object):
     :param int stations:
         Number of stations
     '''
+    __slots__ = ('event_id', 'origin_id', 'value', 'author', 'scale', 'sigma',
+                 'stations', 'magnitude_id')
+
     def __init__(self, event_id, origin_id, value, author, scale=None,
         sigma=None, stations=None):
         '''
@@ -87,22 +633,22 @@ class Magnitude(object):
                                       "{:.2f}".format(self.value),
                                       self.scale])
     
-    def compare_magnitude(self, magnitude, tol=1E-3):
+    def get_key(self):
+        '''
+        Returns the tuple (origin_id, author, scale) identifying the magnitude
+        within an origin
+        '''
+        return (self.origin_id, self.author, self.scale)
+
+    def compare_magnitude(self, magnitude, tol=0.005):
         '''
         Compares if a second instance of a magnitude class is the same as the
-        current magnitude
+        current magnitude, i.e. has the same origin, author and scale and a
+        value within the tolerance
         '''
-        if (magnitude.origin_id == self.origin_id) and (magnitude.author == 
-            self.author) and (magnitude.scale == self.scale):
-            if fabs(magnitude.value - self.value) < 0.005:
-                print self.__dict__
-                print magnitude.__dict__
-                raise ValueError('Two magnitudes with same metadata contain '
-                                 'different values!')
-            return True
-        else:
-            return False
-    
+        return (magnitude.get_key() == self.get_key()) and\
+            (fabs(magnitude.value - self.value) < tol)
+
     def __str__(self):
         """
         Returns the magnitude identifier
@@ -137,7 +683,7 @@ class Magnitude(object):
 
 
 
-class Location(object):
+class Location(_CompactRecord):
     '''
     Instance of a magnitude location
     :param int origin_id:
@@ -157,6 +703,9 @@ class Location(object):
     :param float depth_error:
         1 s.d. Error on the depth value (km) 
     '''
+    __slots__ = ('identifier', 'longitude', 'latitude', 'depth', 'semimajor90',
+                 'semiminor90', 'error_strike', 'depth_error')
+
     def __init__(self, origin_id, longitude, latitude, depth, semimajor90=None,
                 semiminor90=None, error_strike=None, depth_error=None):
         '''
@@ -179,7 +728,7 @@ class Location(object):
                                str(self.latitude),
                                str(self.depth))
 
-class Origin(object):
+class Origin(_CompactRecord):
     '''
     In instance of an origin block
     :param int identifier:
@@ -197,7 +746,7 @@ class Origin(object):
     :param float time_rms:
         Time root-mean-square error (s)
     :param dict metadata:
-        Metadata of dictionary including - 
+        Metadata of dictionary (or :class: OriginMetadata) including - 
         - 'Nphases' - Number of defining phases
         - 'Nstations' - Number of recording stations
         - 'AzimuthGap' - Azimuth Gap of recodring stations
@@ -208,8 +757,16 @@ class Origin(object):
         - 'AnalysisType' - Analysis type
         - 'LocationMethod' - Location Method
         - 'EventType' - Event type
-    
+    Attributes assigned by the homogenisor (magnitude, magnitude_sigma,
+    record_key) have dedicated slots; any other attribute is stored in a
+    dictionary that is only created when first needed
     '''
+    __slots__ = ('id', 'date', 'time', 'location', 'author', 'metadata',
+                 'magnitudes', 'is_prime', 'is_centroid', 'time_error',
+                 'time_rms', 'magnitude', 'magnitude_sigma', 'record_key',
+                 '_magnitude_index', '__dict__')
+    _TRANSIENT = ('_magnitude_index',)
+
     def __init__(self, identifier, date, time, location, author, 
         is_prime=False, is_centroid=False, time_error=None, time_rms=None, 
         metadata=None):
@@ -227,6 +784,8 @@ class Origin(object):
         self.is_centroid = is_centroid
         self.time_error = time_error
         self.time_rms = time_rms
+        self._magnitude_index = None
+
 
     def get_number_magnitudes(self):
         """
@@ -263,28 +822,49 @@ class Origin(object):
         else:
             return [(mag.value, mag.scale) for mag in self.magnitudes]
 
-    def merge_secondary_magnitudes(self, magnitudes):
+    def get_magnitude_index(self):
+        """
+        Returns the dictionary of magnitude keys (origin_id, author, scale)
+        and their positions in the list of magnitudes. The index is kept in
+        step with magnitudes appended to the list and is rebuilt if the list
+        is replaced or its magnitudes are reordered, removed or replaced
+        """
+        self._magnitude_index = _update_id_index(
+            getattr(self, "_magnitude_index", None), self.magnitudes,
+            Magnitude.get_key)
+        return self._magnitude_index[2]
+
+    def merge_secondary_magnitudes(self, magnitudes, tol=0.005):
         """
         Merge magnitudes as instances of isf_catalogue.Magnitude into origin
-        list. 
+        list. Magnitudes with the same origin, author and scale as a current
+        magnitude are not added; if their values differ by more than the
+        tolerance they are returned as conflicts
+        :param list magnitudes:
+            Secondary magnitudes as instances of isf_catalogue.Magnitude
+        :param float tol:
+            Tolerance on the magnitude value
+        :returns:
+            List of conflicting magnitudes as instances of MagnitudeConflict
         """
-        if self.get_number_magnitudes() == 0:
-            # As no magnitudes currently exist then add all input magnitudes
-            # to origin
-            self.magnitudes = magnitudes
-        else:
-            for magnitude1 in magnitudes:
-                if not isinstance(magnitude1, Magnitude):
-                    raise ValueError('Secondary magnitude must be instance of '
-                                     'isf_catalogue.Magnitude')
-                has_magnitude = False
-                for magnitude2 in self.magnitudes:
-                    # Compare magnitudes
-                    has_magnitude = magnitude2.compare_magnitude(magnitude1)
-                if not has_magnitude:
-                    # Magnitude not in current list - append
-                    self.magnitudes.append(magnitude1)
-    
+        conflicts = []
+        magnitude_index = self.get_magnitude_index()
+        for magnitude1 in magnitudes:
+            if not isinstance(magnitude1, Magnitude):
+                raise ValueError('Secondary magnitude must be instance of '
+                                 'isf_catalogue.Magnitude')
+            key = magnitude1.get_key()
+            if key in magnitude_index:
+                magnitude2 = self.magnitudes[magnitude_index[key]]
+                if fabs(magnitude2.value - magnitude1.value) >= tol:
+                    conflicts.append(
+                        MagnitudeConflict(key, magnitude2, magnitude1))
+            else:
+                # Magnitude not in current list - append
+                self.magnitudes.append(magnitude1)
+                magnitude_index = self.get_magnitude_index()
+        return conflicts
+
     def __str__(self):
         """
         Returns an string providing information regarding the origin (namely
@@ -333,7 +913,7 @@ class Origin(object):
 #            grp.attrs[param] = False
 
 
-class Event(object):
+class Event(_CompactRecord):
     '''
     Instance of an event block
     :param int id:
@@ -344,8 +924,16 @@ class Event(object):
         List of instances of the Magnitude class
     :param str description:
         Description string
-
+    Attributes assigned by the parsers and homogenisors (tensor, preferred,
+    origin_rule_idx, magnitude_rule_idx) have dedicated slots; any other
+    attribute is stored in a dictionary that is only created when first
+    needed
     '''
+    __slots__ = ('id', 'origins', 'magnitudes', 'description', 'tensor',
+                 'preferred', 'origin_rule_idx', 'magnitude_rule_idx',
+                 '_origin_index', '__dict__')
+    _TRANSIENT = ('_origin_index',)
+
     def __init__(self, identifier, origins, magnitudes, description=None):
         """
         Instantiate event object
@@ -354,6 +942,7 @@ class Event(object):
         self.origins = origins
         self.magnitudes = magnitudes
         self.description=description
+        self._origin_index = None
 
     def number_origins(self):
         '''
@@ -367,6 +956,17 @@ class Event(object):
         '''
         return [orig.id for orig in self.origins]
 
+    def get_origin_index(self):
+        '''
+        Returns the dictionary of origin IDs and their positions in the list
+        of origins. The index is kept in step with origins appended to the
+        list and is rebuilt if the list is replaced or its origins are
+        reordered, removed or replaced
+        '''
+        self._origin_index = _update_id_index(
+            getattr(self, "_origin_index", None), self.origins)
+        return self._origin_index[2]
+
     def get_author_list(self):
         """
         Return list of origin authors associated to event
@@ -404,22 +1004,25 @@ class Event(object):
 
     def merge_secondary_origin(self, origin2set):
         '''
-        Merges an instance of an isf_catalogue.Origin class into the set 
-        of origins. 
+        Merges an instance of an isf_catalogue.Origin class into the set
+        of origins. Returns the list of magnitude conflicts (as instances of
+        MagnitudeConflict) found when merging origins already in the event
         '''
-        current_id_list = self.get_origin_id_list()
+        conflicts = []
+        origin_index = self.get_origin_index()
         for origin2 in origin2set:
             if not isinstance(origin2, Origin):
                 raise ValueError('Secondary origins must be instance of '
                                  'isf_catalogue.Origin class')
-            if origin2.id in current_id_list:
+            if origin2.id in origin_index:
                 # Origin is already in list - process magnitudes
-                location = current_id_list.index(origin2.id)
-                origin = self.origins[location]
-                origin.merge_secondary_magnitudes(origin2.magnitudes)
-                self.origins[location] = origin
+                origin = self.origins[origin_index[origin2.id]]
+                conflicts.extend(
+                    origin.merge_secondary_magnitudes(origin2.magnitudes))
             else:
                 self.origins.append(origin2)
+                origin_index = self.get_origin_index()
+        return conflicts
 
     def get_origin_mag_vals(self):
         """
@@ -453,10 +1056,336 @@ class Event(object):
         return "%s:%s" % (str(self.id), self.description)
 
 
+def _to_optional(value, missing=None):
+    """
+    Returns a table value as a float, or the missing value if it is missing
+    (NaN)
+    """
+    value = float(value)
+    if np.isnan(value):
+        return missing
+    return value
+
+
+def _get_group_pointers(codes, number_groups):
+    """
+    Returns the order of the rows sorted by group code (or None if they are
+    already sorted) and the array of pointers such that the rows of group i
+    are order[pointers[i]:pointers[i + 1]]
+    """
+    if len(codes) and np.any(np.diff(codes) < 0):
+        order = np.argsort(codes, kind="mergesort")
+        codes = codes[order]
+    else:
+        order = None
+    pointers = np.searchsorted(codes, np.arange(number_groups + 1))
+    return order, pointers
+
+
+class EventTableView(object):
+    """
+    Sequence of events backed by the origin and magnitude tables of a
+    catalogue (numpy structured arrays defined by DATAMAP and MAGDATAMAP).
+    The Event, Origin, Location and Magnitude objects are only built when an
+    event is accessed, and are then kept so that changes to them persist.
+    Events can be appended as with a list. While no event has been replaced
+    or appended, and the view has not been marked as modified, the view is
+    "pristine" and the tables are an exact representation of the events, so
+    reading events does not affect the use of the tables. Changes made in
+    place to accessed events must be followed by mark_modified (called by
+    ISFCatalogue.invalidate_cache)
+
+    The events hold only what the tables hold: the seconds (float16) and
+    the coordinates and errors (float32) have the precision of the tables,
+    and the attributes not in the tables (the event description, the origin
+    metadata, time_rms and is_centroid, and the magnitude stations) are not
+    set, so reading them raises AttributeError (see TableEvent, TableOrigin
+    and TableMagnitude) unless they are assigned first
+    :param origin_data:
+        Origin table
+    :param mag_data:
+        Magnitude table
+    :param missing:
+        Value of the optional values of the events (e.g. depth, errors) that
+        are missing from the tables: None, as in the events parsed from a
+        file, or NaN, as in the events built by CatalogueDB.build_isf
+    """
+    def __init__(self, origin_data, mag_data, missing=None):
+        """
+        Instantiate with the origin and magnitude tables
+        """
+        self.origin_data = origin_data
+        self.mag_data = mag_data
+        self.missing = missing
+        # Events are defined by the event IDs of the origins and magnitudes
+        # in order of first appearance
+        codes, event_ids = pd.factorize(np.concatenate(
+            [origin_data["eventID"], mag_data["eventID"]]))
+        self.event_ids = np.asarray(event_ids)
+        self.origin_codes = codes[:len(origin_data)]
+        self.mag_codes = codes[len(origin_data):]
+        self.origin_order, self.origin_pointers = _get_group_pointers(
+            self.origin_codes, len(self.event_ids))
+        self.mag_order, self.mag_pointers = _get_group_pointers(
+            self.mag_codes, len(self.event_ids))
+        self._events = {}
+        self._appended = []
+        # Number of changes other than appends
+        self.version = 0
+
+    def is_pristine(self):
+        """
+        Returns True if no event has been replaced or appended and the view
+        has not been marked as modified
+        """
+        return not (self.version or self._appended)
+
+    def mark_modified(self):
+        """
+        Records that accessed events have been modified in place, so that
+        the tables no longer represent the events
+        """
+        self.version += 1
+
+    def __len__(self):
+        return len(self.event_ids) + len(self._appended)
+
+    def __iter__(self):
+        for iloc in range(len(self)):
+            yield self[iloc]
+
+    def __getitem__(self, iloc):
+        if isinstance(iloc, slice):
+            return [self[i] for i in range(*iloc.indices(len(self)))]
+        if iloc < 0:
+            iloc += len(self)
+        if iloc < 0 or iloc >= len(self):
+            raise IndexError("Event index out of range")
+        if iloc >= len(self.event_ids):
+            return self._appended[iloc - len(self.event_ids)]
+        if not iloc in self._events:
+            self._events[iloc] = self.build_event(iloc)
+        return self._events[iloc]
+
+    def __setitem__(self, iloc, event):
+        self.version += 1
+        if iloc < 0:
+            iloc += len(self)
+        if iloc >= len(self.event_ids):
+            self._appended[iloc - len(self.event_ids)] = event
+        else:
+            self._events[iloc] = event
+
+    def append(self, event):
+        """
+        Appends an event to the sequence
+        """
+        self._appended.append(event)
+
+    def extend(self, events):
+        """
+        Appends a list of events to the sequence
+        """
+        self._appended.extend(events)
+
+    def _get_rows(self, order, pointers, iloc):
+        """
+        Returns the row indices of the event in a table
+        """
+        rows = np.arange(pointers[iloc], pointers[iloc + 1])
+        if order is not None:
+            rows = order[rows]
+        return rows
+
+    def get_origin_rows(self, iloc):
+        """
+        Returns the indices of the rows of the origin table of an event
+        """
+        return self._get_rows(self.origin_order, self.origin_pointers, iloc)
+
+    def get_magnitude_rows(self, iloc):
+        """
+        Returns the indices of the rows of the magnitude table of an event
+        """
+        return self._get_rows(self.mag_order, self.mag_pointers, iloc)
+
+    def build_event(self, iloc):
+        """
+        Builds the event at a given position from the tables, as an
+        instance of :class: TableEvent
+        """
+        magnitudes = [build_magnitude(self.mag_data[i], self.missing)
+                      for i in self.get_magnitude_rows(iloc)]
+        origins = [build_origin(self.origin_data[i], self.missing)
+                   for i in self.get_origin_rows(iloc)]
+        event = TableEvent(self.event_ids[iloc], origins, magnitudes)
+        if origins and magnitudes:
+            event.assign_magnitudes_to_origins()
+        return event
+
+    def get_prime_origin_table(self):
+        """
+        Returns the table of prime origins (see PRIME_ORIGIN_DTYPE) built
+        directly from the tables
+        """
+        nevents = len(self.event_ids)
+        table = np.zeros(nevents, dtype=PRIME_ORIGIN_DTYPE)
+        table["eventID"] = self.event_ids
+        table["originID"] = None
+        table["magnitude"] = np.nan
+        # The prime origin is the only origin of the event or the last of
+        # its prime origins
+        number_origins = np.diff(self.origin_pointers)
+        rows = np.arange(len(self.origin_data))
+        if self.origin_order is not None:
+            rows = self.origin_order
+        codes = self.origin_codes[rows]
+        candidate = np.logical_or(self.origin_data["prime"][rows] > 0,
+                                  number_origins[codes] == 1)
+        rows = rows[candidate]
+        codes = codes[candidate]
+        is_last = np.ones(len(rows), dtype=bool)
+        is_last[:-1] = codes[1:] != codes[:-1]
+        rows = rows[is_last]
+        codes = codes[is_last]
+        origins = self.origin_data[rows]
+        table["originID"][codes] = origins["originID"]
+        table["prime"][codes] = origins["prime"] > 0
+        for key in ["year", "month", "day", "hour", "minute", "second",
+                    "longitude", "latitude", "depth"]:
+            table[key][codes] = origins[key]
+        # Magnitude is the first magnitude of the event from the origin
+        mags = pd.DataFrame({"code": self.mag_codes,
+                             "originID": self.mag_data["originID"],
+                             "value": self.mag_data["value"]})
+        if self.mag_order is not None:
+            mags = mags.iloc[self.mag_order]
+        mags = mags.drop_duplicates(["code", "originID"])
+        prime_mags = pd.merge(
+            pd.DataFrame({"code": codes, "originID": origins["originID"]}),
+            mags, on=["code", "originID"], how="inner")
+        table["magnitude"][prime_mags["code"].values] =\
+            prime_mags["value"].values
+        return table
+
+    def select(self, mask):
+        """
+        Returns a new view of the events selected by a boolean mask
+        """
+        mask = np.asarray(mask, dtype=bool)
+        return EventTableView(self.origin_data[mask[self.origin_codes]],
+                              self.mag_data[mask[self.mag_codes]],
+                              self.missing)
+
+
+class _TableRecord(object):
+    """
+    Mixin for the records built from the origin and magnitude tables (see
+    EventTableView). The attributes named in _MISSING are not held in the
+    tables, so they are left unset and reading them raises AttributeError
+    rather than returning None, which could be mistaken for a missing value
+    of the original record. Assigning them sets them as usual
+    """
+    __slots__ = ()
+    _MISSING = ()
+
+    def __init__(self, *args, **kwargs):
+        super(_TableRecord, self).__init__(*args, **kwargs)
+        for name in self._MISSING:
+            delattr(self, name)
+
+    def __getattr__(self, name):
+        # Only called if the attribute is not found, i.e. not set
+        if name in self._MISSING:
+            raise AttributeError(
+                "%s of %s is not held in the catalogue tables it was built "
+                "from" % (name, type(self).__name__))
+        raise AttributeError("'%s' object has no attribute '%s'" %
+                             (type(self).__name__, name))
+
+
+class TableMagnitude(_TableRecord, Magnitude):
+    """
+    Magnitude built from a row of the magnitude table, without the number
+    of stations
+    """
+    __slots__ = ()
+    _MISSING = ('stations',)
+
+
+class TableOrigin(_TableRecord, Origin):
+    """
+    Origin built from a row of the origin table, without the metadata,
+    time_rms and is_centroid
+    """
+    __slots__ = ()
+    _MISSING = ('metadata', 'time_rms', 'is_centroid')
+
+
+class TableEvent(_TableRecord, Event):
+    """
+    Event built from the origin and magnitude tables, without the
+    description
+    """
+    __slots__ = ()
+    _MISSING = ('description',)
+
+    def __str__(self):
+        """
+        Return string definition from the ID, or from the ID and description
+        if the description has been assigned
+        """
+        if hasattr(self, 'description'):
+            return Event.__str__(self)
+        return str(self.id)
+
+
+def build_origin(row, missing=None):
+    """
+    Builds an instance of :class: TableOrigin from a row of the origin table.
+    The seconds and coordinates have the precision of the table (float16 and
+    float32)
+    :param missing:
+        Value of the missing optional values (see EventTableView)
+    """
+    seconds = min(float(row["second"]), 59.999999)
+    location = Location(row["originID"], float(row["longitude"]),
+                        float(row["latitude"]),
+                        _to_optional(row["depth"], missing),
+                        _to_optional(row["semimajor90"], missing),
+                        _to_optional(row["semiminor90"], missing),
+                        _to_optional(row["error_strike"], missing),
+                        _to_optional(row["depth_error"], missing))
+    return TableOrigin(
+        row["originID"],
+        datetime.date(int(row["year"]), int(row["month"]), int(row["day"])),
+        datetime.time(int(row["hour"]), int(row["minute"]), int(seconds),
+                      int(round((seconds % 1.) * 1.0E6)) % 1000000),
+        location, row["Agency"], is_prime=bool(row["prime"]),
+        time_error=_to_optional(row["time_error"], missing))
+
+
+def build_magnitude(row, missing=None):
+    """
+    Builds an instance of :class: TableMagnitude from a row of the magnitude
+    table, with the magnitude ID of the table. The value and sigma have the
+    precision of the table (float32)
+    :param missing:
+        Value of a missing sigma (see EventTableView)
+    """
+    magnitude = TableMagnitude(row["eventID"], row["originID"],
+                               float(row["value"]), row["magAgency"],
+                               row["magType"],
+                               _to_optional(row["sigma"], missing))
+    magnitude.magnitude_id = row["magnitudeID"]
+    return magnitude
+
 
 class ISFCatalogue(object):
     '''
-    Instance of an earthquake catalogue
+    Instance of an earthquake catalogue. The events are either a list of
+    instances of :class: Event or, for a catalogue built with from_tables,
+    an :class: EventTableView over the origin and magnitude tables
     '''
     def __init__(self, identifier, name, events=None):
         """
@@ -468,6 +1397,71 @@ class ISFCatalogue(object):
             self.events = events
         else:
             self.events = []
+        self._event_index = None
+        self._prime_origins = None
+
+
+    @classmethod
+    def from_tables(cls, identifier, name, origin_data, mag_data,
+                    missing=None):
+        """
+        Builds a catalogue backed by the origin and magnitude tables (as
+        returned by get_origin_mag_tables), creating the event objects only
+        when they are accessed
+        :param missing:
+            Value of the missing optional values of the events (see
+            :class: EventTableView)
+        """
+        catalogue = cls(identifier, name)
+        catalogue.events = EventTableView(origin_data, mag_data, missing)
+        return catalogue
+
+
+    def is_table_backed(self):
+        """
+        Returns True if the events are an unmodified view over tables, in
+        which case the tables can be used without building the events
+        """
+        return isinstance(self.events, EventTableView) and\
+            self.events.is_pristine()
+
+
+    def select_events(self, mask):
+        """
+        Returns a new catalogue with the events selected by a boolean mask
+        (one value per event)
+        """
+        if self.is_table_backed():
+            catalogue = ISFCatalogue(self.id, self.name)
+            catalogue.events = self.events.select(mask)
+            return catalogue
+        return ISFCatalogue(self.id, self.name,
+                            [event for event, keep in zip(self.events, mask)
+                             if keep])
+
+
+    def __getstate__(self):
+        """
+        Returns the state for pickling, without the derived indices
+        """
+        state = self.__dict__.copy()
+        state["_event_index"] = None
+        state["_prime_origins"] = None
+        return state
+
+
+    def invalidate_cache(self):
+        """
+        Discards the derived indices and tables. Appending, reordering,
+        removing or replacing events of the event list (or replacing the
+        list) is detected automatically, but this must be called after
+        events or their origins are modified in place. For a table-backed
+        catalogue the tables are then no longer used for the events
+        """
+        if isinstance(self.events, EventTableView):
+            self.events.mark_modified()
+        self._event_index = None
+        self._prime_origins = None
 
 
     def get_number_events(self):
@@ -483,152 +1477,211 @@ class ISFCatalogue(object):
         """
         if self.get_number_events() == 0:
             return []
+        elif self.is_table_backed():
+            return self.events.event_ids.tolist()
         else:
             return [eq.id for eq in self.events]
 
 
+    def get_event_index(self):
+        """
+        Returns the dictionary of event IDs and their positions in the list
+        of events. The index is kept in step with events appended to the
+        list and is rebuilt if the list is replaced or its events are
+        reordered, removed or replaced
+        """
+        self._event_index = _update_id_index(
+            getattr(self, "_event_index", None), self.events)
+        return self._event_index[2]
+
+
+    def get_prime_origin_table(self):
+        """
+        Returns the table of prime origins, with one row per event, as a
+        numpy structured array (see PRIME_ORIGIN_DTYPE). The table is cached:
+        rows are added for events appended to the event list, and the table
+        is rebuilt if the list is replaced or its events are reordered,
+        removed or replaced. Changes made in place to the events or their
+        origins are not detected: call invalidate_cache after them
+        """
+        events = self.events
+        if isinstance(events, EventTableView):
+            # Changes to a view other than appends increment its version
+            state = events.version
+        else:
+            state = None
+        cache = getattr(self, "_prime_origins", None)
+        if cache is None or cache[0] is not events or cache[1] != state or\
+                (state is None and events[:len(cache[2])] != cache[2]):
+            if isinstance(events, EventTableView) and not events.version:
+                table = events.get_prime_origin_table()
+            else:
+                table = np.zeros(0, dtype=PRIME_ORIGIN_DTYPE)
+            cache = (events, state, [], table)
+        indexed, table = cache[2], cache[3]
+        if len(table) < len(events):
+            new_events = events[len(table):]
+            new_rows = np.array(
+                [get_prime_origin_row(event) for event in new_events],
+                dtype=PRIME_ORIGIN_DTYPE)
+            table = np.concatenate([table, new_rows])
+            if state is None:
+                # Events are compared by identity to detect changes
+                indexed.extend(new_events)
+        self._prime_origins = (events, state, indexed, table)
+        return table
+
+
     def merge_second_catalogue(self, catalogue):
         '''
-        Merge in a second catalogue of the format ISF Catalogue and link via 
-        Event Keys
+        Merge in a second catalogue of the format ISF Catalogue and link via
+        Event Keys. Returns the list of magnitude conflicts (as instances of
+        MagnitudeConflict) found in the merge
         '''
         if not isinstance(catalogue, ISFCatalogue):
             raise ValueError('Input catalogue must be instance of ISF '
                              'Catalogue')
 
-        native_keys = self.get_event_key_list()
-        new_keys = catalogue.get_event_key_list()
-        for iloc, key in enumerate(new_keys):
-            if key in native_keys:
-                # Add secondary to primary
-                location = native_keys.index(key)
-                # Merge origins into catalogue
-                event = self.events[location]
-                event.merge_secondary_origin(catalogue.events[iloc].origins)
-                self.events[location] = event
+        conflicts = []
+        merged = False
+        event_index = self.get_event_index()
+        for event2 in catalogue.events:
+            if event2.id in event_index:
+                # Merge origins of secondary event into primary
+                event = self.events[event_index[event2.id]]
+                conflicts.extend(event.merge_secondary_origin(event2.origins))
+                merged = True
+        if merged:
+            # Merged origins may change the prime origins and the tables
+            if isinstance(self.events, EventTableView):
+                self.events.mark_modified()
+            self._prime_origins = None
+        return conflicts
 
     def get_decimal_dates(self):
         """
-        Returns dates and time as a vector of decimal dates
-        """
-        neq = self.get_number_events()
-        year = np.zeros(neq, dtype=int)
-        month = np.zeros(neq, dtype=int)
-        day = np.zeros(neq, dtype=int)
-        hour = np.zeros(neq, dtype=int)
-        minute = np.zeros(neq, dtype=int)
-        second = np.zeros(neq, dtype=float)
-        for iloc, event in enumerate(self.events):
-            for origin in event.origins:
-                if len(event.origins) > 1 and not origin.is_prime:
-                    continue
-                else:
-                    year[iloc] = origin.date.year
-                    month[iloc] = origin.date.month
-                    day[iloc] = origin.date.day
-                    hour[iloc] = origin.time.hour
-                    minute[iloc] = origin.time.minute
-                    second[iloc] = float(origin.time.second) + \
-                        (float(origin.time.microsecond) / 1.0E6)
-        return decimal_time(year, month, day, hour, minute, second)
-                    
+        Returns dates and time as a vector of decimal dates, from the cached
+        table of prime origins (see get_prime_origin_table: call
+        invalidate_cache after modifying events or origins in place)
+        """
+        table = self.get_prime_origin_table()
+        return decimal_time(table["year"], table["month"], table["day"],
+                            table["hour"], table["minute"], table["second"])
 
     def render_to_simple_numpy_array(self):
         '''
-        Render to a simple array using preferred origin time and magnitude
+        Render to a simple array using preferred origin time and magnitude.
+        Returns an object array with columns [eventID, originID, decimal time,
+        latitude, longitude, depth, magnitude] for the events whose prime
+        origin has a magnitude. Built from the cached table of prime origins
+        (see get_prime_origin_table: call invalidate_cache after modifying
+        events or origins in place)
         '''
-        decimal_time = self.get_decimal_dates()
-        decimal_time = decimal_time.tolist()
-        simple_array = []
-        for iloc, event in enumerate(self.events):
-            for origin in event.origins:
-                if not origin.is_prime:
-                    continue
-                else:
-                    if len(origin.magnitudes) == 0:
-                        continue
-
-                    simple_array.append([event.id, 
-                                         origin.id, 
-                                         decimal_time[iloc],
-                                         origin.location.latitude, 
-                                         origin.location.longitude,
-                                         origin.location.depth, 
-                                         origin.magnitudes[0].value])
-        return np.array(simple_array)
+        table = self.get_prime_origin_table()
+        idx = np.logical_and(table["prime"],
+                             np.logical_not(np.isnan(table["magnitude"])))
+        table = table[idx]
+        return np.column_stack([
+            table["eventID"],
+            table["originID"],
+            self.get_decimal_dates()[idx].astype(object),
+            table["latitude"].astype(object),
+            table["longitude"].astype(object),
+            table["depth"].astype(object),
+            table["magnitude"].astype(object)])
 
 
     def get_origin_mag_tables(self):
         """
         Returns the full ISF catalogue as a pair of tables, the first
         containing only the origins, the second containing the
-        magnitudes
-        """
-        #Find out size of tables
-        n_origins = 0
-        n_mags = 0
-        for eq in self.events:
-            n_origins += len(eq.origins)
-            n_mags += len(eq.magnitudes)
-        # Pre-allocate data to zeros
-        origin_data = np.zeros((n_origins,), dtype=DATAMAP)
-        mag_data = np.zeros((n_mags,), dtype=MAGDATAMAP)
-        o_counter = 0
-        m_counter = 0
-        for eq in self.events:
-            for orig in eq.origins:
-                # Convert seconds fromd datetime to float
-                seconds = float(orig.time.second) +\
-                    float(orig.time.microsecond) / 1.0E6
-                # Optional defaults
-                if orig.time_error:
-                    time_error = orig.time_error
-                else:    
-                    time_error = 0.0
-                if orig.location.semimajor90:
-                    semimajor90 = orig.location.semimajor90
-                    semiminor90 = orig.location.semiminor90
-                    error_strike = orig.location.error_strike
-                else:
-                    semimajor90 = 0.0
-                    semiminor90 = 0.0
-                    error_strike = 0.0
-
-                if orig.location.depth_error:
-                    depth_error = orig.location.depth_error
-                else: 
-                    depth_error = 0.0
-                if orig.is_prime:
-                    prime = 1
-                else:
-                    prime = 0
-                origin_data[o_counter] = (eq.id, orig.id, orig.author,
-                    orig.date.year, orig.date.month, orig.date.day,
-                    orig.time.hour, orig.time.minute, seconds, time_error,
-                    orig.location.longitude, orig.location.latitude, 
-                    orig.location.depth, semimajor90, semiminor90, 
-                    error_strike, depth_error, prime)
-                o_counter += 1
-
-            for mag in eq.magnitudes:
-                if mag.sigma:
-                    sigma = mag.sigma
-                else:
-                    sigma = 0.0
-                mag_data[m_counter] = (mag.event_id, mag.origin_id, 
-                    mag.magnitude_id, mag.value, sigma, mag.scale, mag.author)
-                m_counter += 1
+        magnitudes. Missing optional values are NaN. For a table backed
+        catalogue the tables are returned without copying
+        """
+        if self.is_table_backed():
+            return self.events.origin_data, self.events.mag_data
+        origin_data = np.zeros((self.get_number_origins(),), dtype=DATAMAP)
+        mag_data = np.zeros((self.get_number_magnitudes(),), dtype=MAGDATAMAP)
+        fill_origin_mag_tables(self.events, origin_data, mag_data)
+        return origin_data, mag_data
+
+
+    def get_number_origins(self):
+        """
+        Returns the total number of origins in the catalogue
+        """
+        if self.is_table_backed():
+            return len(self.events.origin_data)
+        return sum([len(eq.origins) for eq in self.events])
+
+
+    def get_number_magnitudes(self):
+        """
+        Returns the total number of magnitudes in the catalogue
+        """
+        if self.is_table_backed():
+            return len(self.events.mag_data)
+        return sum([len(eq.magnitudes) for eq in self.events])
+
+
+    def write_origin_mag_tables(self, origin_file, magnitude_file,
+                                chunk_size=100000):
+        """
+        Writes the origin and magnitude tables (as from
+        get_origin_mag_tables) directly into memory-mapped .npy files, for
+        catalogues whose tables do not fit in memory. The tables are filled
+        in chunks of events and can be reopened with
+        numpy.load(filename, mmap_mode="r")
+        :param str origin_file:
+            Path to the .npy file of the origin table
+        :param str magnitude_file:
+            Path to the .npy file of the magnitude table
+        :param int chunk_size:
+            Number of events written at a time
+        :returns:
+            Memory-mapped origin and magnitude tables
+        """
+        origin_data = np.lib.format.open_memmap(
+            origin_file, mode="w+", dtype=DATAMAP,
+            shape=(self.get_number_origins(),))
+        mag_data = np.lib.format.open_memmap(
+            magnitude_file, mode="w+", dtype=MAGDATAMAP,
+            shape=(self.get_number_magnitudes(),))
+        if self.is_table_backed():
+            origin_data[:] = self.events.origin_data
+            mag_data[:] = self.events.mag_data
+        else:
+            n_origins = 0
+            n_mags = 0
+            for start in range(0, self.get_number_events(), chunk_size):
+                n_chunk_origins, n_chunk_mags = fill_origin_mag_tables(
+                    self.events[start:(start + chunk_size)], origin_data,
+                    mag_data, n_origins, n_mags)
+                n_origins += n_chunk_origins
+                n_mags += n_chunk_mags
+        origin_data.flush()
+        mag_data.flush()
         return origin_data, mag_data
     
     
     
-    def build_dataframe(self, hdf5_file=None):
+    def build_dataframe(self, hdf5_file=None, chunk_size=CHUNK_SIZE,
+                        complib=COMPLIB, complevel=COMPLEVEL,
+                        categorical=False):
         """
         Renders the catalogue into two Pandas Dataframe objects, one
         representing the full list of origins, the other the full list
         of magnitudes
         :param str hd5_file:
-            Path to the hdf5 for writing
+            Path to the hdf5 for writing (see write_catalogue_tables)
+        :param int chunk_size:
+            Number of rows written to the hdf5 file at a time
+        :param str complib:
+            Compression library of the hdf5 tables
+        :param int complevel:
+            Compression level of the hdf5 tables
+        :param bool categorical:
+            Store the agency and magnitude type columns as categoricals
         :returns:
             orig_df - Origin dataframe
             mag_df  - Magnitude dataframe
@@ -639,12 +1692,23 @@ class ISFCatalogue(object):
         mag_df = pd.DataFrame(mag_data,
                               columns=[val[0] for val in MAGDATAMAP])
         if hdf5_file:
-            store = pd.HDFStore(hdf5_file)
-            store.append("catalogue/origins", orig_df)
-            store.append("catalogue/magnitudes", mag_df)
-            store.close()
+            write_catalogue_tables(hdf5_file, origin_data, mag_data,
+                                   chunk_size, complib, complevel,
+                                   categorical)
         return orig_df, mag_df
 
+
+    def write_to_hdf5(self, hdf5_file, chunk_size=CHUNK_SIZE,
+                      complib=COMPLIB, complevel=COMPLEVEL,
+                      categorical=False):
+        """
+        Writes the catalogue to the tables of an hdf5 file without building
+        the complete dataframes (see write_catalogue_tables)
+        """
+        origin_data, mag_data = self.get_origin_mag_tables()
+        write_catalogue_tables(hdf5_file, origin_data, mag_data, chunk_size,
+                               complib, complevel, categorical)
+
     def render_to_xyzm(self, filename, frmt='%.3f'):
         '''
         Writes the catalogue to a simple [long, lat, depth, mag] format - for
@@ -652,9 +1716,13 @@ class ISFCatalogue(object):
         '''
         # Get numpy array
         print 'Creating array ...'
-        #cat_array = self.render_to_simple_numpy_array('Mw')
-        cat_array = self.render_to_simple_numpy_array()
-        cat_array = cat_array[:, [4, 3, 5, 6]]
+        table = self.get_prime_origin_table()
+        idx = np.logical_and(table["prime"],
+                             np.logical_not(np.isnan(table["magnitude"])))
+        cat_array = np.column_stack([table["longitude"][idx],
+                                     table["latitude"][idx],
+                                     table["depth"][idx],
+                                     table["magnitude"][idx]])
         print 'Writing to file ...'
         np.savetxt(filename, cat_array, fmt=frmt)
         print 'done!'
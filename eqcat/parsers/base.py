@@ -16,7 +16,146 @@
 #!/usr/bin/env/python
 
 import abc
+import io
 import os
+import gzip
+import subprocess
+from distutils.spawn import find_executable
+try:
+    # Multi-stream bz2 support (backport of the Python 3 module)
+    from bz2file import BZ2File
+except ImportError:
+    from bz2 import BZ2File
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Leading bytes identifying each of the supported compression formats
+COMPRESSION_MAGIC = [("gzip", "\x1f\x8b"),
+                     ("bz2", "BZh"),
+                     ("xz", "\xfd7zXZ\x00"),
+                     ("zstd", "\x28\xb5\x2f\xfd")]
+
+# External multi-threaded decompressors, used when available if parallel
+# decompression is requested
+PARALLEL_DECOMPRESSORS = {"gzip": ["pigz", "-dc"],
+                          "bz2": ["pbzip2", "-dc"],
+                          "xz": ["xz", "-T0", "-dc"],
+                          "zstd": ["zstd", "-T0", "-dc"]}
+
+
+def get_compression(filename):
+    """
+    Returns the compression format of the file ("gzip", "bz2", "xz" or
+    "zstd") identified from its leading bytes, or None if the file is not
+    compressed
+    """
+    with open(filename, "rb") as fle:
+        magic = fle.read(6)
+    for compression, signature in COMPRESSION_MAGIC:
+        if magic.startswith(signature):
+            return compression
+    return None
+
+
+class _ProcessOutput(object):
+    """
+    File-like wrapper around the output stream of a decompression process
+    """
+    def __init__(self, command):
+        """
+        Starts the process
+        """
+        self.command = command
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE)
+
+    def __iter__(self):
+        return iter(self.process.stdout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Do not mask an error raised while reading the stream
+        self.close(check=exc_type is None)
+
+    def read(self, *args):
+        return self.process.stdout.read(*args)
+
+    def readline(self, *args):
+        return self.process.stdout.readline(*args)
+
+    def readlines(self, *args):
+        return self.process.stdout.readlines(*args)
+
+    def close(self, check=True):
+        """
+        Closes the stream and terminates the process if still running. Raises
+        IOError if the process failed (e.g. on a truncated or corrupt file),
+        unless it was terminated here
+        :param bool check:
+            Check the exit status of the process
+        """
+        self.process.stdout.close()
+        terminated = False
+        if self.process.poll() is None:
+            self.process.terminate()
+            terminated = True
+        returncode = self.process.wait()
+        # A process that had already exited with an error before it could be
+        # terminated (i.e. not ended by a signal) still reports its status
+        if check and returncode and not (terminated and returncode < 0):
+            raise IOError("%s failed with exit status %d" %
+                          (" ".join(self.command), returncode))
+
+
+def open_catalogue_file(filename, mode="rt", parallel=False):
+    """
+    Opens a catalogue file for reading. Files compressed with gzip, bz2, xz
+    or zstd are decompressed as a stream (with multi-member/multi-frame
+    files supported by the codecs), so no temporary file is needed.
+    :param str filename:
+        Path to the file
+    :param str mode:
+        Mode used to open uncompressed files
+    :param bool parallel:
+        Decompress using an external multi-threaded tool (pigz, pbzip2,
+        xz -T0 or zstd -T0) running as a separate process, if found
+    :returns:
+        File-like object iterating over the lines of the file
+    """
+    compression = get_compression(filename)
+    if not compression:
+        return open(filename, mode)
+    if parallel:
+        command = PARALLEL_DECOMPRESSORS[compression]
+        if find_executable(command[0]):
+            return _ProcessOutput(command + [filename])
+    if compression == "gzip":
+        return gzip.open(filename, "rb")
+    elif compression == "bz2":
+        return BZ2File(filename, "rb")
+    elif compression == "xz":
+        if lzma is None:
+            raise IOError("xz compressed file %s requires the lzma module "
+                          "(backports.lzma)" % filename)
+        return lzma.LZMAFile(filename, "rb")
+    else:
+        if zstandard is None:
+            raise IOError("zstd compressed file %s requires the zstandard "
+                          "module" % filename)
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            open(filename, "rb"), read_across_frames=True)
+        return io.BufferedReader(reader)
 
 def _to_int(string):
     """
@@ -61,13 +200,26 @@ class BaseCatalogueDatabaseReader(object):
             List of origin agencies to be considered for inclusion 
         :param list selected_magnitude_agencies:
             List of magnitude agencies to be considered for inclusion 
+        The agencies are held as frozensets for constant time membership
+        tests
         """
         if not os.path.exists(filename):
             raise IOError("File %s does not exist!" % filename)
         self.filename = filename
         self.catalogue = None
-        self.selected_origin_agencies = selected_origin_agencies
-        self.selected_magnitude_agencies = selected_magnitude_agencies
+        self.selected_origin_agencies = frozenset(selected_origin_agencies)
+        self.selected_magnitude_agencies = frozenset(
+            selected_magnitude_agencies)
+        self.compression = get_compression(filename)
+        self.parallel_decompression = False
+
+    def open_file(self):
+        """
+        Opens the catalogue file for reading, decompressing it as a stream if
+        compressed
+        """
+        return open_catalogue_file(self.filename,
+                                   parallel=self.parallel_decompression)
 
     @abc.abstractmethod
     def read_file(self, identifier, name):
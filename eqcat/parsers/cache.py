@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute 
+# it and/or modify it under the terms of the GNU Affero General Public 
+# License as published by the Free Software Foundation, either version 
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+'''
+Persistent on-disk cache of parsed catalogues, keyed by the input file and
+the parser options
+'''
+import os
+import gc
+import hashlib
+import tempfile
+import cPickle as pickle
+from eqcat.spatial_index import get_file_identity
+from eqcat.catalogue_ingest import get_file_hash
+
+
+# Errors raised by unpickling a truncated or otherwise damaged cache entry
+DAMAGED_ENTRY_ERRORS = (EOFError, ValueError, KeyError, IndexError,
+                        pickle.UnpicklingError)
+
+
+class ParseCache(object):
+    """
+    Stores the output of a parser (e.g. ISFReader.read_file,
+    ParseNDKtoGCMT.read_file or GenericCataloguetoISFParser.parse) in a
+    binary file in the cache directory, so that repeated parsing of the same
+    file with the same options loads the stored output instead. When the
+    total size of the cache exceeds the maximum size the least recently used
+    entries are removed. The output is pickled, so a cached output is
+    identical to the output of the parser. Damaged entries are removed and
+    treated as missing.
+    :param str cache_dir:
+        Path to the cache directory
+    :param int max_size:
+        Maximum total size of the cache (bytes)
+    :param bool hash_content:
+        Identify the input file by the hash of its content (True) or by its
+        size and modification time (False)
+    """
+    EXTENSION = ".pkl"
+
+    def __init__(self, cache_dir, max_size=2 * (1024 ** 3),
+            hash_content=False):
+        """
+        Instantiate the cache, creating the directory if needed
+        """
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hash_content = hash_content
+
+    def read_file(self, parser, *args, **kwargs):
+        """
+        Returns the output of parser.read_file(*args, **kwargs), from the
+        cache if available
+        """
+        return self.read(parser, "read_file", *args, **kwargs)
+
+    def parse(self, parser, *args, **kwargs):
+        """
+        Returns the output of parser.parse(*args, **kwargs), from the cache
+        if available
+        """
+        return self.read(parser, "parse", *args, **kwargs)
+
+    def read(self, parser, method, *args, **kwargs):
+        """
+        Returns the output of the parser method called with the given
+        arguments, loading it from the cache if available or otherwise
+        calling the method and storing the output in the cache
+        :param parser:
+            Parser instance (with the input file as attribute filename)
+        :param str method:
+            Name of the parser method
+        """
+        key = self.get_key(parser, method, args, kwargs)
+        output = self.load(key)
+        if output is None:
+            output = getattr(parser, method)(*args, **kwargs)
+            self.store(key, output)
+        return output
+
+    def get_key(self, parser, method, args=(), kwargs={}):
+        """
+        Returns the cache key of the parser call, defined from the identity
+        of the input file, the parser class and method, the selected
+        agencies (if any) and the call arguments
+        """
+        checksum = hashlib.sha1()
+        for value in [parser.__class__.__name__,
+                      method,
+                      os.path.abspath(parser.filename),
+                      self._get_file_identity(parser.filename)]:
+            checksum.update(str(value))
+        for attribute in ["selected_origin_agencies",
+                          "selected_magnitude_agencies"]:
+            if hasattr(parser, attribute):
+                checksum.update(repr(sorted(getattr(parser, attribute))))
+        checksum.update(repr(args))
+        checksum.update(repr(sorted(kwargs.items())))
+        return checksum.hexdigest()
+
+    def load(self, key):
+        """
+        Returns the cached output for the key, or None if not in the cache.
+        A damaged entry is removed and None returned
+        """
+        filename = self._get_filename(key)
+        if not os.path.exists(filename):
+            return None
+        # The cyclic garbage collector is suspended while loading, as
+        # otherwise it is repeatedly triggered by the many objects created
+        gc.disable()
+        try:
+            with open(filename, "rb") as fle:
+                output = pickle.load(fle)
+        except DAMAGED_ENTRY_ERRORS:
+            os.remove(filename)
+            return None
+        finally:
+            gc.enable()
+        # Mark as recently used
+        os.utime(filename, None)
+        return output
+
+    def store(self, key, output):
+        """
+        Stores the output in the cache, then removes the least recently used
+        entries if the cache exceeds the maximum size
+        """
+        fid, temp_file = tempfile.mkstemp(dir=self.cache_dir)
+        try:
+            with os.fdopen(fid, "wb") as fle:
+                pickle.dump(output, fle, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_file, self._get_filename(key))
+        except:
+            os.remove(temp_file)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the total size of the
+        cache is within the maximum size
+        """
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(self.EXTENSION):
+                continue
+            filename = os.path.join(self.cache_dir, filename)
+            status = os.stat(filename)
+            entries.append((status.st_mtime, status.st_size, filename))
+        total_size = sum([entry[1] for entry in entries])
+        for _, size, filename in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            os.remove(filename)
+            total_size -= size
+
+    def clear(self):
+        """
+        Removes all entries from the cache
+        """
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(self.EXTENSION):
+                os.remove(os.path.join(self.cache_dir, filename))
+
+    def _get_file_identity(self, filename):
+        """
+        Returns the string identifying the version of the input file
+        """
+        if self.hash_content:
+            return get_file_hash(filename)
+        return get_file_identity(filename)
+
+    def _get_filename(self, key):
+        """
+        Returns the path to the cache file for the key
+        """
+        return os.path.join(self.cache_dir, key + self.EXTENSION)
@@ -29,6 +29,7 @@ from eqcat.parsers.generic_catalogue import GeneralCsvCatalogue
 from eqcat.isf_catalogue import (ISFCatalogue, Magnitude,
                                  Origin, Location, Event)
 from eqcat.parsers.gcmt_ndk_parser import ParseNDKtoGCMT
+from eqcat.parsers.base import open_catalogue_file
 
 def _header_check(input_keys, catalogue_keys):
     valid_key_list = []
@@ -68,43 +69,50 @@ class GenericCataloguetoISFParser(object):
     Reads the generic csv catalogue file to return an instance of the
     ISFCatalogue class
     '''
-    def __init__(self, filename):
+    def __init__(self, filename, parallel_decompression=False):
         '''
+        :param str filename:
+            Path to the csv file (which may be compressed with gzip, bz2, xz
+            or zstd)
+        :param bool parallel_decompression:
+            Use an external multi-threaded decompressor if available
         '''
         self.filename = filename
+        self.parallel_decompression = parallel_decompression
         self.catalogue = None
 
     def parse(self, cat_id, cat_name):
         '''
         Opens the raw file parses the catalogue then exports
         '''
-        filedata = open(self.filename, 'rU')
         self.catalogue = GeneralCsvCatalogue()
-        # Reading the data file
-        data = csv.DictReader(filedata)
-        # Parsing the data content
-        for irow, row in enumerate(data):
-            if irow == 0:
-                valid_key_list = _header_check(row.keys(), 
-                    self.catalogue.TOTAL_ATTRIBUTE_LIST)
-            for key in valid_key_list:
-                if key in catalogue.FLOAT_ATTRIBUTE_LIST:
-                    self.catalogue.data[key] = _float_check(
-                        self.catalogue.data[key], 
-                        row[key])
-                elif key in catalogue.INT_ATTRIBUTE_LIST:
-                    self.catalogue.data[key] = _int_check(
-                        self.catalogue.data[key],
-                        row[key])
-                else:
-                    self.catalogue.data[key].append(row[key])
-        self.export(cat_id, cat_name)
+        with open_catalogue_file(self.filename, 'rU',
+                                 self.parallel_decompression) as filedata:
+            # Reading the data file
+            data = csv.DictReader(filedata)
+            # Parsing the data content
+            for irow, row in enumerate(data):
+                if irow == 0:
+                    valid_key_list = _header_check(row.keys(), 
+                        self.catalogue.TOTAL_ATTRIBUTE_LIST)
+                for key in valid_key_list:
+                    if key in self.catalogue.FLOAT_ATTRIBUTE_LIST:
+                        self.catalogue.data[key] = _float_check(
+                            self.catalogue.data[key], 
+                            row[key])
+                    elif key in self.catalogue.INT_ATTRIBUTE_LIST:
+                        self.catalogue.data[key] = _int_check(
+                            self.catalogue.data[key],
+                            row[key])
+                    else:
+                        self.catalogue.data[key].append(row[key])
+        return self.export(cat_id, cat_name)
 
     def export(self, cat_id=None, cat_name=None):
         """
         Exports the catalogue to ISF Format
         """
-        return self.catalogue.write_to_isf_catalogue()
+        return self.catalogue.write_to_isf_catalogue(cat_id, cat_name)
 
 
 class GenericCataloguetoGCMT(GenericCataloguetoISFParser):
@@ -116,7 +124,7 @@ class GenericCataloguetoGCMT(GenericCataloguetoISFParser):
         """
         Exports the catalogue to GCMT format
         """
-        return catalogue.write_to_gcmt_class()
+        return self.catalogue.write_to_gcmt_class()
 
 
 class GCMTtoISFParser(object):
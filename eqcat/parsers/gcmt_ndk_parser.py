@@ -22,8 +22,8 @@ import re
 import datetime
 import numpy as np
 from math import floor, fabs
-from linecache import getlines
 import eqcat.gcmt_utils as utils
+from eqcat.parsers.base import open_catalogue_file
 from eqcat.gcmt_catalogue import (GCMTHypocentre, GCMTCentroid, 
                                   GCMTPrincipalAxes, GCMTNodalPlanes,
                                   GCMTMomentTensor, GCMTEvent, GCMTCatalogue)
@@ -103,19 +103,25 @@ class ParseNDKtoGCMT(object):
     '''
     Implements the parser to read a file in ndk format to the GCMT catalogue
     '''
-    def __init__(self, filename):
+    def __init__(self, filename, parallel_decompression=False):
         '''
         :param str filename:
-            Name of the catalogue file in ndk format
+            Name of the catalogue file in ndk format (which may be compressed
+            with gzip, bz2, xz or zstd)
+        :param bool parallel_decompression:
+            Use an external multi-threaded decompressor if available
         '''
         self.filename = filename
+        self.parallel_decompression = parallel_decompression
         self.data = GCMTCatalogue()
 
     def read_file(self, start_year=None, end_year=None):
         '''
         Reads the file
         '''
-        raw_data = getlines(self.filename)
+        with open_catalogue_file(self.filename,
+                parallel=self.parallel_decompression) as fle:
+            raw_data = fle.readlines()
         num_lines = len(raw_data)
         if ((float(num_lines) / 5.) - float(num_lines / 5)) > 1E-9:
             raise IOError('GCMT represented by 5 lines - number in file not'
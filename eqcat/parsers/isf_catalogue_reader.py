@@ -21,15 +21,20 @@ headers
 '''
 import os
 import datetime
+import hashlib
+import multiprocessing
 import numpy as np
 from math import floor, ceil, fabs
 from eqcat.parsers.base import (BaseCatalogueDatabaseReader,
-                                _to_int, _to_str, _to_float)
+                                get_compression, _to_int, _to_str, _to_float)
 from eqcat.isf_catalogue import (Magnitude,
                                  Location,
                                  Origin,
+                                 OriginMetadata,
                                  Event,
-                                 ISFCatalogue)
+                                 ISFCatalogue,
+                                 DATAMAP,
+                                 MAGDATAMAP)
 
 
 origin_header = '   Date       Time        Err   RMS Latitude Longitude  '\
@@ -72,19 +77,19 @@ def get_time_from_str(row):
 
 def get_origin_metadata(row):
     """
-    Returns the dictionary of metadata from the origins
-    """
-    metadata = {
-        'Nphases': _to_int(row[83:87]),
-        'Nstations': _to_int(row[88:92]),
-        'AzimuthGap': _to_float(row[93:96]),
-        'minDist': _to_float(row[97:103]),
-        'maxDist': _to_float(row[104:110]),
-        'FixedTime': _to_str(row[22]),
-        'DepthSolution': _to_str(row[54]),
-        'AnalysisType': _to_str(row[111]),
-        'LocationMethod': _to_str(row[113]),
-        'EventType': _to_str(row[115:117])}
+    Returns the metadata of the origin as an instance of OriginMetadata
+    """
+    metadata = OriginMetadata(
+        Nphases=_to_int(row[83:87]),
+        Nstations=_to_int(row[88:92]),
+        AzimuthGap=_to_float(row[93:96]),
+        minDist=_to_float(row[97:103]),
+        maxDist=_to_float(row[104:110]),
+        FixedTime=_to_str(row[22]),
+        DepthSolution=_to_str(row[54]),
+        AnalysisType=_to_str(row[111]),
+        LocationMethod=_to_str(row[113]),
+        EventType=_to_str(row[115:117]))
     return metadata
 
 def get_event_origin_row(row, selected_agencies=[]):
@@ -138,6 +143,327 @@ def get_event_magnitude(row, event_id, selected_agencies=[]):
                      scale=row[:5].strip(' '), sigma=sigma, stations=nstations) 
 
 
+def _to_nan_float(string):
+    """
+    Converts a string to a float, returning NaN if empty
+    """
+    value = _to_float(string)
+    if value is None:
+        return np.nan
+    return value
+
+
+def get_origin_table_row(row, event_id, selected_agencies=[]):
+    """
+    Parses the Origin row from ISF format directly to a tuple ordered
+    according to isf_catalogue.DATAMAP, or returns None if the author is not
+    one of the selected agencies. Missing optional values are rendered as
+    NaN, as in :meth: eqcat.isf_catalogue.ISFCatalogue.get_origin_mag_tables
+    """
+    author = _to_str(row[118:127])
+    if len(selected_agencies) and not author in selected_agencies:
+        return None
+    return (event_id, _to_str(row[128:]), author,
+            int(row[0:4]), int(row[5:7]), int(row[8:10]),
+            int(row[11:13]), int(row[14:16]), float(row[17:22]),
+            _to_nan_float(row[24:29]),
+            float(row[45:54]), float(row[36:44]), _to_nan_float(row[71:76]),
+            _to_nan_float(row[55:60]), _to_nan_float(row[61:66]),
+            _to_nan_float(row[67:70]), _to_nan_float(row[78:82]), 0)
+
+
+def get_magnitude_table_row(row, event_id, selected_agencies=[]):
+    """
+    Parses the Magnitude row from ISF format directly to a tuple ordered
+    according to isf_catalogue.MAGDATAMAP, or returns None if the author is
+    not one of the selected agencies
+    """
+    author = row[20:29].strip(' ')
+    if len(selected_agencies) and not author in selected_agencies:
+        return None
+    origin_id = _to_str(row[30:])
+    value = _to_float(row[6:10])
+    scale = row[:5].strip(' ') or 'UK'
+    magnitude_id = "|".join([origin_id, author, "{:.2f}".format(value),
+                             scale])
+    return (event_id, origin_id, magnitude_id, value,
+            _to_nan_float(row[11:14]), scale, author)
+
+
+def _grow_table(table, size):
+    """
+    Resizes a table (in place where possible) such that it can hold at least
+    size rows, doubling the current length to amortise the reallocation
+    """
+    if size > len(table):
+        table.resize(max(2 * len(table), size), refcheck=False)
+    return table
+
+
+def get_event_chunk_offsets(filename, number_chunks):
+    """
+    Splits the file into (approximately) equally sized byte ranges, with each
+    range beginning on an event header row
+    :param str filename:
+        Path to the ISF file
+    :param int number_chunks:
+        Target number of chunks
+    :returns:
+        List of (start, end) byte offsets
+    """
+    file_size = os.path.getsize(filename)
+    chunk_size = max(file_size // max(number_chunks, 1), 1)
+    offsets = [0]
+    with open(filename, 'rb') as fle:
+        for target in range(chunk_size, file_size, chunk_size):
+            if target <= offsets[-1]:
+                # Previous chunk already extends beyond this target
+                continue
+            fle.seek(target)
+            # Skip the (probably) partial row
+            position = target + len(fle.readline())
+            while position < file_size:
+                row = fle.readline()
+                if 'Event' in row:
+                    break
+                position += len(row)
+            if position >= file_size:
+                break
+            offsets.append(position)
+    offsets.append(file_size)
+    return [(offsets[iloc], offsets[iloc + 1])
+            for iloc in range(0, len(offsets) - 1)]
+
+
+def _iter_byte_range(fle, start, end):
+    """
+    Generator yielding the rows of an open file found between the start and
+    end byte offsets
+    """
+    fle.seek(start)
+    position = start
+    while position < end:
+        row = fle.readline()
+        if not row:
+            break
+        position += len(row)
+        yield row
+
+
+def _parse_isf_chunk(args):
+    """
+    Parses the events found within a byte range of the ISF file. Defined at
+    module level so that it can be dispatched to a multiprocessing pool
+    :param tuple args:
+        (filename, start, end, selected_origin_agencies,
+         selected_magnitude_agencies)
+    :returns:
+        List of instances of :class: eqcat.isf_catalogue.Event
+    """
+    filename, start, end, origin_agencies, magnitude_agencies = args
+    reader = ISFReader(filename, origin_agencies, magnitude_agencies)
+    with open(filename, 'rb') as fle:
+        return list(reader._parse_rows(_iter_byte_range(fle, start, end)))
+
+
+def _date_to_str(value):
+    """
+    Renders a date (as instance of datetime.date or a string YYYY/MM/DD) to
+    the string used in the event index
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return "%04d/%02d/%02d" % (value.year, value.month, value.day)
+    return value.replace("-", "/")
+
+
+class ISFEventIndex(object):
+    """
+    Index of the byte offset of each event header in an ISF file, stored in
+    a sidecar text file. Each event is stored with its ID and the date of its
+    prime origin (or first origin if no prime is indicated)
+    :param str filename:
+        Path to the ISF file
+    :param str index_file:
+        Path to the index file (defaults to the ISF file path + ".idx")
+    :param list event_ids:
+        Event IDs in file order
+    :param list offsets:
+        Byte offsets of the event headers
+    :param list dates:
+        Event dates as strings YYYY/MM/DD (empty if the event has no origins)
+    :param int file_size:
+        Size of the file (bytes) covered by the index
+    """
+    HEADER = "# ISF event index"
+    FINGERPRINT_SIZE = 65536
+
+    def __init__(self, filename, index_file=None):
+        """
+        Instantiate the index
+        """
+        self.filename = filename
+        self.index_file = index_file or (filename + ".idx")
+        self.event_ids = []
+        self.offsets = []
+        self.dates = []
+        self.file_size = 0
+        self.fingerprint = None
+
+    def update(self):
+        """
+        Loads the index from the sidecar file and brings it up to date. If the
+        ISF file has only grown by appending then just the new section of the
+        file is scanned, otherwise the index is rebuilt from the start
+        :returns:
+            The index (self)
+        """
+        if get_compression(self.filename):
+            raise ValueError("Event index requires an uncompressed file")
+        file_size = os.path.getsize(self.filename)
+        start = 0
+        if self._load() and (self.file_size <= file_size) and\
+            (self._get_fingerprint(self.file_size) == self.fingerprint):
+            if self.file_size == file_size:
+                # Index is already up to date
+                return self
+            if len(self.offsets):
+                # Last event may have been incomplete - rescan it
+                start = self.offsets.pop()
+                self.event_ids.pop()
+                self.dates.pop()
+        else:
+            self.event_ids = []
+            self.offsets = []
+            self.dates = []
+        self._scan(start, file_size)
+        self.file_size = file_size
+        self.fingerprint = self._get_fingerprint(file_size)
+        self._save()
+        return self
+
+    def get_event_ranges(self, event_ids):
+        """
+        Returns the sorted list of (start, end) byte ranges of the requested
+        events. Event IDs not found in the index are ignored
+        """
+        event_ids = set(event_ids)
+        return self._to_ranges([iloc for iloc, event_id
+                                in enumerate(self.event_ids)
+                                if event_id in event_ids])
+
+    def get_date_ranges(self, start_date=None, end_date=None):
+        """
+        Returns the list of (start, end) byte ranges of the events whose
+        date is within the (inclusive) date range
+        """
+        start_date = _date_to_str(start_date) if start_date else ""
+        end_date = _date_to_str(end_date) if end_date else "9999/99/99"
+        return self._to_ranges([iloc for iloc, event_date
+                                in enumerate(self.dates)
+                                if event_date and
+                                (start_date <= event_date <= end_date)])
+
+    def _to_ranges(self, locations):
+        """
+        Converts a list of event locations in the index to byte ranges,
+        merging consecutive events into a single range
+        """
+        ranges = []
+        for iloc in locations:
+            start = self.offsets[iloc]
+            if iloc + 1 < len(self.offsets):
+                end = self.offsets[iloc + 1]
+            else:
+                end = self.file_size
+            if len(ranges) and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+
+    def _scan(self, start, end):
+        """
+        Scans the file between the start and end offsets, adding each event
+        header to the index
+        """
+        is_origin = False
+        last_date = None
+        with open(self.filename, 'rb') as fle:
+            position = start
+            for row in _iter_byte_range(fle, start, end):
+                offset = position
+                position += len(row)
+                row = row.rstrip('\n')
+                if '(#PRIME)' in row:
+                    if is_origin and last_date:
+                        self.dates[-1] = last_date
+                    continue
+                if '(#CENTROID)' in row:
+                    continue
+                if 'Event' in row:
+                    self.event_ids.append(row.split()[1])
+                    self.offsets.append(offset)
+                    self.dates.append("")
+                    is_origin = False
+                    last_date = None
+                    continue
+                if row == origin_header:
+                    is_origin = True
+                elif row == magnitude_header:
+                    is_origin = False
+                elif is_origin and len(row) == 136 and len(self.dates):
+                    last_date = row[:10]
+                    if not self.dates[-1]:
+                        self.dates[-1] = last_date
+
+    def _get_fingerprint(self, size):
+        """
+        Returns a hash of the start of the file and of the section of the
+        file preceding the given size
+        """
+        checksum = hashlib.sha1()
+        with open(self.filename, 'rb') as fle:
+            checksum.update(fle.read(min(size, self.FINGERPRINT_SIZE)))
+            fle.seek(max(size - self.FINGERPRINT_SIZE, 0))
+            checksum.update(fle.read(size - fle.tell()))
+        return checksum.hexdigest()
+
+    def _load(self):
+        """
+        Loads the index from the sidecar file, returning False if no valid
+        index file is found
+        """
+        if not os.path.exists(self.index_file):
+            return False
+        with open(self.index_file, 'rt') as fle:
+            header = fle.readline().rstrip('\n').split(",")
+            if header[0] != self.HEADER:
+                return False
+            self.file_size = int(header[1])
+            self.fingerprint = header[2]
+            self.event_ids = []
+            self.offsets = []
+            self.dates = []
+            for row in fle:
+                event_id, offset, event_date = row.rstrip('\n').split(",")
+                self.event_ids.append(event_id)
+                self.offsets.append(int(offset))
+                self.dates.append(event_date)
+        return True
+
+    def _save(self):
+        """
+        Writes the index to the sidecar file
+        """
+        with open(self.index_file, 'wt') as fle:
+            fle.write("%s,%d,%s\n" % (self.HEADER, self.file_size,
+                                      self.fingerprint))
+            for event_id, offset, event_date in zip(self.event_ids,
+                                                    self.offsets,
+                                                    self.dates):
+                fle.write("%s,%d,%s\n" % (event_id, offset, event_date))
+
+
 class ISFReader(BaseCatalogueDatabaseReader):
     '''
     Class to read an ISF formatted earthquake catalogue considering only the
@@ -148,70 +474,334 @@ class ISFReader(BaseCatalogueDatabaseReader):
         Reads the catalogue from the file and assigns the identifier and name
         """
         self.catalogue = ISFCatalogue(identifier, name)
-        f = open(self.filename, 'rt')
-        counter = 0
+        for event in self.iter_events():
+            self.catalogue.events.append(event)
+        return self.catalogue
+
+    def read_file_parallel(self, identifier, name, processes=None,
+            chunks_per_process=4):
+        """
+        Reads the catalogue by splitting the file into byte ranges starting
+        on event headers and parsing the ranges in a pool of processes. The
+        events are returned in file order, so the catalogue is identical to
+        that returned by :meth: read_file. Compressed files cannot be split by
+        byte offset and are read serially with :meth: read_file
+        :param int processes:
+            Number of processes (defaults to the number of CPUs)
+        :param int chunks_per_process:
+            Number of byte ranges per process (more chunks balance the load
+            better at the cost of more inter-process communication)
+        """
+        if self.compression:
+            # Byte offsets cannot be used in a compressed stream
+            return self.read_file(identifier, name)
+        if not processes:
+            processes = multiprocessing.cpu_count()
+        self.catalogue = ISFCatalogue(identifier, name)
+        chunks = get_event_chunk_offsets(self.filename,
+                                         processes * chunks_per_process)
+        tasks = [(self.filename, start, end,
+                  self.selected_origin_agencies,
+                  self.selected_magnitude_agencies)
+                 for start, end in chunks]
+        pool = multiprocessing.Pool(processes)
+        try:
+            # imap preserves the order of the chunks
+            for events in pool.imap(_parse_isf_chunk, tasks):
+                self.catalogue.events.extend(events)
+        finally:
+            pool.close()
+            pool.join()
+        return self.catalogue
+
+    def read_events(self, identifier, name, event_ids, index=None):
+        """
+        Reads only the requested events, seeking directly to them using the
+        event index
+        :param list event_ids:
+            List of event IDs
+        :param index:
+            Event index as instance of :class: ISFEventIndex (if not supplied
+            the index is loaded from, or built into, the sidecar file)
+        """
+        if index is None:
+            index = ISFEventIndex(self.filename).update()
+        return self._read_byte_ranges(identifier, name,
+                                      index.get_event_ranges(event_ids))
+
+    def read_date_range(self, identifier, name, start_date=None,
+            end_date=None, index=None):
+        """
+        Reads only the events within a date range (inclusive), seeking
+        directly to them using the event index
+        :param start_date:
+            Start date as instance of datetime.date or string YYYY/MM/DD
+        :param end_date:
+            End date as instance of datetime.date or string YYYY/MM/DD
+        :param index:
+            Event index as instance of :class: ISFEventIndex (if not supplied
+            the index is loaded from, or built into, the sidecar file)
+        """
+        if index is None:
+            index = ISFEventIndex(self.filename).update()
+        return self._read_byte_ranges(
+            identifier, name, index.get_date_ranges(start_date, end_date))
+
+    def _read_byte_ranges(self, identifier, name, byte_ranges):
+        """
+        Reads the events found within a list of (start, end) byte ranges
+        """
+        self.catalogue = ISFCatalogue(identifier, name)
+        with open(self.filename, 'rb') as fle:
+            for start, end in byte_ranges:
+                self.catalogue.events.extend(
+                    self._parse_rows(_iter_byte_range(fle, start, end)))
+        return self.catalogue
+
+    def read_to_arrays(self, initial_size=100000):
+        """
+        Reads the file directly into the origin and magnitude tables (numpy
+        structured arrays defined by isf_catalogue.DATAMAP and
+        isf_catalogue.MAGDATAMAP), without building the intermediate
+        Event, Origin, Location and Magnitude objects. The tables are
+        equivalent to those returned by
+        :meth: eqcat.isf_catalogue.ISFCatalogue.get_origin_mag_tables for the
+        catalogue returned by :meth: read_file
+        :param int initial_size:
+            Number of rows initially allocated to each table (the tables
+            grow as needed)
+        :returns:
+            origin_data - Origin table
+            mag_data - Magnitude table
+        """
+        origin_agencies = self.selected_origin_agencies
+        magnitude_agencies = self.selected_magnitude_agencies
+        origin_data = np.zeros(initial_size, dtype=DATAMAP)
+        mag_data = np.zeros(initial_size, dtype=MAGDATAMAP)
+        n_origins = 0
+        n_mags = 0
+        # Rows of the event currently being parsed
+        event_origins = 0
+        event_mags = 0
+        event_id = None
+        last_origin = False
+        is_origin = False
+        is_magnitude = False
+        skip_event = False
+        with self.open_file() as fle:
+            for row in fle:
+                if skip_event and not 'Event' in row:
+                    continue
+
+                if is_origin and origin_agencies and len(row) > 135 and\
+                    not row[118:127].strip(' ') in origin_agencies:
+                    if len(row.rstrip('\n')) == 136 and\
+                        not row.startswith(origin_header):
+                        last_origin = False
+                        continue
+
+                row = row.rstrip('\n')
+                if not row:
+                    continue
+
+                if '(#PRIME)' in row:
+                    if last_origin:
+                        origin_data['prime'][n_origins - 1] = 1
+                    continue
+
+                if '(#CENTROID)' in row:
+                    continue
+
+                if 'Event' in row:
+                    if (n_origins == event_origins) or\
+                        (n_mags == event_mags):
+                        # Previous event is incomplete - discard its rows
+                        n_origins = event_origins
+                        n_mags = event_mags
+                    event_origins = n_origins
+                    event_mags = n_mags
+                    event_id = row.split()[1]
+                    last_origin = False
+                    is_origin = False
+                    is_magnitude = False
+                    skip_event = False
+                    continue
+
+                if row == origin_header:
+                    is_origin = True
+                    is_magnitude = False
+                    continue
+                elif row == magnitude_header:
+                    is_origin = False
+                    is_magnitude = True
+                    if event_id is not None and n_origins == event_origins:
+                        skip_event = True
+                    continue
+
+                if event_id is None:
+                    continue
+
+                if is_magnitude and len(row) == 38:
+                    mag = get_magnitude_table_row(row, event_id,
+                                                  magnitude_agencies)
+                    if mag:
+                        mag_data = _grow_table(mag_data, n_mags + 1)
+                        mag_data[n_mags] = mag
+                        n_mags += 1
+                    continue
+
+                if is_origin and len(row) == 136:
+                    orig = get_origin_table_row(row, event_id,
+                                                origin_agencies)
+                    last_origin = orig is not None
+                    if last_origin:
+                        origin_data = _grow_table(origin_data, n_origins + 1)
+                        origin_data[n_origins] = orig
+                        n_origins += 1
+        if (n_origins == event_origins) or (n_mags == event_mags):
+            # Final event is incomplete
+            n_origins = event_origins
+            n_mags = event_mags
+        origin_data.resize(n_origins, refcheck=False)
+        mag_data.resize(n_mags, refcheck=False)
+        return origin_data, mag_data
+
+    def read_table_catalogue(self, identifier, name):
+        """
+        Reads the file into an instance of :class: ISFCatalogue backed by the
+        origin and magnitude tables (see :meth: read_to_arrays), such that
+        the event objects are only built when accessed
+        """
+        origin_data, mag_data = self.read_to_arrays()
+        return ISFCatalogue.from_tables(identifier, name, origin_data,
+                                        mag_data)
+
+    def iter_events(self):
+        """
+        Generator that reads the file line by line, yielding each event as
+        an instance of :class: eqcat.isf_catalogue.Event as soon as its block
+        has been parsed. Only the current event is held in memory, so the
+        memory use is independent of the size of the bulletin
+        """
+        with self.open_file() as fle:
+            for event in self._parse_rows(fle):
+                yield event
+
+    def _parse_rows(self, rows):
+        """
+        Parses an iterable of ISF rows, yielding the events that contain at
+        least one origin and one magnitude from the selected agencies.
+
+        Origin rows from unselected agencies are rejected using only the
+        author field of the raw row, and the Event object is only created
+        once the event is known to be retained. Events without any selected
+        origins are skipped from the start of the magnitude block.
+        :param rows:
+            Iterable of strings (e.g. an open file object)
+        """
+        origin_agencies = self.selected_origin_agencies
+        magnitude_agencies = self.selected_magnitude_agencies
+        header = None
+        event_id = None
+        origins = []
+        magnitudes = []
+        last_origin = None
         is_origin = False
         is_magnitude = False
-        for row in f.readlines():
-            if not row.rstrip('\n'):
+        skip_event = False
+        for row in rows:
+            if skip_event and not 'Event' in row:
+                # No selected origins in event - move to the next header
+                continue
+
+            if is_origin and origin_agencies and len(row) > 135 and\
+                not row[118:127].strip(' ') in origin_agencies:
+                # Origin row of an unselected agency - reject before decoding
+                if len(row.rstrip('\n')) == 136 and\
+                    not row.startswith(origin_header):
+                    last_origin = None
+                    continue
+
+            row = row.rstrip('\n')
+            if not row:
                 # Ignore empty rows
                 continue
-                
+
             if '(#PRIME)' in row:
                 # Previous origin block was the prime origin
-                if len(origins) > 0:
-                    origins[-1].is_prime = True
+                if last_origin is not None:
+                    last_origin.is_prime = True
                 continue
-                
+
             if '(#CENTROID)' in row:
                 # Previous origin block is a centroid
-                if len(origins) > 0:
-                    origins[-1].is_centroid = True
+                if last_origin is not None:
+                    last_origin.is_centroid = True
                 continue
 
             if 'Event' in row:
-                # Is an event header row
-                if counter > 0:
-                    # Add magnitudes and origins to previous event
-                    # and previous event to catalogue
-                    Event.origins = origins
-                    Event.magnitudes = magnitudes
-                    if len(Event.origins) and len(Event.magnitudes):
-                        Event.assign_magnitudes_to_origins()
-                        self.catalogue.events.append(Event)
-                
-                # Get a new event
-                Event = get_event_header_row(row.rstrip('\n'))
+                # Is an event header row - close the previous event
+                if header is not None:
+                    event = self._close_event(header, origins, magnitudes)
+                    if event is not None:
+                        yield event
+                # Start a new event
+                header = row
+                event_id = row.split()[1]
                 origins = []
                 magnitudes = []
-                counter += 1
+                last_origin = None
+                is_origin = False
+                is_magnitude = False
+                skip_event = False
                 continue
 
-            if row.rstrip('\n') == origin_header:
+            if row == origin_header:
                 is_origin = True
                 is_magnitude = False
                 continue
-            elif row.strip('\n') == magnitude_header:
+            elif row == magnitude_header:
                 is_origin = False
                 is_magnitude = True
+                if header is not None and not len(origins):
+                    skip_event = True
                 continue
             else:
                 pass
-            
-            if is_magnitude and len(row.strip('\n')) == 38:
+
+            if header is None:
+                # Rows preceding the first event header
+                continue
+
+            if is_magnitude and len(row) == 38:
                 # Is a magnitude row
-                mag = get_event_magnitude(row.strip('\n'),
-                                          Event.id,
-                                          self.selected_magnitude_agencies)
+                mag = get_event_magnitude(row, event_id, magnitude_agencies)
                 if mag:
                     magnitudes.append(mag)
                 continue
 
-            if is_origin and len(row.strip('\n')) == 136:
+            if is_origin and len(row) == 136:
                 # Is an origin row
-                orig = get_event_origin_row(row.strip('\n'),
-                                            self.selected_origin_agencies)
-                if orig:
-                    origins.append(orig)
-        return self.catalogue
+                last_origin = get_event_origin_row(row, origin_agencies)
+                if last_origin:
+                    origins.append(last_origin)
+        # Close the final event in the file
+        if header is not None:
+            event = self._close_event(header, origins, magnitudes)
+            if event is not None:
+                yield event
 
+    @staticmethod
+    def _close_event(header, origins, magnitudes):
+        """
+        Returns the event defined by the header row with the origins and
+        magnitudes assigned, or None if the event lacks either origins or
+        magnitudes from the selected agencies
+        """
+        if not len(origins) or not len(magnitudes):
+            return None
+        event = get_event_header_row(header)
+        event.origins = origins
+        event.magnitudes = magnitudes
+        event.assign_magnitudes_to_origins()
+        return event
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Longitude/latitude grid index of the origins of a catalogue, for spatial
+selections that only test the origins in the cells they overlap
+"""
+import os
+import zipfile
+import numpy as np
+from matplotlib.path import Path
+
+
+# Errors raised when loading a damaged (e.g. truncated or partly written) or
+# incompatible index file, which is then rebuilt
+INDEX_FILE_ERRORS = (IOError, OSError, EOFError, ValueError, KeyError,
+                     IndexError, zipfile.BadZipfile)
+
+
+def get_file_identity(filename):
+    """
+    Returns the string identifying the version of a file from its size and
+    modification time
+    """
+    status = os.stat(filename)
+    return "%d|%r" % (status.st_size, status.st_mtime)
+
+
+def get_cell_indices(values, origin, cell_size):
+    """
+    Returns the (unbounded) indices of the grid cells containing a set of
+    coordinates along one axis of a grid. All cell computations use this
+    function, so that a point on the edge of a cell is always assigned to
+    the same cell
+    """
+    return np.floor((np.asarray(values, dtype=float) - origin) /
+                    cell_size).astype(int)
+
+
+class SpatialGridIndex(object):
+    """
+    Index of points (e.g. origins) on a regular longitude/latitude grid. The
+    rows of the points are stored sorted by grid cell, with the offsets of
+    each cell in compressed sparse row form, such that the points of cell i
+    are rows[offsets[i]:offsets[i + 1]]. Points with missing coordinates are
+    not indexed. The coordinates are stored in the same order, so that
+    queries do not need to read the source table
+    :param float cell_size:
+        Size of the grid cells (decimal degrees)
+    :param float west:
+        Western edge of the grid
+    :param float south:
+        Southern edge of the grid
+    :param int nlon:
+        Number of cells along longitude
+    :param int nlat:
+        Number of cells along latitude
+    :param numpy.ndarray offsets:
+        Offsets of the cells in the sorted rows
+    :param numpy.ndarray rows:
+        Rows of the points (in the source table) sorted by cell
+    :param numpy.ndarray longitudes:
+        Longitudes of the points sorted by cell
+    :param numpy.ndarray latitudes:
+        Latitudes of the points sorted by cell
+    :param int number_rows:
+        Number of rows of the source table
+    :param str identity:
+        Identity of the source file (see get_file_identity), if any
+    """
+    def __init__(self, cell_size, west, south, nlon, nlat, offsets, rows,
+                 longitudes, latitudes, number_rows, identity=""):
+        """
+        Instantiate with the grid and the sorted points
+        """
+        self.cell_size = cell_size
+        self.west = west
+        self.south = south
+        self.nlon = nlon
+        self.nlat = nlat
+        self.offsets = offsets
+        self.rows = rows
+        self.longitudes = longitudes
+        self.latitudes = latitudes
+        self.number_rows = number_rows
+        self.identity = identity
+
+    @classmethod
+    def build(cls, longitudes, latitudes, cell_size=1.0, identity=""):
+        """
+        Builds the index of a set of points
+        :param numpy.ndarray longitudes:
+            Longitudes of the points (one per row of the source table)
+        :param numpy.ndarray latitudes:
+            Latitudes of the points
+        :param float cell_size:
+            Size of the grid cells (decimal degrees)
+        """
+        longitudes = np.asarray(longitudes, dtype=float)
+        latitudes = np.asarray(latitudes, dtype=float)
+        rows = np.where(np.isfinite(longitudes) & np.isfinite(latitudes))[0]
+        if len(rows):
+            west = np.floor(np.min(longitudes[rows]) / cell_size) * cell_size
+            south = np.floor(np.min(latitudes[rows]) / cell_size) * cell_size
+            nlon = int(get_cell_indices(np.max(longitudes[rows]), west,
+                                        cell_size)) + 1
+            nlat = int(get_cell_indices(np.max(latitudes[rows]), south,
+                                        cell_size)) + 1
+        else:
+            west, south, nlon, nlat = 0.0, 0.0, 1, 1
+        index = cls(cell_size, west, south, nlon, nlat, None, rows,
+                    longitudes[rows], latitudes[rows], len(longitudes),
+                    identity)
+        cells = index.get_cells(index.longitudes, index.latitudes)
+        order = np.argsort(cells, kind="mergesort")
+        index.rows = index.rows[order]
+        index.longitudes = index.longitudes[order]
+        index.latitudes = index.latitudes[order]
+        index.offsets = np.searchsorted(cells[order],
+                                        np.arange(nlon * nlat + 1))
+        return index
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Loads the index from a .npz file. Raises one of INDEX_FILE_ERRORS if
+        the file is damaged or does not hold a consistent index
+        """
+        if not zipfile.is_zipfile(filename):
+            raise IOError("Damaged spatial index file %s" % filename)
+        data = np.load(filename)
+        try:
+            index = cls(float(data["cell_size"]), float(data["west"]),
+                        float(data["south"]), int(data["nlon"]),
+                        int(data["nlat"]), data["offsets"], data["rows"],
+                        data["longitudes"], data["latitudes"],
+                        int(data["number_rows"]), str(data["identity"]))
+        finally:
+            data.close()
+        number_points = len(index.rows)
+        if len(index.offsets) != index.nlon * index.nlat + 1 or\
+                index.offsets[-1] != number_points or\
+                len(index.longitudes) != number_points or\
+                len(index.latitudes) != number_points:
+            raise ValueError("Inconsistent spatial index file %s" % filename)
+        return index
+
+    def save(self, filename):
+        """
+        Saves the index to a .npz file
+        """
+        np.savez(filename, cell_size=self.cell_size, west=self.west,
+                 south=self.south, nlon=self.nlon, nlat=self.nlat,
+                 offsets=self.offsets, rows=self.rows,
+                 longitudes=self.longitudes, latitudes=self.latitudes,
+                 number_rows=self.number_rows, identity=self.identity)
+
+    def get_cells(self, longitudes, latitudes):
+        """
+        Returns the cells of points within the grid
+        """
+        ilon = np.clip(get_cell_indices(longitudes, self.west,
+                                        self.cell_size), 0, self.nlon - 1)
+        ilat = np.clip(get_cell_indices(latitudes, self.south,
+                                        self.cell_size), 0, self.nlat - 1)
+        return ilat * self.nlon + ilon
+
+    def get_candidates(self, bounds):
+        """
+        Returns the locations (in the sorted points) of the points in the
+        cells overlapping a bounding box [llon, llat, ulon, ulat]
+        """
+        llon, llat, ulon, ulat = bounds
+        ilon = get_cell_indices([llon, ulon], self.west, self.cell_size)
+        ilat = get_cell_indices([llat, ulat], self.south, self.cell_size)
+        if ilon[1] < 0 or ilat[1] < 0 or ilon[0] >= self.nlon or\
+                ilat[0] >= self.nlat:
+            return np.array([], dtype=int)
+        ilon = np.clip(ilon, 0, self.nlon - 1)
+        ilat = np.clip(ilat, 0, self.nlat - 1)
+        # Cells of each grid row within the box are contiguous
+        first_cells = np.arange(ilat[0], ilat[1] + 1) * self.nlon
+        starts = self.offsets[first_cells + ilon[0]]
+        ends = self.offsets[first_cells + ilon[1] + 1]
+        if not len(starts):
+            return np.array([], dtype=int)
+        return np.concatenate([np.arange(start, end)
+                               for start, end in zip(starts, ends)])
+
+    def select_within_bounding_box(self, bounds):
+        """
+        Returns the sorted rows of the points within a bounding box
+        [llon, llat, ulon, ulat] (bounds included)
+        """
+        locations = self.get_candidates(bounds)
+        lons = self.longitudes[locations]
+        lats = self.latitudes[locations]
+        inside = (lons >= bounds[0]) & (lons <= bounds[2]) &\
+            (lats >= bounds[1]) & (lats <= bounds[3])
+        return np.sort(self.rows[locations[inside]])
+
+    def select_within_polygon(self, poly_lons, poly_lats):
+        """
+        Returns the sorted rows of the points within a polygon, testing the
+        containment (as matplotlib.path.Path.contains_points) only on the
+        points in the cells overlapping the polygon
+        """
+        locations = self.get_candidates([np.min(poly_lons), np.min(poly_lats),
+                                         np.max(poly_lons), np.max(poly_lats)])
+        if not len(locations):
+            return np.array([], dtype=int)
+        polypath = Path(np.column_stack([poly_lons, poly_lats]))
+        inside = polypath.contains_points(np.column_stack([
+            self.longitudes[locations], self.latitudes[locations]]))
+        return np.sort(self.rows[locations[inside]])
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Synthetic ISF bulletins and helper functions shared by the tests
+"""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from eqcat.parsers.isf_catalogue_reader import origin_header, \
+    magnitude_header
+
+
+AGENCIES = ["NEIC", "ISC", "EHB", "MOS"]
+
+
+def _origin_row(event, agency, origin_id, rng, depth=True):
+    """
+    Returns a fixed-width ISF origin row
+    """
+    row = [" "] * 136
+
+    def put(start, text):
+        row[start:(start + len(text))] = list(text)
+    put(0, "%04d/%02d/%02d" % (1990 + event % 20, 1 + event % 12,
+                               1 + event % 28))
+    put(11, "%02d:%02d:%05.2f" % (event % 24, event % 60,
+                                  rng.uniform(0., 59.9)))
+    put(24, " 0.50")
+    put(30, " 1.10")
+    put(36, "%8.4f" % rng.uniform(-60., 60.))
+    put(45, "%9.4f" % rng.uniform(-170., 170.))
+    put(55, " 10.0   5.0  45")
+    if depth:
+        put(71, "%5.1f" % rng.uniform(0., 300.))
+    put(78, " 2.0   20   15  90   1.00  50.00 m i ke")
+    put(118, "%-9s" % agency)
+    put(128, "%8s" % origin_id)
+    return "".join(row)
+
+
+def write_isf(filename, event_ids, agencies=AGENCIES, id_offset=100000,
+              seed=1):
+    """
+    Writes a synthetic ISF bulletin with one origin per agency for each
+    event, each with an mb and an MS magnitude. The ISC origin is the prime
+    origin, except for every fifth event, for which the prime marker follows
+    the last origin. Every seventh event has an ISC origin without depth
+    """
+    rng = random.Random(seed)
+    rows = ["DATA_TYPE BULLETIN IMS1.0:short", ""]
+    for event in event_ids:
+        rows.extend(["Event %d Synthetic Region" % (600000 + event), "",
+                     origin_header])
+        origin_ids = []
+        for iloc, agency in enumerate(agencies):
+            origin_id = "%d" % (id_offset + 10 * event + iloc)
+            origin_ids.append((agency, origin_id))
+            rows.append(_origin_row(event, agency, origin_id, rng,
+                                    not (agency == "ISC" and event % 7 == 3)))
+            prime_agency = agencies[-1] if event % 5 == 0 else "ISC"
+            if agency == prime_agency:
+                rows.append(" (#PRIME)")
+        rows.extend(["", magnitude_header])
+        for agency, origin_id in origin_ids:
+            for scale in ["mb", "MS"]:
+                rows.append("%-5s %4.1f %3.1f %4d %-9s %8s" % (
+                    scale, rng.uniform(4.0, 7.0), 0.1, 12, agency,
+                    origin_id))
+        rows.append("")
+    with open(filename, "w") as fle:
+        fle.write("\n".join(rows) + "\n")
+
+
+def same_tables(tables1, tables2):
+    """
+    Returns True if two pairs of origin and magnitude tables are equal
+    (with NaN equal to NaN)
+    """
+    for table1, table2 in zip(tables1, tables2):
+        if table1.dtype != table2.dtype or len(table1) != len(table2):
+            return False
+        for name in table1.dtype.names:
+            if table1.dtype[name].kind == "f":
+                if not np.allclose(table1[name], table2[name],
+                                   equal_nan=True):
+                    return False
+            elif not np.array_equal(table1[name], table2[name]):
+                return False
+    return True
+
+
+def same_selection(catalogue1, catalogue2):
+    """
+    Returns True if two instances of CatalogueDB hold the same origins and
+    magnitudes in the same order
+    """
+    return np.array_equal(
+        np.asarray(catalogue1.origins["originID"], dtype=str),
+        np.asarray(catalogue2.origins["originID"], dtype=str)) and\
+        np.array_equal(
+            np.asarray(catalogue1.magnitudes["magnitudeID"], dtype=str),
+            np.asarray(catalogue2.magnitudes["magnitudeID"], dtype=str))
+
+
+def get_event_records(events):
+    """
+    Returns all the attributes of a list of events (and of their origins,
+    locations and magnitudes) as nested tuples, for exact comparisons
+    """
+    def magnitude_record(magnitude):
+        return (magnitude.event_id, magnitude.origin_id, magnitude.value,
+                magnitude.author, magnitude.scale, magnitude.sigma,
+                magnitude.stations, magnitude.magnitude_id)
+
+    def origin_record(origin):
+        location = origin.location
+        metadata = origin.metadata
+        if metadata is not None:
+            metadata = sorted(metadata.items())
+        return (origin.id, origin.date, origin.time, origin.author,
+                origin.is_prime, origin.is_centroid, origin.time_error,
+                origin.time_rms, metadata,
+                (location.identifier, location.longitude, location.latitude,
+                 location.depth, location.semimajor90, location.semiminor90,
+                 location.error_strike, location.depth_error),
+                [magnitude_record(magnitude)
+                 for magnitude in origin.magnitudes])
+    return [(event.id, event.description,
+             [origin_record(origin) for origin in event.origins],
+             [magnitude_record(magnitude) for magnitude in event.magnitudes])
+            for event in events]
+
+
+class SyntheticFilesTestCase(unittest.TestCase):
+    """
+    Writes a synthetic bulletin of 40 events to a temporary directory
+    """
+    NUMBER_EVENTS = 40
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.isf_file = os.path.join(cls.tmp_dir, "bulletin.isf")
+        write_isf(cls.isf_file, range(cls.NUMBER_EVENTS))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Tests of the incremental ingestion of ISF bulletins into the database
+
+Run from the root of the repository with: python -m unittest discover
+"""
+import os
+import unittest
+import numpy as np
+import pandas as pd
+from eqcat.isf_catalogue import write_catalogue_tables
+from eqcat.parsers.isf_catalogue_reader import ISFReader
+from eqcat.catalogue_ingest import (MANIFEST_KEY, ingest_isf_file,
+                                    get_ingest_manifest)
+from eqcat.catalogue_query_tools import CatalogueDB
+from tests.synthetic_isf import AGENCIES, SyntheticFilesTestCase, write_isf
+
+
+class IngestTestCase(SyntheticFilesTestCase):
+    """
+    Tests the upsert of overlapping bulletins into the database
+    """
+    @classmethod
+    def setUpClass(cls):
+        super(IngestTestCase, cls).setUpClass()
+        # Events 30 - 59 with a new agency, overlapping events 30 - 39
+        cls.update_file = os.path.join(cls.tmp_dir, "update.isf")
+        write_isf(cls.update_file, range(30, 60), AGENCIES[:-1] + ["BJI"],
+                  id_offset=200000, seed=2)
+
+    def _write_database(self, categorical=False):
+        db_file = os.path.join(self.tmp_dir, "%s.h5" % self.id())
+        origin_data, mag_data = ISFReader(self.isf_file).read_to_arrays()
+        write_catalogue_tables(db_file, origin_data, mag_data,
+                               categorical=categorical)
+        return db_file, origin_data, mag_data
+
+    def _check_upsert(self, categorical):
+        db_file, origin_data, mag_data = self._write_database(categorical)
+        entry = ingest_isf_file(db_file, self.update_file)
+        self.assertEqual(entry["replaced_origins"], 10 * len(AGENCIES))
+        self.assertEqual(entry["replaced_magnitudes"],
+                         20 * len(AGENCIES))
+        self.assertEqual(ingest_isf_file(db_file, self.update_file), None)
+        _ = ingest_isf_file(db_file, self.update_file, force=True)
+        new_origins, new_mags = ISFReader(self.update_file).read_to_arrays()
+        database = CatalogueDB(db_file)
+        for table, data, new_data, id_column in [
+                (database.origins, origin_data, new_origins, "originID"),
+                (database.magnitudes, mag_data, new_mags, "magnitudeID")]:
+            kept = data[~np.in1d(data["eventID"], new_data["eventID"])]
+            self.assertTrue(np.array_equal(
+                np.asarray(table[id_column], dtype=str),
+                np.concatenate([kept[id_column], new_data[id_column]])))
+        self.assertEqual(
+            (database.origins["Agency"] == "BJI").sum(), 30)
+        self.assertEqual(len(get_ingest_manifest(db_file)), 2)
+
+    def test_upsert(self):
+        self._check_upsert(False)
+
+    def test_upsert_new_categories(self):
+        self._check_upsert(True)
+
+    def test_agency_selection(self):
+        db_file = self._write_database()[0]
+        entry = ingest_isf_file(db_file, self.update_file, ["ISC"])
+        self.assertEqual(entry["origin_agencies"], "ISC")
+        self.assertEqual(entry["origins"], 30)
+        # The same file with another agency selection is ingested
+        self.assertEqual(ingest_isf_file(db_file, self.update_file,
+                                         ["ISC"]), None)
+        entry = ingest_isf_file(db_file, self.update_file, ["BJI", "ISC"],
+                                ["BJI"])
+        self.assertEqual(entry["origin_agencies"], "BJI,ISC")
+        self.assertEqual(entry["magnitude_agencies"], "BJI")
+        self.assertEqual(ingest_isf_file(db_file, self.update_file,
+                                         ["ISC", "BJI"], ["BJI"]), None)
+        database = CatalogueDB(db_file)
+        self.assertEqual((database.origins["Agency"] == "BJI").sum(), 30)
+        self.assertEqual(len(get_ingest_manifest(db_file)), 2)
+
+    def test_older_manifest(self):
+        db_file = self._write_database()[0]
+        ingest_isf_file(db_file, self.update_file)
+        store = pd.HDFStore(db_file)
+        try:
+            store.put(MANIFEST_KEY, store[MANIFEST_KEY].drop(
+                ["origin_agencies", "magnitude_agencies"], axis=1))
+        finally:
+            store.close()
+        # Without the recorded selections the file is ingested again
+        self.assertNotEqual(ingest_isf_file(db_file, self.update_file),
+                            None)
+        self.assertEqual(ingest_isf_file(db_file, self.update_file), None)
+        self.assertEqual(len(get_ingest_manifest(db_file)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,699 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Tests of the hdf5 catalogue database and its selection tools on synthetic
+bulletins
+
+Run from the root of the repository with: python -m unittest discover
+"""
+import os
+import datetime
+import unittest
+import numpy as np
+import pandas as pd
+from matplotlib.path import Path
+from eqcat.isf_catalogue import write_catalogue_tables
+from eqcat.parsers.isf_catalogue_reader import ISFReader
+from eqcat.catalogue_query_tools import (CatalogueDB, CatalogueSelector,
+                                         CatalogueQuery, assign_source_zones,
+                                         get_zone_catalogues,
+                                         get_event_codes,
+                                         select_event_codes,
+                                         get_selected_events,
+                                         get_agency_origin_count,
+                                         get_agency_magnitude_count,
+                                         get_agency_magnitude_pairs,
+                                         to_categorical)
+from eqcat.spatial_index import SpatialGridIndex, get_file_identity
+from tests.synthetic_isf import SyntheticFilesTestCase, same_selection
+
+
+def get_table_records(events):
+    """
+    Returns the attributes of a list of events held in the catalogue tables
+    as nested tuples. The seconds are rounded to 10 microseconds, within
+    which the times of the events built from the tables agree
+    """
+    def magnitude_record(magnitude):
+        return (magnitude.event_id, magnitude.origin_id, magnitude.value,
+                magnitude.author, magnitude.scale, magnitude.sigma,
+                magnitude.magnitude_id)
+
+    def origin_record(origin):
+        location = origin.location
+        seconds = origin.time.second + origin.time.microsecond / 1.0E6
+        return (origin.id, origin.date, origin.time.hour,
+                origin.time.minute, round(seconds, 5), origin.author,
+                origin.is_prime, origin.time_error,
+                (location.identifier, location.longitude, location.latitude,
+                 location.depth, location.semimajor90, location.semiminor90,
+                 location.error_strike, location.depth_error),
+                [magnitude_record(magnitude)
+                 for magnitude in origin.magnitudes])
+    return [(event.id, [origin_record(origin) for origin in event.origins],
+             [magnitude_record(magnitude) for magnitude in event.magnitudes])
+            for event in events]
+
+
+class CatalogueDBTestCase(SyntheticFilesTestCase):
+    """
+    Writes the hdf5 catalogue database of the synthetic bulletin
+    """
+    SELECTIONS = [
+        ("select_by_agency", ("ISC",)),
+        ("limit_to_agency", ("EHB",)),
+        ("select_within_depth_range", (10., 150.)),
+        ("select_within_depth_range", (0., 200., "all")),
+        ("select_within_magnitude_range", (5.0, 6.5)),
+        ("select_within_magnitude_range", (4.5, 6.8, "all")),
+        ("select_within_polygon", ([-100., 100., 100., -100.],
+                                   [-40., -40., 40., 40.])),
+        ("select_within_bounding_box", ([-50., -30., 60., 30.],)),
+        ("select_within_time_window", (datetime.datetime(1992, 1, 1),
+                                       datetime.datetime(2000, 6, 1))),
+        ("select_within_time_window", (datetime.datetime(1992, 1, 1),
+                                       datetime.datetime(2000, 6, 1),
+                                       "all"))]
+
+    @classmethod
+    def setUpClass(cls):
+        super(CatalogueDBTestCase, cls).setUpClass()
+        cls.origin_data, cls.mag_data = ISFReader(
+            cls.isf_file).read_to_arrays()
+        cls.db_file = os.path.join(cls.tmp_dir, "catalogue.h5")
+        write_catalogue_tables(cls.db_file, cls.origin_data, cls.mag_data)
+        cls.categorical_file = os.path.join(cls.tmp_dir, "categorical.h5")
+        write_catalogue_tables(cls.categorical_file, cls.origin_data,
+                               cls.mag_data, categorical=True)
+
+    def _get_databases(self):
+        """
+        Returns the databases whose selections must equal the selections of
+        the database loaded in full
+        """
+        return [CatalogueDB(self.db_file, lazy=True),
+                CatalogueDB(self.db_file, categorical=True),
+                CatalogueDB(self.categorical_file),
+                CatalogueDB(self.categorical_file, lazy=True,
+                            categorical=True)]
+
+    def _check_selections(self, selections):
+        for method, args in selections:
+            expected = getattr(CatalogueSelector(CatalogueDB(self.db_file)),
+                               method)(*args)
+            self.assertTrue(len(expected.origins) > 0)
+            for database in self._get_databases():
+                selection = getattr(CatalogueSelector(database),
+                                    method)(*args)
+                self.assertTrue(same_selection(selection, expected),
+                                "%s%s" % (method, args))
+
+
+class EventCodesTestCase(unittest.TestCase):
+    """
+    Tests the integer event codes shared by the origin and magnitude tables
+    """
+    ORIGIN_IDS = ["E3", "E1", "E3", "E2", "E1", "E3"]
+
+    MAGNITUDE_IDS = ["E1", "E4", "E3", "E1", "E3"]
+
+    def _check_codes(self, event_codes, origin_ids, magnitude_ids):
+        """
+        Checks the codes and the rows of each event in each table
+        """
+        event_ids = list(event_codes.event_ids)
+        for ids, codes, order, offsets in [
+                (origin_ids, event_codes.origin_codes,
+                 event_codes.origin_order, event_codes.origin_offsets),
+                (magnitude_ids, event_codes.magnitude_codes,
+                 event_codes.magnitude_order,
+                 event_codes.magnitude_offsets)]:
+            self.assertEqual([event_ids[code] for code in codes], ids)
+            self.assertEqual(len(offsets), len(event_ids) + 1)
+            for code, event_id in enumerate(event_ids):
+                self.assertEqual(
+                    list(order[offsets[code]:offsets[code + 1]]),
+                    [iloc for iloc, value in enumerate(ids)
+                     if value == event_id])
+
+    def test_get_event_codes(self):
+        event_codes = get_event_codes(self.ORIGIN_IDS, self.MAGNITUDE_IDS)
+        # Sorted event IDs of both tables
+        self.assertEqual(list(event_codes.event_ids),
+                         ["E1", "E2", "E3", "E4"])
+        self._check_codes(event_codes, self.ORIGIN_IDS, self.MAGNITUDE_IDS)
+
+    def test_select_event_codes(self):
+        event_codes = get_event_codes(self.ORIGIN_IDS, self.MAGNITUDE_IDS)
+        origin_mask = np.array([True, False, True, True, False, True])
+        magnitude_mask = np.array([False, True, True, True, False])
+        selected = select_event_codes(event_codes, origin_mask,
+                                      magnitude_mask)
+        # The codes of the full tables are kept
+        self.assertTrue(selected.event_ids is event_codes.event_ids)
+        self._check_codes(
+            selected,
+            [value for value, keep in zip(self.ORIGIN_IDS, origin_mask)
+             if keep],
+            [value for value, keep in zip(self.MAGNITUDE_IDS,
+                                          magnitude_mask) if keep])
+
+    def test_get_selected_events(self):
+        event_codes = get_event_codes(self.ORIGIN_IDS, self.MAGNITUDE_IDS)
+        idx = np.array([True, True, False, False, True, True])
+        for select_type, expected in [("any", [True, False, True, False]),
+                                      ("all", [True, False, False, False])]:
+            self.assertEqual(list(get_selected_events(
+                event_codes.origin_codes, event_codes.origin_offsets, idx,
+                select_type)), expected)
+
+
+class CatalogueSelectorTestCase(CatalogueDBTestCase):
+    """
+    Tests the equivalence of the selections of the database evaluated from
+    the file and from the loaded tables
+    """
+    def test_selector_equivalence(self):
+        self._check_selections(self.SELECTIONS)
+
+    def test_time_window(self):
+        database = CatalogueDB(self.db_file)
+        origins = database.origins
+        times = [datetime.datetime(*map(int, row[:5])) +
+                 datetime.timedelta(seconds=float(row[5]))
+                 for row in origins[["year", "month", "day", "hour",
+                                     "minute", "second"]].values.tolist()]
+        selector = CatalogueSelector(database)
+        for start, end in [(datetime.datetime(1992, 1, 1),
+                            datetime.datetime(2000, 6, 1)),
+                           (None, datetime.datetime(1995, 1, 1)),
+                           (datetime.datetime(2005, 3, 1), None)]:
+            in_window = np.array([(start is None or value >= start) and
+                                  (end is None or value <= end)
+                                  for value in times])
+            expected = set(origins["eventID"][in_window])
+            self.assertTrue(0 < len(expected) < self.NUMBER_EVENTS)
+            selection = selector.select_within_time_window(start, end)
+            self.assertEqual(set(selection.origins["eventID"]), expected)
+
+    def test_select_events(self):
+        for database in [CatalogueDB(self.db_file)] + self._get_databases():
+            event_codes = database.get_event_codes()
+            selected = np.zeros(len(event_codes.event_ids), dtype=bool)
+            selected[::3] = True
+            event_ids = event_codes.event_ids[selected]
+            selection = database.select_events(selected)
+            expected = CatalogueDB(self.db_file)
+            for table, source_table in [
+                    (selection.origins, expected.origins),
+                    (selection.magnitudes, expected.magnitudes)]:
+                self.assertTrue(np.array_equal(
+                    np.asarray(table["eventID"], dtype=str),
+                    np.asarray(source_table["eventID"], dtype=str)[
+                        source_table["eventID"].isin(event_ids).values]))
+            # The selection keeps the codes of the full tables
+            self.assertTrue(selection.get_event_codes().event_ids is
+                            event_codes.event_ids)
+
+    def test_lazy_selection(self):
+        # The selections are evaluated without loading the tables
+        database = CatalogueDB(self.db_file, lazy=True)
+        selector = CatalogueSelector(database)
+        for method, args in self.SELECTIONS:
+            _ = getattr(selector, method)(*args)
+            self.assertTrue(database.is_lazy(), method)
+        self.assertEqual(database.number_origins, len(self.origin_data))
+        self.assertEqual(len(database.origins), len(self.origin_data))
+        self.assertFalse(database.is_lazy())
+
+
+class CatalogueQueryTestCase(CatalogueDBTestCase):
+    """
+    Tests the query plans against the selections applied in turn
+    """
+    def _get_expected(self, steps):
+        expected = CatalogueDB(self.db_file)
+        for method, args in steps:
+            expected = getattr(CatalogueSelector(expected), method)(*args)
+        return expected
+
+    def _get_query(self, database, steps):
+        query = CatalogueQuery(database)
+        for method, args in steps:
+            query = getattr(query, method)(*args)
+        return query
+
+    def test_query_equivalence(self):
+        for steps in [[self.SELECTIONS[2], self.SELECTIONS[4],
+                       self.SELECTIONS[6], self.SELECTIONS[0]],
+                      [self.SELECTIONS[7], self.SELECTIONS[5],
+                       self.SELECTIONS[1]],
+                      [self.SELECTIONS[1], self.SELECTIONS[3]],
+                      [self.SELECTIONS[8], self.SELECTIONS[4],
+                       self.SELECTIONS[9]]]:
+            expected = self._get_expected(steps)
+            self.assertTrue(len(expected.origins) > 0)
+            for database in [CatalogueDB(self.db_file)] +\
+                    self._get_databases():
+                selection = self._get_query(database, steps).execute()
+                self.assertTrue(same_selection(selection, expected), steps)
+
+    def test_query_reuse(self):
+        database = CatalogueDB(self.db_file)
+        query = self._get_query(database, self.SELECTIONS[2:3])
+        _ = query.select_within_magnitude_range(5.0, 6.5)
+        # Adding a step returns a new query
+        self.assertEqual(len(query.steps), 1)
+        self.assertTrue(same_selection(query.execute(),
+                                       self._get_expected(
+                                           self.SELECTIONS[2:3])))
+        self.assertRaises(ValueError, query.select_by_agency, "ISC",
+                          "some")
+
+    def test_explain(self):
+        database = CatalogueDB(self.db_file, lazy=True)
+        steps = [self.SELECTIONS[2], self.SELECTIONS[4]]
+        query = self._get_query(database, steps)
+        lines = query.explain().split("\n")
+        self.assertEqual(len(lines), len(steps) + 1)
+        self.assertEqual(lines[0], "Query on %d origins and %d magnitudes"
+                         % (len(self.origin_data), len(self.mag_data)))
+        # All the rows are sampled, so the selectivity is exact
+        loaded = CatalogueDB(self.db_file)
+        for line, number, table, selected in [
+                (lines[1], 1, "origins",
+                 (loaded.origins["depth"] >= 10.) &
+                 (loaded.origins["depth"] <= 150.)),
+                (lines[2], 2, "magnitudes",
+                 (loaded.magnitudes["value"] >= 5.0) &
+                 (loaded.magnitudes["value"] <= 6.5))]:
+            self.assertTrue(line.startswith("%d. any %s: " % (number,
+                                                               table)))
+            self.assertTrue(line.endswith(
+                "(estimated selectivity %.1f %%, ~%d rows)" % (
+                    100.0 * np.mean(selected),
+                    np.mean(selected) * len(selected))), line)
+        # A sample of the rows is read from the file
+        self.assertEqual(query.explain(20, seed=1),
+                         query.explain(20, seed=1))
+        self.assertTrue(database.is_lazy())
+
+
+class SelectTypeTestCase(CatalogueDBTestCase):
+    """
+    Tests the selection of the events with all of their origins or
+    magnitudes selected
+    """
+    def _get_all_selected(self, table, is_selected):
+        """
+        Returns the sorted IDs of the events with all of their rows selected,
+        as found by the original loop over the events
+        """
+        return sorted([event_id for event_id, rows in table.groupby("eventID")
+                       if np.all(is_selected(rows))])
+
+    def test_all_selection(self):
+        database = CatalogueDB(self.db_file)
+        columns = (list(database.origins.columns),
+                   list(database.magnitudes.columns))
+        selector = CatalogueSelector(database)
+        for method, args, table, is_selected in [
+                ("select_within_depth_range", (10., 150.),
+                 database.origins,
+                 lambda rows: (rows["depth"] >= 10.) &
+                 (rows["depth"] <= 150.)),
+                ("select_within_magnitude_range", (4.5, 6.8),
+                 database.magnitudes,
+                 lambda rows: (rows["value"] >= 4.5) &
+                 (rows["value"] <= 6.8))]:
+            expected = self._get_all_selected(table, is_selected)
+            self.assertTrue(0 < len(expected) < self.NUMBER_EVENTS)
+            selection = getattr(selector, method)(*(args + ("all",)))
+            for selected_table, source_table in [
+                    (selection.origins, database.origins),
+                    (selection.magnitudes, database.magnitudes)]:
+                self.assertEqual(sorted(set(selected_table["eventID"])),
+                                 expected)
+                # Every row of the selected events is kept
+                self.assertEqual(
+                    len(selected_table),
+                    np.sum(source_table["eventID"].isin(expected)))
+            # The events with all rows selected have any row selected
+            self.assertTrue(set(expected) <= set(
+                getattr(selector, method)(*args).origins["eventID"]))
+        # The source tables are not modified
+        self.assertEqual((list(database.origins.columns),
+                          list(database.magnitudes.columns)), columns)
+        self.assertRaises(ValueError, selector.select_within_depth_range,
+                          10., 150., "some")
+
+
+class SourceZonesTestCase(CatalogueDBTestCase):
+    """
+    Tests the assignment of the origins to source zones against the
+    assignment by polygon
+    """
+    POLYGONS = [([-100., 100., 100., -100.], [-40., -40., 40., 40.]),
+                ([-180., 0., 0., -180.], [-60., -60., 60., 60.]),
+                ([0., 180., 180., 0.], [-60., -60., 60., 60.])]
+
+    DEPTH_BANDS = [(0., 100.), None, (50., 300.)]
+
+    def _get_expected_zones(self, origins, depth_bands):
+        """
+        Returns the first zone containing each origin with a depth
+        """
+        points = np.column_stack([origins["longitude"].values,
+                                  origins["latitude"].values])
+        depths = origins["depth"].values
+        expected = -np.ones(len(origins), dtype=int)
+        for zone_id, ((poly_lons, poly_lats), depth_band) in enumerate(
+                zip(self.POLYGONS, depth_bands)):
+            inside = Path(np.column_stack([poly_lons, poly_lats])
+                          ).contains_points(points)
+            inside &= np.logical_not(np.isnan(depths))
+            if depth_band is not None:
+                with np.errstate(invalid="ignore"):
+                    inside &= (depths >= depth_band[0]) &\
+                        (depths <= depth_band[1])
+            expected[inside & (expected < 0)] = zone_id
+        return expected
+
+    def test_assign_source_zones(self):
+        database = CatalogueDB(self.db_file)
+        for depth_bands in [None, self.DEPTH_BANDS]:
+            expected = self._get_expected_zones(
+                database.origins, depth_bands or [None] * 3)
+            self.assertTrue(np.all(np.bincount(expected + 1) > 0))
+            for processes in [1, 2]:
+                zones = assign_source_zones(database, self.POLYGONS,
+                                            depth_bands, processes, 1)
+                self.assertTrue(zones.index.equals(database.origins.index))
+                self.assertTrue(np.array_equal(zones.values, expected))
+        self.assertRaises(ValueError, assign_source_zones, database,
+                          self.POLYGONS, self.DEPTH_BANDS[:2])
+
+    def test_get_zone_catalogues(self):
+        for database in [CatalogueDB(self.db_file),
+                         CatalogueDB(self.categorical_file)]:
+            zones = assign_source_zones(database, self.POLYGONS,
+                                        self.DEPTH_BANDS)
+            zone_catalogues = get_zone_catalogues(database, zones)
+            self.assertEqual(len(zone_catalogues), len(self.POLYGONS))
+            origin_ids = np.asarray(database.origins["originID"], dtype=str)
+            mag_origin_ids = np.asarray(database.magnitudes["originID"],
+                                        dtype=str)
+            for zone_id, zone_catalogue in enumerate(zone_catalogues):
+                # The origins of the zone, in the order of the table, and
+                # the magnitudes of these origins
+                selected = origin_ids[zones.values == zone_id]
+                self.assertTrue(np.array_equal(np.asarray(
+                    zone_catalogue.origins["originID"], dtype=str),
+                    selected))
+                self.assertTrue(np.array_equal(np.asarray(
+                    zone_catalogue.magnitudes["originID"], dtype=str),
+                    mag_origin_ids[np.in1d(mag_origin_ids, selected)]))
+                self.assertEqual(zone_catalogue.number_origins,
+                                 len(selected))
+                self.assertEqual(zone_catalogue.categorical,
+                                 database.categorical)
+            self.assertEqual(len(get_zone_catalogues(database, zones, 5)), 5)
+
+
+class IndexFilesTestCase(CatalogueDBTestCase):
+    """
+    Tests the spatial and time index sidecar files of the database
+    """
+    def setUp(self):
+        self.index_dir = os.path.join(self.tmp_dir, self.id())
+        os.mkdir(self.index_dir)
+        self.spatial_selections = [selection for selection in self.SELECTIONS
+                                   if selection[0] in [
+                                       "select_within_polygon",
+                                       "select_within_bounding_box"]]
+        self.time_selections = [selection for selection in self.SELECTIONS
+                                if selection[0] ==
+                                "select_within_time_window"]
+
+    def _check_index_selections(self, selections):
+        """
+        Checks the selections of a new database using the index directory
+        """
+        database = CatalogueDB(self.db_file, lazy=True,
+                               index_dir=self.index_dir)
+        selector = CatalogueSelector(database)
+        expected = CatalogueSelector(CatalogueDB(self.db_file))
+        for method, args in selections:
+            self.assertTrue(same_selection(
+                getattr(selector, method)(*args),
+                getattr(expected, method)(*args)), method)
+        return database
+
+    def test_damaged_spatial_index(self):
+        database = self._check_index_selections(self.spatial_selections)
+        index_file = database.get_index_file(".grid.npz")
+        with open(index_file, "rb") as fle:
+            content = fle.read()
+        for damaged in [content[:len(content) // 2], "not an index"]:
+            with open(index_file, "wb") as fle:
+                fle.write(damaged)
+            _ = self._check_index_selections(self.spatial_selections)
+            # The sidecar file is replaced by the rebuilt index
+            self.assertEqual(SpatialGridIndex.load(index_file).number_rows,
+                             len(self.origin_data))
+
+    def test_stale_spatial_index(self):
+        database = CatalogueDB(self.db_file, lazy=True,
+                               index_dir=self.index_dir)
+        index_file = database.get_index_file(".grid.npz")
+        # Index of other origins, with the identity of the file
+        index = SpatialGridIndex.build(self.origin_data["longitude"][:10],
+                                       self.origin_data["latitude"][:10],
+                                       1.0, get_file_identity(self.db_file))
+        index.save(index_file)
+        _ = self._check_index_selections(self.spatial_selections)
+        self.assertEqual(SpatialGridIndex.load(index_file).number_rows,
+                         len(self.origin_data))
+
+    def test_damaged_time_index(self):
+        database = self._check_index_selections(self.time_selections)
+        index_file = database.get_index_file(".time.npz")
+        with open(index_file, "rb") as fle:
+            content = fle.read()
+        for damaged in [content[:len(content) // 2], "not an index"]:
+            with open(index_file, "wb") as fle:
+                fle.write(damaged)
+            _ = self._check_index_selections(self.time_selections)
+            # The sidecar file is replaced by the rebuilt index
+            data = np.load(index_file)
+            try:
+                self.assertEqual(len(data["rows"]), len(self.origin_data))
+            finally:
+                data.close()
+
+    def test_stale_time_index(self):
+        database = CatalogueDB(self.db_file, lazy=True,
+                               index_dir=self.index_dir)
+        index_file = database.get_index_file(".time.npz")
+        # Index of other origins, with the identity of the file
+        np.savez(index_file, times=np.arange(10.), rows=np.arange(10),
+                 identity=get_file_identity(self.db_file))
+        _ = self._check_index_selections(self.time_selections)
+        # Index of the origins, with the identity of another version
+        times, rows = database.get_time_index()
+        np.savez(index_file, times=times, rows=rows[::-1],
+                 identity="another version")
+        _ = self._check_index_selections(self.time_selections)
+
+    def test_unwritable_index_dir(self):
+        self.index_dir = os.path.join(self.index_dir, "missing", "directory")
+        _ = self._check_index_selections(self.spatial_selections +
+                                         self.time_selections)
+        self.assertFalse(os.path.exists(self.index_dir))
+
+
+class CategoricalTablesTestCase(CatalogueDBTestCase):
+    """
+    Tests the tables with categorical identifier, agency and magnitude type
+    columns
+    """
+    def test_to_categorical(self):
+        database = CatalogueDB(self.db_file)
+        origins, magnitudes = to_categorical(database.origins,
+                                             database.magnitudes)
+        for table, expected in [(origins, database.origins),
+                                (magnitudes, database.magnitudes)]:
+            self.assertEqual(list(table.columns), list(expected.columns))
+            for col in table.columns:
+                self.assertTrue(pd.Series(np.asarray(table[col])).equals(
+                    pd.Series(np.asarray(expected[col]))), col)
+        # The event and origin codes of the two tables are comparable
+        for col in ["eventID", "originID"]:
+            self.assertTrue(origins[col].cat.categories.equals(
+                magnitudes[col].cat.categories))
+        # The source tables are unchanged
+        self.assertFalse(pd.api.types.is_categorical_dtype(
+            database.origins["Agency"].dtype))
+
+    def test_categorical_selection(self):
+        database = CatalogueDB(self.db_file, lazy=True, categorical=True)
+        for method in ["select_by_agency", "limit_to_agency"]:
+            selection = getattr(CatalogueSelector(database), method)("ISC")
+            self.assertTrue(pd.api.types.is_categorical_dtype(
+                selection.origins["Agency"].dtype))
+        self.assertEqual(set(selection.origins["Agency"]), set(["ISC"]))
+
+    def test_categorical_agency_counts(self):
+        expected = CatalogueDB(self.db_file)
+        for database in [CatalogueDB(self.db_file, categorical=True),
+                         CatalogueDB(self.categorical_file)]:
+            self.assertEqual(dict(get_agency_origin_count(database)),
+                             dict(get_agency_origin_count(expected)))
+            self.assertEqual(dict(get_agency_magnitude_count(database)),
+                             dict(get_agency_magnitude_count(expected)))
+
+
+class AgencyMagnitudePairsTestCase(CatalogueDBTestCase):
+    """
+    Tests the magnitudes of pairs of agency and magnitude type against the
+    original loop over the magnitudes of the second pair
+    """
+    def _get_loop_pairs(self, database, pair1, pair2):
+        """
+        Returns the magnitudes and uncertainties of the two pairs, and the
+        IDs of the common events, as found by the original loop
+        """
+        magnitudes = database.magnitudes
+        select_cat1 = magnitudes[(magnitudes["magAgency"] == pair1[0]) &
+                                 (magnitudes["magType"] == pair1[1])]
+        select_cat2 = magnitudes[(magnitudes["magAgency"] == pair2[0]) &
+                                 (magnitudes["magType"] == pair2[1])]
+        common_catalogue = select_cat2[
+            select_cat2.eventID.isin(select_cat1.eventID)]
+        cat1_groups = select_cat1.groupby("eventID")
+        mag1, sigma1, mag2, sigma2 = [], [], [], []
+        for _, row in common_catalogue.iterrows():
+            mag2.append(row.value)
+            sigma2.append(row.sigma)
+            event1 = cat1_groups.get_group(row.eventID)
+            event1 = event1.iloc[np.argmax(
+                np.asarray(event1["originID"], dtype=object))]
+            mag1.append(event1.value)
+            sigma1.append(event1.sigma)
+        return (mag1, sigma1, mag2, sigma2,
+                set(common_catalogue["eventID"]))
+
+    def _get_databases(self):
+        """
+        Returns the database in the order of the file, in reverse order and
+        in random order with several magnitudes of each pair for some events
+        """
+        databases = [CatalogueDB(self.db_file)]
+        database = CatalogueDB(self.db_file)
+        database.origins = database.origins.iloc[::-1]
+        database.magnitudes = database.magnitudes.iloc[::-1]
+        databases.append(database)
+        database = CatalogueDB(self.db_file)
+        magnitudes = database.magnitudes.copy()
+        # The EHB mb of every other event becomes a second ISC mb, and the
+        # MOS MS of every third event a second NEIC MS
+        event_ids = sorted(set(magnitudes["eventID"]))
+        for agency, new_agency, scale, step in [("EHB", "ISC", "mb", 2),
+                                                ("MOS", "NEIC", "MS", 3)]:
+            magnitudes.loc[(magnitudes["magAgency"] == agency) &
+                           (magnitudes["magType"] == scale) &
+                           magnitudes["eventID"].isin(event_ids[::step]),
+                           "magAgency"] = new_agency
+        rng = np.random.RandomState(42)
+        database.magnitudes = magnitudes.iloc[
+            rng.permutation(len(magnitudes))]
+        databases.append(database)
+        return databases
+
+    def test_get_agency_magnitude_pairs(self):
+        pair1, pair2 = ("ISC", "mb"), ("NEIC", "MS")
+        for database in self._get_databases():
+            mag1, sigma1, mag2, sigma2, event_ids = self._get_loop_pairs(
+                database, pair1, pair2)
+            self.assertEqual(len(event_ids), self.NUMBER_EVENTS)
+            for no_case, pairs in [(False, (pair1, pair2)),
+                                   (True, (("isc", "MB"), ("neic", "ms")))]:
+                output, catalogue = get_agency_magnitude_pairs(
+                    database, pairs[0], pairs[1], no_case)
+                values = output.values()
+                for value, expected in zip(values,
+                                           [mag1, sigma1, mag2, sigma2]):
+                    np.testing.assert_array_equal(value, expected)
+                for table, source_table in [
+                        (catalogue.origins, database.origins),
+                        (catalogue.magnitudes, database.magnitudes)]:
+                    self.assertTrue(np.array_equal(
+                        np.asarray(table["eventID"], dtype=str),
+                        np.asarray(source_table["eventID"], dtype=str)[
+                            source_table["eventID"].isin(
+                                event_ids).values]))
+
+    def test_no_magnitudes(self):
+        database = CatalogueDB(self.db_file)
+        for pair1, pair2 in [(("XXX", "mb"), ("ISC", "MS")),
+                             (("ISC", "mb"), ("ISC", "Mw"))]:
+            self.assertEqual(get_agency_magnitude_pairs(database, pair1,
+                                                        pair2), (None, None))
+
+
+class BuildISFTestCase(CatalogueDBTestCase):
+    """
+    Tests the catalogues of events built from the database
+    """
+    def _check_catalogues(self, database, scales):
+        catalogue = database.build_isf("A", "B")
+        table_catalogue = database.build_isf("A", "B", lazy=True)
+        self.assertTrue(table_catalogue.is_table_backed())
+        np.testing.assert_equal(get_table_records(table_catalogue.events),
+                                get_table_records(catalogue.events))
+        # The events are sorted by ID and hold their magnitudes in the
+        # order of the tables
+        event_ids = catalogue.get_event_key_list()
+        self.assertEqual(event_ids, sorted(event_ids))
+        self.assertEqual(len(event_ids), self.NUMBER_EVENTS)
+        for event in catalogue.events:
+            self.assertEqual(len(event.origins), 4)
+            for origin in event.origins:
+                self.assertEqual([mag.origin_id for mag in origin.magnitudes],
+                                 [origin.id, origin.id])
+                self.assertEqual([mag.scale for mag in origin.magnitudes],
+                                 scales)
+        # As in the events built from the tables, missing depths are NaN
+        for events in [catalogue.events, table_catalogue.events]:
+            depths = [origin.location.depth for event in events
+                      for origin in event.origins]
+            self.assertEqual(np.sum(np.isnan(depths)),
+                             len(range(3, self.NUMBER_EVENTS, 7)))
+
+    def test_build_isf(self):
+        self._check_catalogues(CatalogueDB(self.db_file), ["mb", "MS"])
+
+    def test_build_isf_unsorted(self):
+        database = CatalogueDB(self.db_file)
+        database.origins = database.origins.iloc[::-1]
+        database.magnitudes = database.magnitudes.iloc[::-1]
+        self._check_catalogues(database, ["MS", "mb"])
+
+
+if __name__ == "__main__":
+    unittest.main()
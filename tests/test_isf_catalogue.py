@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Tests of the ISF catalogue classes on synthetic bulletins
+
+Run from the root of the repository with: python -m unittest discover
+"""
+import os
+import gc
+import pickle
+import unittest
+import cPickle
+import numpy as np
+import pandas as pd
+from eqcat.isf_catalogue import (ORIGIN_KEY, MAGNITUDE_KEY,
+                                 ORIGIN_DATA_COLUMNS, MAGNITUDE_DATA_COLUMNS,
+                                 SCHEMA_VERSION, ISFCatalogue, Magnitude,
+                                 OriginMetadata, TableEvent, TableOrigin,
+                                 datetime_to_decimal_time,
+                                 get_schema_version)
+from eqcat.parsers.isf_catalogue_reader import ISFReader
+from tests.synthetic_isf import (AGENCIES, SyntheticFilesTestCase,
+                                 get_event_records, same_tables)
+
+
+def has_instance_dict(record):
+    """
+    Returns True if the instance dictionary of a slotted record exists
+    (reading __dict__ would create it)
+    """
+    return any([isinstance(referent, dict)
+                for referent in gc.get_referents(record)])
+
+
+def get_prime_origins(catalogue):
+    """
+    Returns, for each event, the prime origin (or only origin) selected as
+    by the original loops of get_decimal_dates, or None
+    """
+    prime_origins = []
+    for event in catalogue.events:
+        prime_origin = None
+        for origin in event.origins:
+            if len(event.origins) == 1 or origin.is_prime:
+                prime_origin = origin
+        prime_origins.append(prime_origin)
+    return prime_origins
+
+
+class CompactRecordTestCase(SyntheticFilesTestCase):
+    """
+    Tests the pickling of the slotted records and the origin metadata
+    """
+    def setUp(self):
+        self.catalogue = ISFReader(self.isf_file).read_file("A", "B")
+
+    def test_pickle(self):
+        events = self.catalogue.events
+        origin = events[0].origins[0]
+        origin.record_key = "key"
+        origin.extra_value = 1.5
+        events[1].extra_value = [1, 2]
+        _ = origin.get_magnitude_index()
+        expected = get_event_records(events)
+        for module in [pickle, cPickle]:
+            for protocol in range(3):
+                output = module.loads(module.dumps(events, protocol))
+                self.assertEqual(get_event_records(output), expected)
+                self.assertEqual(output[0].origins[0].record_key, "key")
+                self.assertEqual(output[0].origins[0].extra_value, 1.5)
+                self.assertEqual(output[1].extra_value, [1, 2])
+                # Transient indices are not pickled, but are rebuilt
+                self.assertEqual(getattr(output[0].origins[0],
+                                         "_magnitude_index", None), None)
+                self.assertEqual(len(output[0].origins[0].
+                                     get_magnitude_index()), 2)
+                self.assertEqual(output[0].get_origin_index(),
+                                 events[0].get_origin_index())
+                # Magnitudes shared by events and origins remain shared
+                self.assertTrue(output[0].origins[0].magnitudes[0] is
+                                output[0].magnitudes[0])
+        # Pickling does not create instance dictionaries
+        self.assertFalse(has_instance_dict(events[2]))
+        self.assertFalse(has_instance_dict(events[2].origins[0]))
+        self.assertTrue(has_instance_dict(origin))
+
+    def test_origin_metadata(self):
+        metadata = self.catalogue.events[0].origins[0].metadata
+        self.assertTrue(isinstance(metadata, OriginMetadata))
+        self.assertEqual(metadata["Nphases"], 20)
+        self.assertEqual(metadata["EventType"], "ke")
+        self.assertEqual(len(metadata), len(OriginMetadata.KEYS))
+        self.assertEqual(list(metadata), list(OriginMetadata.KEYS))
+        self.assertRaises(KeyError, metadata.__getitem__, "Comment")
+        self.assertEqual(metadata.get("Comment", "none"), "none")
+        metadata["Comment"] = "reviewed"
+        metadata["Nstations"] = 16
+        self.assertTrue("Comment" in metadata)
+        self.assertEqual(metadata["Comment"], "reviewed")
+        self.assertEqual(dict(metadata.items())["Nstations"], 16)
+        self.assertEqual(len(metadata.values()), len(OriginMetadata.KEYS) + 1)
+        self.assertEqual(metadata, OriginMetadata(**dict(metadata.items())))
+        self.assertNotEqual(metadata, OriginMetadata())
+        for protocol in range(3):
+            self.assertEqual(cPickle.loads(cPickle.dumps(metadata, protocol)),
+                             metadata)
+
+
+class MergeCatalogueTestCase(SyntheticFilesTestCase):
+    """
+    Tests the merging of catalogues through the ID indices
+    """
+    def setUp(self):
+        self.catalogue = ISFReader(self.isf_file).read_file("A", "B")
+
+    def _get_secondary(self):
+        """
+        Returns the catalogue of the ISC and EHB origins, with the ISC
+        origins renamed (i.e. new origins) and the EHB origins unchanged
+        (i.e. origins merged into the existing ones)
+        """
+        secondary = ISFReader(self.isf_file, ["ISC", "EHB"]).read_file("A",
+                                                                       "B")
+        for event in secondary.events:
+            for origin in event.origins:
+                if origin.author == "ISC":
+                    origin.id = "S" + origin.id
+        return secondary
+
+    def test_merge(self):
+        self.catalogue.merge_second_catalogue(self._get_secondary())
+        for event in self.catalogue.events:
+            self.assertEqual(
+                [origin.author for origin in event.origins],
+                AGENCIES + ["ISC"])
+            self.assertEqual(event.origins[-1].id,
+                             "S" + event.origins[1].id)
+            self.assertEqual(event.get_origin_index(),
+                             dict([(origin.id, iloc) for iloc, origin
+                                   in enumerate(event.origins)]))
+
+    def test_merge_after_reorder(self):
+        _ = self.catalogue.get_event_index()
+        self.catalogue.events.sort(key=lambda event: event.id, reverse=True)
+        # Replace, remove and append events after the index is built
+        _ = self.catalogue.get_event_index()
+        self.catalogue.events[0] = self.catalogue.events.pop()
+        self.catalogue.events.append(
+            ISFReader(self.isf_file).read_file("A", "B").events[0])
+        event_ids = self.catalogue.get_event_key_list()
+        # As in list.index, the first event with an ID is indexed
+        self.assertEqual(self.catalogue.get_event_index(),
+                         dict([(event_id, event_ids.index(event_id))
+                               for event_id in event_ids]))
+        self.catalogue.merge_second_catalogue(self._get_secondary())
+        self.assertEqual(self.catalogue.get_event_key_list(), event_ids)
+        for event in self.catalogue.events[:-1]:
+            self.assertEqual(len(event.origins), len(AGENCIES) + 1)
+        # The appended event shares its ID with the first event
+        self.assertEqual(len(self.catalogue.events[-1].origins),
+                         len(AGENCIES))
+
+    def test_magnitude_conflicts(self):
+        secondary = self._get_secondary()
+        event = secondary.events[3]
+        magnitude = event.origins[1].magnitudes[0]
+        magnitude.value += 0.5
+        conflicts = self.catalogue.merge_second_catalogue(secondary)
+        self.assertEqual(len(conflicts), 1)
+        self.assertEqual(conflicts[0].key, magnitude.get_key())
+        self.assertTrue(conflicts[0].secondary is magnitude)
+        self.assertAlmostEqual(conflicts[0].current.value,
+                               magnitude.value - 0.5)
+
+
+class MagnitudeMergeTestCase(SyntheticFilesTestCase):
+    """
+    Tests the comparison and deduplication of magnitudes
+    """
+    def test_compare_magnitude(self):
+        magnitude = Magnitude("1", "2", 5.0, "ISC", "mb")
+        self.assertTrue(magnitude.compare_magnitude(
+            Magnitude("1", "2", 5.004, "ISC", "mb")))
+        self.assertFalse(magnitude.compare_magnitude(
+            Magnitude("1", "2", 5.01, "ISC", "mb")))
+        self.assertTrue(magnitude.compare_magnitude(
+            Magnitude("1", "2", 5.01, "ISC", "mb"), tol=0.02))
+        for other in [Magnitude("1", "2", 5.0, "ISC", "Mw"),
+                      Magnitude("1", "2", 5.0, "NEIC", "mb"),
+                      Magnitude("1", "3", 5.0, "ISC", "mb")]:
+            self.assertFalse(magnitude.compare_magnitude(other))
+
+    def test_merge_secondary_magnitudes(self):
+        origin = ISFReader(self.isf_file).read_file("A",
+                                                    "B").events[0].origins[0]
+        first = origin.magnitudes[0]
+        magnitudes = list(origin.magnitudes)
+
+        def new_magnitude(value, scale):
+            return Magnitude(first.event_id, first.origin_id, value,
+                             first.author, scale)
+        conflicts = origin.merge_secondary_magnitudes([
+            # Same value within the tolerance
+            new_magnitude(first.value + 0.001, first.scale),
+            # Conflicting value
+            new_magnitude(first.value + 0.5, first.scale),
+            # New scale, given twice
+            new_magnitude(5.0, "ML"),
+            new_magnitude(5.2, "ML")])
+        self.assertEqual([conflict.secondary.value for conflict in conflicts],
+                         [first.value + 0.5, 5.2])
+        self.assertTrue(conflicts[0].current is first)
+        self.assertEqual(origin.magnitudes[:len(magnitudes)], magnitudes)
+        self.assertEqual([(magnitude.scale, magnitude.value)
+                          for magnitude in origin.magnitudes[2:]],
+                         [("ML", 5.0)])
+        self.assertRaises(ValueError, origin.merge_secondary_magnitudes,
+                          [first.value])
+
+
+class PrimeOriginTableTestCase(SyntheticFilesTestCase):
+    """
+    Tests the cached table of prime origins and the outputs built from it
+    """
+    def setUp(self):
+        # Every fifth event has no prime origin once MOS is excluded
+        self.catalogue = ISFReader(self.isf_file,
+                                   AGENCIES[:-1]).read_file("A", "B")
+
+    def _check_decimal_dates(self, catalogue):
+        expected = [datetime_to_decimal_time(origin.date, origin.time)[0]
+                    if origin is not None else None
+                    for origin in get_prime_origins(catalogue)]
+        decimal_dates = catalogue.get_decimal_dates()
+        self.assertEqual(len(decimal_dates), catalogue.get_number_events())
+        for value, expected_value in zip(decimal_dates, expected):
+            if expected_value is not None:
+                self.assertAlmostEqual(value, expected_value, 10)
+
+    def test_decimal_dates(self):
+        self._check_decimal_dates(self.catalogue)
+
+    def test_render_to_simple_numpy_array(self):
+        output = self.catalogue.render_to_simple_numpy_array()
+        expected = [(event.id, origin.id, origin.location.latitude,
+                     origin.location.longitude, origin.location.depth,
+                     origin.magnitudes[0].value)
+                    for event, origin in zip(self.catalogue.events,
+                                             get_prime_origins(
+                                                 self.catalogue))
+                    if origin is not None and origin.is_prime and
+                    origin.magnitudes]
+        # One row for each event with a prime origin with a magnitude
+        self.assertEqual(output.shape, (len(expected), 7))
+        self.assertEqual(len(expected), 32)
+        self.assertEqual(output.dtype, object)
+        for row, expected_row in zip(output, expected):
+            self.assertEqual(tuple(row[:2]), expected_row[:2])
+            self.assertTrue(isinstance(row[2], float))
+            # A missing depth is NaN
+            self.assertTrue(np.allclose(
+                np.array(row[3:], dtype=float),
+                np.array(expected_row[2:], dtype=float), equal_nan=True))
+
+    def test_cache_follows_events(self):
+        _ = self.catalogue.get_prime_origin_table()
+        self.catalogue.events.reverse()
+        self.assertEqual(
+            list(self.catalogue.get_prime_origin_table()["eventID"]),
+            self.catalogue.get_event_key_list())
+        self._check_decimal_dates(self.catalogue)
+        # Appended events are added to the table
+        table = self.catalogue.get_prime_origin_table()
+        self.catalogue.events.extend(
+            ISFReader(self.isf_file).read_file("A", "B").events[:3])
+        self.assertEqual(
+            list(self.catalogue.get_prime_origin_table()["eventID"]),
+            self.catalogue.get_event_key_list())
+        self.assertEqual(len(table), self.NUMBER_EVENTS)
+        # Changes in place are applied after invalidate_cache
+        origin = self.catalogue.events[0].origins[1]
+        origin.location.depth = 999.0
+        self.assertNotEqual(self.catalogue.get_prime_origin_table()[0][
+            "depth"], 999.0)
+        self.catalogue.invalidate_cache()
+        self.assertEqual(self.catalogue.get_prime_origin_table()[0][
+            "depth"], 999.0)
+
+
+class OriginMagTablesTestCase(SyntheticFilesTestCase):
+    """
+    Tests the origin and magnitude tables built from the events
+    """
+    def setUp(self):
+        reader = ISFReader(self.isf_file)
+        self.catalogue = reader.read_file("A", "B")
+        self.expected = reader.read_to_arrays()
+
+    def test_get_origin_mag_tables(self):
+        tables = self.catalogue.get_origin_mag_tables()
+        self.assertTrue(same_tables(tables, self.expected))
+        # Missing depths are NaN
+        self.assertEqual(np.sum(np.isnan(tables[0]["depth"])),
+                         len(range(3, self.NUMBER_EVENTS, 7)))
+        # The tables of a table backed catalogue are not copied
+        table_catalogue = ISFReader(self.isf_file).read_table_catalogue(
+            "A", "B")
+        tables = table_catalogue.get_origin_mag_tables()
+        self.assertTrue(tables[0] is table_catalogue.events.origin_data)
+        self.assertTrue(tables[1] is table_catalogue.events.mag_data)
+
+    def test_write_origin_mag_tables(self):
+        table_catalogue = ISFReader(self.isf_file).read_table_catalogue(
+            "A", "B")
+        for catalogue, chunk_size in [(self.catalogue, 1),
+                                      (self.catalogue, 7),
+                                      (self.catalogue, 100),
+                                      (table_catalogue, 7)]:
+            origin_file = os.path.join(self.tmp_dir, "origins.npy")
+            magnitude_file = os.path.join(self.tmp_dir, "magnitudes.npy")
+            tables = catalogue.write_origin_mag_tables(
+                origin_file, magnitude_file, chunk_size)
+            self.assertTrue(same_tables(tables, self.expected))
+            del tables
+            tables = (np.load(origin_file, mmap_mode="r"),
+                      np.load(magnitude_file, mmap_mode="r"))
+            self.assertTrue(same_tables(tables, self.expected))
+            del tables
+
+
+class CatalogueTablesTestCase(SyntheticFilesTestCase):
+    """
+    Tests the writing of the catalogue tables to hdf5 in chunks
+    """
+    def test_write_to_hdf5(self):
+        catalogue = ISFReader(self.isf_file).read_file("A", "B")
+        origin_data, mag_data = catalogue.get_origin_mag_tables()
+        for chunk_size in [7, 1000]:
+            hdf5_file = os.path.join(self.tmp_dir, "tables_%d.h5" %
+                                     chunk_size)
+            orig_df, mag_df = catalogue.build_dataframe(hdf5_file,
+                                                        chunk_size)
+            store = pd.HDFStore(hdf5_file, "r")
+            try:
+                for key, data, dataframe, data_columns in [
+                        (ORIGIN_KEY, origin_data, orig_df,
+                         ORIGIN_DATA_COLUMNS),
+                        (MAGNITUDE_KEY, mag_data, mag_df,
+                         MAGNITUDE_DATA_COLUMNS)]:
+                    expected = pd.DataFrame(data)
+                    pd.testing.assert_frame_equal(dataframe, expected)
+                    pd.testing.assert_frame_equal(
+                        store[key].reset_index(drop=True), expected)
+                    self.assertEqual(get_schema_version(store, key),
+                                     SCHEMA_VERSION)
+                    # No reference to the table node is kept once closed
+                    self.assertTrue(
+                        store.get_storer(key).table.filters.complevel > 0)
+                    colindexed = dict(
+                        store.get_storer(key).table.colindexed)
+                    for column in data_columns:
+                        self.assertTrue(colindexed[column])
+            finally:
+                store.close()
+
+
+class TableBackedCatalogueTestCase(SyntheticFilesTestCase):
+    """
+    Tests the catalogue backed by the origin and magnitude tables against the
+    catalogue of event objects read from the same file
+    """
+    def setUp(self):
+        reader = ISFReader(self.isf_file)
+        self.catalogue = reader.read_file("A", "B")
+        self.table_catalogue = reader.read_table_catalogue("A", "B")
+
+    def test_table_fields(self):
+        events = self.table_catalogue.events
+        self.assertEqual(len(events), self.NUMBER_EVENTS)
+        for event, table_event in zip(self.catalogue.events, events):
+            self.assertTrue(isinstance(table_event, TableEvent))
+            self.assertEqual(table_event.id, event.id)
+            self.assertEqual(len(table_event.origins), len(event.origins))
+            for origin, table_origin in zip(event.origins,
+                                            table_event.origins):
+                self.assertTrue(isinstance(table_origin, TableOrigin))
+                self.assertEqual(
+                    (table_origin.id, table_origin.author,
+                     table_origin.is_prime, table_origin.date,
+                     table_origin.time.replace(second=0, microsecond=0)),
+                    (origin.id, origin.author, origin.is_prime, origin.date,
+                     origin.time.replace(second=0, microsecond=0)))
+                # Seconds are stored as float16 and coordinates as float32
+                seconds = origin.time.second +\
+                    origin.time.microsecond / 1.0E6
+                table_seconds = table_origin.time.second +\
+                    table_origin.time.microsecond / 1.0E6
+                self.assertAlmostEqual(table_seconds,
+                                       float(np.float16(seconds)), 5)
+                location = origin.location
+                table_location = table_origin.location
+                for key in ["longitude", "latitude", "depth"]:
+                    value = getattr(location, key)
+                    if value is not None:
+                        value = float(np.float32(value))
+                    self.assertEqual(getattr(table_location, key), value)
+                self.assertEqual(
+                    [(mag.origin_id, mag.author, mag.scale,
+                      float(np.float32(mag.value)))
+                     for mag in origin.magnitudes],
+                    [(mag.origin_id, mag.author, mag.scale, mag.value)
+                     for mag in table_origin.magnitudes])
+
+    def test_missing_fields(self):
+        event = self.table_catalogue.events[0]
+        origin = event.origins[0]
+        magnitude = event.magnitudes[0]
+        for record, name in [(event, "description"), (origin, "metadata"),
+                             (origin, "time_rms"), (origin, "is_centroid"),
+                             (magnitude, "stations")]:
+            self.assertFalse(hasattr(record, name))
+            self.assertRaises(AttributeError, getattr, record, name)
+        self.assertEqual(str(event), str(event.id))
+        # Assigned fields are set as usual, also after pickling
+        event.description = "Description"
+        origin.time_rms = 0.5
+        output = cPickle.loads(cPickle.dumps(event, 2))
+        self.assertEqual(str(output), "%s:Description" % event.id)
+        self.assertEqual(output.origins[0].time_rms, 0.5)
+        self.assertFalse(hasattr(output.origins[0], "metadata"))
+
+    def test_read_access(self):
+        # Reading the events leaves the tables in use
+        events = self.table_catalogue.events
+        _ = [str(event) for event in events]
+        self.assertTrue(self.table_catalogue.is_table_backed())
+        table = self.table_catalogue.get_prime_origin_table()
+        expected = ISFCatalogue("A", "B",
+                                list(events)).get_prime_origin_table()
+        # The times of the events are rounded to the microsecond
+        self.assertTrue(np.allclose(table["second"], expected["second"],
+                                    atol=1.0E-6))
+        expected["second"] = table["second"]
+        np.testing.assert_equal(table.tolist(), expected.tolist())
+        events[1] = events[1]
+        self.assertFalse(self.table_catalogue.is_table_backed())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Tests of the ISF reader on synthetic bulletins
+
+Run from the root of the repository with: python -m unittest discover
+"""
+import os
+import datetime
+import unittest
+from eqcat.parsers.isf_catalogue_reader import (ISFReader, ISFEventIndex,
+                                                get_event_chunk_offsets)
+from tests.synthetic_isf import (AGENCIES, SyntheticFilesTestCase,
+                                 same_tables, write_isf)
+
+
+class ISFReaderTestCase(SyntheticFilesTestCase):
+    """
+    Tests the ISF reader and the equivalence of its reading modes
+    """
+    def setUp(self):
+        self.catalogue = ISFReader(self.isf_file).read_file("A", "B")
+
+    def test_final_event_included(self):
+        self.assertEqual(self.catalogue.get_number_events(),
+                         self.NUMBER_EVENTS)
+        self.assertEqual(self.catalogue.events[-1].id,
+                         str(600000 + self.NUMBER_EVENTS - 1))
+
+    def test_iter_events(self):
+        events = ISFReader(self.isf_file).iter_events()
+        self.assertEqual(next(events).id, "600000")
+        self.assertEqual(
+            ["600000"] + [event.id for event in events],
+            self.catalogue.get_event_key_list())
+
+    def test_parallel_reader(self):
+        for processes, chunks_per_process in [(2, 4), (3, 1), (1, 50)]:
+            catalogue = ISFReader(self.isf_file).read_file_parallel(
+                "A", "B", processes, chunks_per_process)
+            self.assertEqual(catalogue.get_event_key_list(),
+                             self.catalogue.get_event_key_list())
+            self.assertTrue(same_tables(
+                catalogue.get_origin_mag_tables(),
+                self.catalogue.get_origin_mag_tables()))
+
+    def test_chunk_offsets(self):
+        chunks = get_event_chunk_offsets(self.isf_file, 7)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], os.path.getsize(self.isf_file))
+        with open(self.isf_file, "rb") as fle:
+            for start, end in chunks[1:]:
+                fle.seek(start)
+                self.assertTrue(fle.readline().startswith("Event"))
+
+    def test_read_to_arrays(self):
+        for agencies in [[], ["ISC", "EHB"]]:
+            # A small initial size to exercise the growth of the tables
+            tables = ISFReader(self.isf_file, agencies,
+                               agencies).read_to_arrays(initial_size=7)
+            catalogue = ISFReader(self.isf_file, agencies,
+                                  agencies).read_file("A", "B")
+            self.assertTrue(same_tables(tables,
+                                        catalogue.get_origin_mag_tables()))
+
+    def test_agency_selection(self):
+        catalogue = ISFReader(self.isf_file, ["ISC", "EHB"],
+                              ["EHB"]).read_file("A", "B")
+        self.assertEqual(catalogue.get_number_events(), self.NUMBER_EVENTS)
+        for event in catalogue.events:
+            self.assertEqual(event.get_author_list(), ["ISC", "EHB"])
+            self.assertEqual(set([magnitude.author
+                                  for magnitude in event.magnitudes]),
+                             set(["EHB"]))
+        # Events without an origin of the selected agencies are skipped
+        catalogue = ISFReader(self.isf_file, ["BJI"]).read_file("A", "B")
+        self.assertEqual(catalogue.get_number_events(), 0)
+
+    def test_prime_flag_scoping(self):
+        # The prime marker of every fifth event follows an unselected origin
+        reader = ISFReader(self.isf_file, AGENCIES[:-1])
+        catalogue = reader.read_file("A", "B")
+        for event in catalogue.events:
+            prime = [origin.author for origin in event.origins
+                     if origin.is_prime]
+            if int(event.id) % 5 == 0:
+                self.assertEqual(prime, [])
+            else:
+                self.assertEqual(prime, ["ISC"])
+        origin_data = reader.read_to_arrays()[0]
+        self.assertEqual(
+            list(origin_data["Agency"][origin_data["prime"] == 1]),
+            [origin.author for event in catalogue.events
+             for origin in event.origins if origin.is_prime])
+
+class ISFEventIndexTestCase(SyntheticFilesTestCase):
+    """
+    Tests the byte-offset event index and the reads through it
+    """
+    def setUp(self):
+        self.catalogue = ISFReader(self.isf_file).read_file("A", "B")
+
+    def _get_scans(self, index):
+        """
+        Records the byte ranges scanned by the index
+        """
+        scans = []
+        scan = index._scan
+
+        def _scan(start, end):
+            scans.append((start, end))
+            return scan(start, end)
+        index._scan = _scan
+        return scans
+
+    def test_read_from_index(self):
+        index = ISFEventIndex(self.isf_file).update()
+        self.assertEqual(index.event_ids,
+                         self.catalogue.get_event_key_list())
+        event_ids = ["600003", "600017", "600018", "999999"]
+        catalogue = ISFReader(self.isf_file).read_events("A", "B",
+                                                         event_ids, index)
+        self.assertEqual(catalogue.get_event_key_list(), event_ids[:-1])
+        catalogue = ISFReader(self.isf_file).read_date_range(
+            "A", "B", datetime.date(1990, 1, 1), "1991/12/31", index)
+        self.assertEqual(catalogue.get_event_key_list(),
+                         [event.id for event in self.catalogue.events
+                          if event.origins[0].date.year <= 1991])
+
+    def test_incremental_update(self):
+        isf_file = os.path.join(self.tmp_dir, "growing.isf")
+        write_isf(isf_file, range(20))
+        index = ISFEventIndex(isf_file).update()
+        self.assertTrue(os.path.exists(isf_file + ".idx"))
+        # An unchanged file is not scanned again
+        index = ISFEventIndex(isf_file)
+        scans = self._get_scans(index)
+        index.update()
+        self.assertEqual(scans, [])
+        self.assertEqual(len(index.event_ids), 20)
+        # Appending a month of events scans from the last indexed event
+        offset = index.offsets[-1]
+        with open(self.isf_file, "rb") as fle:
+            rows = fle.read().split("\n")
+        with open(isf_file, "ab") as fle:
+            fle.write("\n".join(rows[rows.index(
+                [row for row in rows if "Event 600020" in row][0]):]))
+        index = ISFEventIndex(isf_file)
+        scans = self._get_scans(index)
+        index.update()
+        self.assertEqual(scans, [(offset, os.path.getsize(isf_file))])
+        expected = ISFEventIndex(isf_file, isf_file + ".new").update()
+        self.assertEqual(index.event_ids, expected.event_ids)
+        self.assertEqual(index.event_ids,
+                         self.catalogue.get_event_key_list())
+        self.assertEqual(index.offsets, expected.offsets)
+        self.assertEqual(index.dates, expected.dates)
+        # A rewritten file is indexed from the start
+        write_isf(isf_file, range(10, 15))
+        index = ISFEventIndex(isf_file)
+        scans = self._get_scans(index)
+        index.update()
+        self.assertEqual(scans, [(0, os.path.getsize(isf_file))])
+        self.assertEqual(index.event_ids,
+                         [str(600000 + event) for event in range(10, 15)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Tests of the persistent parse cache
+
+Run from the root of the repository with: python -m unittest discover
+"""
+import os
+import time
+import shutil
+import unittest
+from eqcat.parsers.cache import ParseCache
+from eqcat.parsers.isf_catalogue_reader import ISFReader
+from tests.synthetic_isf import (SyntheticFilesTestCase, get_event_records,
+                                 write_isf)
+
+
+class _CountingReader(ISFReader):
+    """
+    ISF reader counting the number of times the file is parsed
+    """
+    calls = 0
+
+    def read_file(self, identifier, name):
+        _CountingReader.calls += 1
+        return super(_CountingReader, self).read_file(identifier, name)
+
+
+class ParseCacheTestCase(SyntheticFilesTestCase):
+    """
+    Tests that the cache returns the output of the parser and that damaged
+    entries are parsed again
+    """
+    def setUp(self):
+        self.cache_dir = os.path.join(self.tmp_dir, "cache")
+        self.cache = ParseCache(self.cache_dir)
+        _CountingReader.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _get_entries(self):
+        return sorted(os.listdir(self.cache_dir))
+
+    def test_hit_equals_miss(self):
+        miss = self.cache.read_file(_CountingReader(self.isf_file), "A", "B")
+        hit = self.cache.read_file(_CountingReader(self.isf_file), "A", "B")
+        self.assertEqual(_CountingReader.calls, 1)
+        self.assertEqual((hit.id, hit.name), ("A", "B"))
+        self.assertTrue(isinstance(hit.events, list))
+        self.assertEqual(get_event_records(hit.events),
+                         get_event_records(miss.events))
+        self.assertEqual(hit.events[0].description, "Synthetic Region")
+
+    def test_key(self):
+        self.cache.read_file(_CountingReader(self.isf_file), "A", "B")
+        # A different agency selection or different arguments are parsed
+        self.cache.read_file(_CountingReader(self.isf_file, ["ISC"]),
+                             "A", "B")
+        self.cache.read_file(_CountingReader(self.isf_file), "A", "C")
+        self.assertEqual(_CountingReader.calls, 3)
+        self.assertEqual(len(self._get_entries()), 3)
+        # A modified file is parsed again
+        isf_file = os.path.join(self.tmp_dir, "modified.isf")
+        write_isf(isf_file, range(5))
+        self.cache.read_file(_CountingReader(isf_file), "A", "B")
+        write_isf(isf_file, range(6))
+        os.utime(isf_file, (time.time() + 10, time.time() + 10))
+        catalogue = self.cache.read_file(_CountingReader(isf_file), "A", "B")
+        self.assertEqual(_CountingReader.calls, 5)
+        self.assertEqual(catalogue.get_number_events(), 6)
+
+    def test_damaged_entry(self):
+        expected = get_event_records(ISFReader(self.isf_file).read_file(
+            "A", "B").events)
+        self.cache.read_file(_CountingReader(self.isf_file), "A", "B")
+        filename = os.path.join(self.cache_dir, self._get_entries()[0])
+        with open(filename, "rb") as fle:
+            data = fle.read()
+        for damaged in [data[:(len(data) // 2)], "", "PK\x03\x04",
+                        "garbage data"]:
+            with open(filename, "wb") as fle:
+                fle.write(damaged)
+            catalogue = self.cache.read_file(_CountingReader(self.isf_file),
+                                             "A", "B")
+            self.assertEqual(get_event_records(catalogue.events), expected)
+        self.assertEqual(_CountingReader.calls, 5)
+        # The damaged entry is replaced
+        self.assertTrue(os.path.getsize(filename) == len(data))
+
+    def test_failed_store(self):
+        self.assertRaises(Exception, self.cache.store, "key",
+                          lambda value: value)
+        self.assertEqual(self._get_entries(), [])
+
+    def test_eviction(self):
+        self.cache.read_file(_CountingReader(self.isf_file), "A", "B")
+        size = os.path.getsize(os.path.join(self.cache_dir,
+                                            self._get_entries()[0]))
+        self.cache.max_size = int(1.5 * size)
+        old_entry = self._get_entries()[0]
+        os.utime(os.path.join(self.cache_dir, old_entry),
+                 (time.time() - 100, time.time() - 100))
+        self.cache.read_file(_CountingReader(self.isf_file), "A", "C")
+        self.assertEqual(len(self._get_entries()), 1)
+        self.assertNotEqual(self._get_entries()[0], old_entry)
+        self.cache.clear()
+        self.assertEqual(self._get_entries(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
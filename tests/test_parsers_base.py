@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Tests of the transparent reading of compressed catalogue files
+
+Run from the root of the repository with: python -m unittest discover
+"""
+import os
+import bz2
+import gzip
+import unittest
+from distutils.spawn import find_executable
+from eqcat.parsers.base import (get_compression, open_catalogue_file,
+                                _ProcessOutput, lzma, zstandard)
+from eqcat.parsers.isf_catalogue_reader import ISFReader
+from eqcat.parsers.gcmt_ndk_parser import ParseNDKtoGCMT
+from eqcat.parsers.generic_catalogue import GeneralCsvCatalogue
+from eqcat.parsers.converters import GenericCataloguetoISFParser
+from tests.synthetic_isf import SyntheticFilesTestCase, same_tables
+
+
+NDK_FILE = os.path.join(os.path.dirname(__file__), "..", "notebooks",
+                        "inputs", "gcmt_test_catalogue.txt")
+
+
+def compress(filename, compression):
+    """
+    Writes a compressed copy of the file, returning its path
+    """
+    with open(filename, "rb") as fle:
+        data = fle.read()
+    if compression == "gzip":
+        output_file = filename + ".gz"
+        # Two members, as written by parallel compressors
+        with gzip.open(output_file, "wb") as fle:
+            fle.write(data[:(len(data) // 2)])
+        with gzip.open(output_file, "ab") as fle:
+            fle.write(data[(len(data) // 2):])
+    elif compression == "bz2":
+        output_file = filename + ".bz2"
+        with open(output_file, "wb") as fle:
+            fle.write(bz2.compress(data))
+    elif compression == "xz":
+        output_file = filename + ".xz"
+        with open(output_file, "wb") as fle:
+            fle.write(lzma.compress(data))
+    else:
+        output_file = filename + ".zst"
+        with open(output_file, "wb") as fle:
+            fle.write(zstandard.ZstdCompressor().compress(data))
+    return output_file
+
+
+def get_compressions():
+    """
+    Returns the compression formats supported by the installed modules
+    """
+    compressions = ["gzip", "bz2"]
+    if lzma is not None:
+        compressions.append("xz")
+    if zstandard is not None:
+        compressions.append("zstd")
+    return compressions
+
+
+class CompressedInputTestCase(SyntheticFilesTestCase):
+    """
+    Tests that each parser reads compressed files as the uncompressed file
+    """
+    def test_get_compression(self):
+        self.assertEqual(get_compression(self.isf_file), None)
+        for compression in get_compressions():
+            self.assertEqual(
+                get_compression(compress(self.isf_file, compression)),
+                compression)
+
+    def test_isf(self):
+        expected = ISFReader(self.isf_file).read_file("A", "B")
+        for compression in get_compressions():
+            reader = ISFReader(compress(self.isf_file, compression))
+            catalogue = reader.read_file("A", "B")
+            self.assertEqual(catalogue.get_event_key_list(),
+                             expected.get_event_key_list())
+            self.assertTrue(same_tables(catalogue.get_origin_mag_tables(),
+                                        expected.get_origin_mag_tables()))
+            self.assertTrue(same_tables(reader.read_to_arrays(),
+                                        expected.get_origin_mag_tables()))
+            # A compressed file cannot be split and is read serially
+            catalogue = reader.read_file_parallel("A", "B", processes=2)
+            self.assertEqual(catalogue.get_event_key_list(),
+                             expected.get_event_key_list())
+
+    def test_parallel_decompression(self):
+        expected = ISFReader(self.isf_file).read_file("A", "B")
+        for compression in get_compressions():
+            reader = ISFReader(compress(self.isf_file, compression))
+            reader.parallel_decompression = True
+            self.assertTrue(same_tables(
+                reader.read_file("A", "B").get_origin_mag_tables(),
+                expected.get_origin_mag_tables()))
+
+    def test_truncated_file(self):
+        gz_file = compress(self.isf_file, "gzip")
+        with open(gz_file, "rb") as fle:
+            data = fle.read()
+        truncated_file = os.path.join(self.tmp_dir, "truncated.isf.gz")
+        with open(truncated_file, "wb") as fle:
+            fle.write(data[:(len(data) // 4)])
+        # Raises rather than giving a shorter catalogue
+        self.assertRaises(IOError, ISFReader(truncated_file).read_file,
+                          "A", "B")
+        if not find_executable("gzip"):
+            return
+        stream = _ProcessOutput(["gzip", "-dc", truncated_file])
+        stream.read()
+        self.assertRaises(IOError, stream.close)
+        # Closing before the end of the output terminates the process
+        # without an error
+        with _ProcessOutput(["gzip", "-dc", gz_file]) as stream:
+            stream.readline()
+
+    def test_ndk(self):
+        ndk_file = os.path.join(self.tmp_dir, "gcmt.ndk")
+        with open(NDK_FILE, "rb") as fle:
+            rows = fle.readlines()[:100]
+        with open(ndk_file, "wb") as fle:
+            fle.writelines(rows)
+        expected = ParseNDKtoGCMT(ndk_file).read_file()
+        self.assertEqual(expected.number_events(), 20)
+        for compression in get_compressions():
+            catalogue = ParseNDKtoGCMT(compress(ndk_file,
+                                                compression)).read_file()
+            self.assertEqual(
+                [(gcmt.identifier, gcmt.moment, gcmt.magnitude,
+                  gcmt.centroid.longitude, gcmt.centroid.latitude)
+                 for gcmt in catalogue.gcmts],
+                [(gcmt.identifier, gcmt.moment, gcmt.magnitude,
+                  gcmt.centroid.longitude, gcmt.centroid.latitude)
+                 for gcmt in expected.gcmts])
+
+    def test_csv(self):
+        csv_file = os.path.join(self.tmp_dir, "catalogue.csv")
+        columns = sorted(GeneralCsvCatalogue.TOTAL_ATTRIBUTE_LIST)
+        rows = [",".join(columns)]
+        for iloc in range(10):
+            values = {"eventID": str(iloc + 1), "year": "2001",
+                      "month": "2", "day": "3", "hour": "4", "minute": "5",
+                      "second": "6.5", "longitude": "10.%d" % iloc,
+                      "latitude": "-20.5", "depth": "%d" % (10 * iloc),
+                      "magnitude": "5.%d" % iloc, "sigmaMagnitude": "0.1",
+                      "Agency": "GEM", "magnitudeType": "Mw"}
+            rows.append(",".join([values.get(column, "")
+                                  for column in columns]))
+        with open(csv_file, "w") as fle:
+            fle.write("\n".join(rows) + "\n")
+        expected = GenericCataloguetoISFParser(csv_file).parse("A", "B")
+        self.assertEqual(expected.get_number_events(), 10)
+        for compression in get_compressions():
+            catalogue = GenericCataloguetoISFParser(
+                compress(csv_file, compression)).parse("A", "B")
+            self.assertTrue(same_tables(catalogue.get_origin_mag_tables(),
+                                        expected.get_origin_mag_tables()))
+
+    def test_open_catalogue_file(self):
+        for compression in get_compressions():
+            with open_catalogue_file(compress(self.isf_file,
+                                              compression)) as fle:
+                with open(self.isf_file, "rb") as expected:
+                    self.assertEqual(fle.read(), expected.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Tests of the longitude/latitude grid index
+
+Run from the root of the repository with: python -m unittest discover
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from matplotlib.path import Path
+from eqcat.spatial_index import SpatialGridIndex, INDEX_FILE_ERRORS
+
+
+class SpatialGridIndexTestCase(unittest.TestCase):
+    """
+    Tests the selections of the grid index against the selections from all
+    the points
+    """
+    CELL_SIZES = [1.0, 0.1, 0.3, 2.5]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # Points on a 0.1 degree grid, such that many lie on cell edges,
+        # and a point without coordinates
+        rng = np.random.RandomState(1)
+        self.lons = np.round(rng.uniform(-3., 3., 500), 1)
+        self.lats = np.round(rng.uniform(-2., 2., 500), 1)
+        self.lons[10] = np.nan
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _get_boxes(self):
+        """
+        Returns bounding boxes with edges on the grid of the points
+        """
+        edges = np.round(np.arange(-3.5, 3.6, 0.5), 1)
+        boxes = []
+        for llon in edges[::2]:
+            for ulon in edges[edges > llon][::3]:
+                for llat, ulat in [(-2.5, 2.5), (-1.0, 1.0), (0.1, 0.7),
+                                   (1.0, 1.0)]:
+                    boxes.append([llon, llat, ulon, ulat])
+        return boxes
+
+    def test_bounding_box(self):
+        for cell_size in self.CELL_SIZES:
+            index = SpatialGridIndex.build(self.lons, self.lats, cell_size)
+            for bounds in self._get_boxes():
+                with np.errstate(invalid="ignore"):
+                    expected = np.where((self.lons >= bounds[0]) &
+                                        (self.lons <= bounds[2]) &
+                                        (self.lats >= bounds[1]) &
+                                        (self.lats <= bounds[3]))[0]
+                self.assertTrue(np.array_equal(
+                    index.select_within_bounding_box(bounds), expected),
+                    "%s %s" % (cell_size, bounds))
+
+    def test_edge_point(self):
+        # A point on the western edge of a 0.1 degree cell, where
+        # 1.0 // 0.1 == 9.0 but np.floor(1.0 / 0.1) == 10.0
+        index = SpatialGridIndex.build([0.0, 1.0, 2.0], [0.0, 0.0, 0.0],
+                                       0.1)
+        self.assertEqual(list(index.select_within_bounding_box(
+            [1.0, -1.0, 2.0, 1.0])), [1, 2])
+        self.assertEqual(list(index.select_within_polygon(
+            [1.0, 1.5, 1.5, 1.0], [-1.0, -1.0, 1.0, 1.0])), [1])
+
+    def test_polygon(self):
+        polygons = [([-1.05, 1.05, 1.05, -1.05], [-1.05, -1.05, 1.05, 1.05]),
+                    ([-2.95, 0.05, 2.95], [-1.95, 1.95, -1.95]),
+                    ([5., 6., 6.], [5., 5., 6.])]
+        for cell_size in self.CELL_SIZES:
+            index = SpatialGridIndex.build(self.lons, self.lats, cell_size)
+            for poly_lons, poly_lats in polygons:
+                path = Path(np.column_stack([poly_lons, poly_lats]))
+                expected = np.where(path.contains_points(np.column_stack(
+                    [self.lons, self.lats])))[0]
+                self.assertTrue(np.array_equal(
+                    index.select_within_polygon(poly_lons, poly_lats),
+                    expected))
+
+    def test_missing_coordinates(self):
+        index = SpatialGridIndex.build(self.lons, self.lats)
+        self.assertEqual(index.number_rows, len(self.lons))
+        self.assertEqual(len(index.rows), len(self.lons) - 1)
+        self.assertFalse(10 in index.rows)
+        index = SpatialGridIndex.build([np.nan], [np.nan])
+        self.assertEqual(len(index.select_within_bounding_box(
+            [-180., -90., 180., 90.])), 0)
+
+    def test_save_load(self):
+        index_file = os.path.join(self.tmp_dir, "index.npz")
+        index = SpatialGridIndex.build(self.lons, self.lats, 0.3, "identity")
+        index.save(index_file)
+        output = SpatialGridIndex.load(index_file)
+        for key in ["cell_size", "west", "south", "nlon", "nlat",
+                    "number_rows", "identity"]:
+            self.assertEqual(getattr(output, key), getattr(index, key))
+        for key in ["offsets", "rows", "longitudes", "latitudes"]:
+            self.assertTrue(np.array_equal(getattr(output, key),
+                                           getattr(index, key)))
+
+    def test_damaged_file(self):
+        index_file = os.path.join(self.tmp_dir, "index.npz")
+        index = SpatialGridIndex.build(self.lons, self.lats, 0.3)
+        index.save(index_file)
+        with open(index_file, "rb") as fle:
+            content = fle.read()
+        # Truncated file and file that is not an index
+        for damaged in [content[:len(content) // 2], "not an index"]:
+            with open(index_file, "wb") as fle:
+                fle.write(damaged)
+            self.assertRaises(INDEX_FILE_ERRORS, SpatialGridIndex.load,
+                              index_file)
+        # Inconsistent arrays
+        index.offsets = index.offsets[:-1]
+        index.save(index_file)
+        self.assertRaises(INDEX_FILE_ERRORS, SpatialGridIndex.load,
+                          index_file)
+
+
+if __name__ == "__main__":
+    unittest.main()